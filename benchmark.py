@@ -0,0 +1,230 @@
+"""
+Benchmarks the hot paths of the SubscriptionManager against a synthetic entity hierarchy.
+
+The benchmark runs in a freshly created test database, SQLite by default, and writes its
+results as JSON so that they can be compared between releases.
+"""
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from optparse import OptionParser
+
+# Benchmark against SQLite unless another test DB is requested
+os.environ.setdefault('DB', 'sqlite')
+
+from settings import configure_settings
+
+
+# Configure the default settings
+configure_settings()
+
+# Django must be imported here since it depends on the settings being configured
+import django
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from entity.models import Entity, EntityRelationship
+
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+def build_hierarchy(depth, fanout, sources, mediums, unsubscribe_ratio, seed):
+    """
+    Creates a tree of entities, with a group subscription for the leaves of every top level entity.
+
+    The tree has a single root and `depth` levels below it, each entity having `fanout` sub entities.
+    Every entity is related to all of its ancestors, and each level has its own content type. A
+    `unsubscribe_ratio` fraction of the leaves is unsubscribed from each source and medium.
+    """
+    rng = random.Random(seed)
+    level_types = [
+        ContentType.objects.create(
+            name='level {0}'.format(level), app_label='benchmark', model='level{0}'.format(level)
+        )
+        for level in range(depth + 1)
+    ]
+
+    levels = [[Entity.objects.create(entity_id=0, entity_type=level_types[0])]]
+    ancestors = {levels[0][0].id: []}
+    for level in range(1, depth + 1):
+        Entity.objects.bulk_create([
+            Entity(entity_id=i, entity_type=level_types[level]) for i in range(len(levels[-1]) * fanout)
+        ])
+        entities = list(Entity.objects.filter(entity_type=level_types[level]).order_by('entity_id'))
+        for i, entity in enumerate(entities):
+            parent = levels[-1][i // fanout]
+            ancestors[entity.id] = ancestors[parent.id] + [parent.id]
+        levels.append(entities)
+
+    EntityRelationship.objects.bulk_create([
+        EntityRelationship(sub_entity_id=entity_id, super_entity_id=ancestor_id)
+        for entity_id, entity_ancestors in ancestors.items()
+        for ancestor_id in entity_ancestors
+    ])
+
+    source_objs = [Source.objects.create(name='source{0}'.format(i)) for i in range(sources)]
+    medium_objs = [Medium.objects.create(name='medium{0}'.format(i)) for i in range(mediums)]
+    group_entities = levels[1] if depth > 1 else levels[0]
+    leaves = levels[-1]
+    Subscription.objects.bulk_create([
+        Subscription(entity=entity, source=source, medium=medium, subentity_type=level_types[-1])
+        for entity in group_entities
+        for source in source_objs
+        for medium in medium_objs
+    ])
+    Unsubscribe.objects.bulk_create([
+        Unsubscribe(entity=entity, source=source, medium=medium)
+        for source in source_objs
+        for medium in medium_objs
+        for entity in leaves
+        if rng.random() < unsubscribe_ratio
+    ])
+
+    return {
+        'sources': source_objs,
+        'mediums': medium_objs,
+        'group_entities': group_entities,
+        'leaves': leaves,
+        'leaf_type': level_types[-1],
+    }
+
+
+def measure(func, iterations):
+    """
+    Calls func `iterations` times, returning its latency, query count and memory growth.
+
+    The query count is taken from a separate call, so that capturing the queries does not add
+    to the latency.
+    """
+    with CaptureQueriesContext(connection) as queries:
+        func(0)
+
+    max_rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies = []
+    for i in range(iterations):
+        start = time.time()
+        func(i)
+        latencies.append((time.time() - start) * 1000)
+    max_rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': sum(latencies) / len(latencies),
+        'p50_ms': latencies[len(latencies) // 2],
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'max_ms': latencies[-1],
+        'queries': len(queries),
+        # The peak resident set size of the process only grows, so this
+        # is the growth of that peak while the benchmark ran
+        'peak_memory_growth_kb': max_rss_after - max_rss_before,
+    }
+
+
+def run_benchmarks(data, iterations, audience_size, seed):
+    """
+    Returns the results of every benchmark, keyed by name.
+    """
+    rng = random.Random(seed)
+    sources, mediums, leaves = data['sources'], data['mediums'], data['leaves']
+    group_entities, leaf_type = data['group_entities'], data['leaf_type']
+
+    # Pick the arguments up front, so that choosing them is not measured
+    def pick(population):
+        return [rng.choice(population) for i in range(iterations)]
+    call_sources, call_mediums = pick(sources), pick(mediums)
+    call_leaves, call_groups = pick(leaves), pick(group_entities)
+    audience = rng.sample(leaves, min(audience_size, len(leaves)))
+
+    benchmarks = [
+        ('is_subscribed_individual', lambda i: Subscription.objects.is_subscribed(
+            call_sources[i], call_mediums[i], call_leaves[i]
+        )),
+        ('is_subscribed_group', lambda i: Subscription.objects.is_subscribed(
+            call_sources[i], call_mediums[i], call_groups[i], leaf_type
+        )),
+        ('mediums_subscribed_individual', lambda i: list(Subscription.objects.mediums_subscribed(
+            call_sources[i], call_leaves[i]
+        ))),
+        ('mediums_subscribed_group', lambda i: list(Subscription.objects.mediums_subscribed(
+            call_sources[i], call_groups[i], leaf_type
+        ))),
+        ('filter_not_subscribed', lambda i: list(Subscription.objects.filter_not_subscribed(
+            call_sources[i], call_mediums[i], audience
+        ))),
+    ]
+    return dict((name, measure(func, iterations)) for name, func in benchmarks)
+
+
+def main(options):
+    if 'south' in settings.INSTALLED_APPS:
+        from south.management.commands import patch_for_test_db_setup
+        patch_for_test_db_setup()
+
+    old_name = settings.DATABASES['default']['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        start = time.time()
+        data = build_hierarchy(
+            options.depth, options.fanout, options.sources, options.mediums, options.unsubscribe_ratio, options.seed
+        )
+        dataset = {
+            'entities': Entity.objects.count(),
+            'relationships': EntityRelationship.objects.count(),
+            'subscriptions': Subscription.objects.count(),
+            'unsubscribes': Unsubscribe.objects.count(),
+            'setup_seconds': time.time() - start,
+        }
+        results = run_benchmarks(data, options.iterations, options.audience_size, options.seed)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report = {
+        'config': {
+            'depth': options.depth,
+            'fanout': options.fanout,
+            'sources': options.sources,
+            'mediums': options.mediums,
+            'unsubscribe_ratio': options.unsubscribe_ratio,
+            'iterations': options.iterations,
+            'audience_size': options.audience_size,
+            'seed': options.seed,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'dataset': dataset,
+        'results': results,
+    }
+    return report
+
+
+if __name__ == '__main__':
+    parser = OptionParser(description=__doc__.strip())
+    parser.add_option('--depth', type=int, default=3, help='Levels of entities below the root.')
+    parser.add_option('--fanout', type=int, default=10, help='Sub entities of every entity.')
+    parser.add_option('--sources', type=int, default=5, help='Number of sources.')
+    parser.add_option('--mediums', type=int, default=3, help='Number of mediums.')
+    parser.add_option('--unsubscribe-ratio', type=float, default=0.1, dest='unsubscribe_ratio',
+                      help='Fraction of leaves unsubscribed from each source and medium.')
+    parser.add_option('--iterations', type=int, default=200, help='Calls made to each method.')
+    parser.add_option('--audience-size', type=int, default=500, dest='audience_size',
+                      help='Number of entities passed to filter_not_subscribed.')
+    parser.add_option('--seed', type=int, default=0, help='Seed for the random choices.')
+    parser.add_option('--output', help='Write the JSON results to this file rather than stdout.')
+    (options, args) = parser.parse_args()
+
+    report = main(options)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
@@ -1,8 +1,73 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import SEARCH_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
 
 from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
 
 
+def _estimated_row_count(queryset):
+    """Return the database's estimate of the number of rows in a queryset's table, or None.
+
+    Only PostgreSQL keeps an estimate, in `pg_class.reltuples`, which
+    is updated by `VACUUM` and `ANALYZE`.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    cursor = connection.cursor()
+    cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+    row = cursor.fetchone()
+    return int(row[0]) if row is not None else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """A paginator that estimates the size of large, unfiltered tables instead of counting them.
+
+    Counting every row of a table with millions of rows is slow on
+    PostgreSQL, and is done on every changelist page load. When the
+    queryset is not filtered and the table is estimated to hold at
+    least `estimate_threshold` rows, the estimate is used as the count.
+    Filtered querysets, smaller tables and other databases are counted
+    exactly.
+    """
+    estimate_threshold = 100000
+
+    def _get_count(self):
+        if self._count is None and not self.object_list.query.where:
+            estimate = _estimated_row_count(self.object_list)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                self._count = estimate
+        return super(EstimatedCountPaginator, self)._get_count()
+    count = property(_get_count)
+
+
+class EstimatedCountChangeList(ChangeList):
+    """A changelist that estimates the size of large tables instead of counting them when filtered.
+
+    When a filter or a search is applied, the changelist counts every
+    row of the table, besides the filtered ones, to show the total.
+    For tables estimated to hold at least the paginator's
+    `estimate_threshold` rows, the estimate is shown instead. The
+    filtered rows are still counted by the paginator.
+    """
+    def get_results(self, request):
+        if not (self.get_filters_params() or self.params.get(SEARCH_VAR)):
+            return super(EstimatedCountChangeList, self).get_results(request)
+        estimate = _estimated_row_count(self.root_queryset)
+        if estimate is None or estimate < EstimatedCountPaginator.estimate_threshold:
+            return super(EstimatedCountChangeList, self).get_results(request)
+
+        # An empty queryset is counted without a query
+        root_queryset = self.root_queryset
+        self.root_queryset = root_queryset.none()
+        try:
+            super(EstimatedCountChangeList, self).get_results(request)
+        finally:
+            self.root_queryset = root_queryset
+        self.full_result_count = estimate
+
+
 class MediumAdmin(admin.ModelAdmin):
     pass
 
@@ -13,10 +78,24 @@ class SourceAdmin(admin.ModelAdmin):
 
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('entity', 'source', 'medium')
+    list_select_related = ('entity', 'source', 'medium')
+    list_filter = ('source', 'medium')
+    raw_id_fields = ('entity',)
+    paginator = EstimatedCountPaginator
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
 
 
 class UnsubscribeAdmin(admin.ModelAdmin):
     list_display = ('entity', 'source', 'medium')
+    list_select_related = ('entity', 'source', 'medium')
+    list_filter = ('source', 'medium')
+    raw_id_fields = ('entity',)
+    paginator = EstimatedCountPaginator
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
 
 
 admin.site.register(Medium, MediumAdmin)
@@ -0,0 +1,389 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import get_cache
+from django.db.models.signals import post_delete, post_save
+from entity import EntityRelationship
+
+from entity_subscription.models import (
+    Medium, Source, Subscription, Unsubscribe, _closure_descendant_ids, _id, _registered, closure_enabled
+)
+from entity_subscription.routers import reads_primary
+from entity_subscription.signals import bulk_changed
+
+
+@reads_primary
+def _relationship_entity_ids(relationships):
+    """Return the ids of the entities whose individual checks depend on some relationships.
+
+    These are their sub-entities and, when the `EntityClosure` is
+    maintained, every entity below the sub-entities at any depth.
+    """
+    entity_ids = set(relationship.sub_entity_id for relationship in relationships)
+    if closure_enabled():
+        entity_ids.update(_closure_descendant_ids(entity_ids))
+    return entity_ids
+
+
+class BaseSubscriptionCache(object):
+    """A cache of subscription decisions in front of the `SubscriptionManager`.
+
+    Results of `is_subscribed` and `mediums_subscribed` are cached,
+    keyed on the source, medium, entity and subentity_type they were
+    called with. Subclasses decide where the results are stored and
+    how they are invalidated when a `Subscription`, `Unsubscribe` or
+    `EntityRelationship` is saved or deleted, or when subscriptions
+    and unsubscriptions, or relationships synced by django-entity, are
+    written in bulk.
+
+    Misses are computed from the primary database, as in a
+    `use_primary` block, since a value read from a lagging read
+    database just after a change would otherwise be cached, and
+    returned, long after the read database caught up.
+
+    The `hits` and `misses` attributes count cache lookups made
+    through this object.
+    """
+    def __init__(self, manager=None):
+        """Create a cache and start listening for changes.
+
+        Args:
+
+          manager - (Optional) The `SubscriptionManager` to cache.
+          Defaults to `Subscription.objects`.
+
+        """
+        self.manager = manager if manager is not None else Subscription.objects
+        self.hits = 0
+        self.misses = 0
+
+        post_save.connect(self._subscription_changed, sender=Subscription)
+        post_delete.connect(self._subscription_changed, sender=Subscription)
+        post_save.connect(self._unsubscribe_changed, sender=Unsubscribe)
+        post_delete.connect(self._unsubscribe_changed, sender=Unsubscribe)
+        post_save.connect(self._relationship_changed, sender=EntityRelationship)
+        post_delete.connect(self._relationship_changed, sender=EntityRelationship)
+        bulk_changed.connect(self._bulk_changed)
+
+    def is_subscribed(self, source, medium, entity, subentity_type=None):
+        """Return `SubscriptionManager.is_subscribed`, from the cache if possible.
+        """
+        source, medium = _registered(Source, source), _registered(Medium, medium)
+        key = ('is_subscribed', _id(source), _id(medium), _id(entity), _id(subentity_type))
+        return self._get_or_compute(
+            key, reads_primary(lambda: self.manager.is_subscribed(source, medium, entity, subentity_type))
+        )
+
+    def mediums_subscribed(self, source, entity, subentity_type=None):
+        """Return `SubscriptionManager.mediums_subscribed`, from the cache if possible.
+
+        The mediums are returned as a list, rather than a queryset,
+        so that they can be held in the cache.
+        """
+        source = _registered(Source, source)
+        key = ('mediums_subscribed', _id(source), None, _id(entity), _id(subentity_type))
+        return self._get_or_compute(
+            key, reads_primary(lambda: list(self.manager.mediums_subscribed(source, entity, subentity_type)))
+        )
+
+    def clear(self):
+        """Invalidate every entry in the cache.
+        """
+        raise NotImplementedError
+
+    def _get_or_compute(self, key, compute):
+        """Return the cached value for the key, computing and storing it on a miss.
+
+        The key is a tuple of the method name and the source, medium,
+        entity and subentity_type ids.
+        """
+        raise NotImplementedError
+
+    def _subscription_changed(self, sender, instance, created=True, **kwargs):
+        raise NotImplementedError
+
+    def _unsubscribe_changed(self, sender, instance, created=True, **kwargs):
+        raise NotImplementedError
+
+    def _relationship_changed(self, sender, instance, created=True, **kwargs):
+        raise NotImplementedError
+
+    def _bulk_changed(self, sender, rows, **kwargs):
+        raise NotImplementedError
+
+
+class SubscriptionCache(BaseSubscriptionCache):
+    """An in-process cache in front of the `SubscriptionManager`.
+
+    The least recently used entries are evicted once `max_size`
+    entries are held, and entries expire after `ttl` seconds.
+
+    Entries are invalidated as soon as a `Subscription`, `Unsubscribe`
+    or `EntityRelationship` that could change them is saved or
+    deleted. Only the affected entries are dropped:
+
+    - A subscription change drops every entry for its source.
+
+    - An unsubscribe change drops the individual entries for its
+      entity and source, or for every source if it has none. Group entries never take unsubscriptions
+      into account, so they are kept.
+
+    - A relationship change drops the individual entries for the
+      sub-entity, and for every entity below it when the
+      `EntityClosure` is maintained, and every group entry.
+
+    Rows written in bulk are handled together, in a single pass over
+    the entries.
+
+    The previous values of an edited row are not known once it has
+    been saved, so editing an existing row clears the whole cache.
+    """
+    def __init__(self, max_size=10000, ttl=300, manager=None):
+        """Create a cache and start listening for changes.
+
+        Args:
+
+          max_size - The maximum number of entries held before the
+          least recently used ones are evicted.
+
+          ttl - The number of seconds an entry is valid for, or None
+          for entries that only expire through invalidation.
+
+          manager - (Optional) The `SubscriptionManager` to cache.
+          Defaults to `Subscription.objects`.
+
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # Bumped on every invalidation, so that a value computed while
+        # an invalidation happened is not stored afterwards
+        self._generation = 0
+        super(SubscriptionCache, self).__init__(manager)
+
+    def clear(self):
+        """Remove every entry from the cache.
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_or_compute(self, key, compute):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and (entry[0] is None or entry[0] > now):
+                # Re-inserting the entry marks it as most recently used
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = compute()
+        expires_at = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[key] = (expires_at, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def _invalidate(self, predicate, created=True):
+        """Remove every entry whose key matches the predicate.
+
+        Everything is removed if an existing row was edited, since
+        entries matching its previous values may also be stale.
+        """
+        with self._lock:
+            self._generation += 1
+            if not created:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if predicate(*key)]:
+                del self._entries[key]
+
+    def _subscription_changed(self, sender, instance, created=True, **kwargs):
+        self._invalidate(lambda method, source_id, medium_id, entity_id, subentity_type_id: (
+            source_id == instance.source_id
+        ), created)
+
+    def _unsubscribe_changed(self, sender, instance, created=True, **kwargs):
+        self._invalidate(lambda method, source_id, medium_id, entity_id, subentity_type_id: (
+            subentity_type_id is None and
+            instance.source_id in (source_id, None) and
+            entity_id == instance.entity_id
+        ), created)
+
+    def _relationship_changed(self, sender, instance, created=True, **kwargs):
+        self._relationships_changed([instance], created)
+
+    def _relationships_changed(self, relationships, created=True):
+        entity_ids = _relationship_entity_ids(relationships)
+        self._invalidate(lambda method, source_id, medium_id, entity_id, subentity_type_id: (
+            subentity_type_id is not None or entity_id in entity_ids
+        ), created)
+
+    def _bulk_changed(self, sender, rows, **kwargs):
+        if sender is EntityRelationship:
+            self._relationships_changed(rows)
+        elif sender is Subscription:
+            source_ids = set(row.source_id for row in rows)
+            self._invalidate(lambda method, source_id, medium_id, entity_id, subentity_type_id: (
+                source_id in source_ids
+            ))
+        else:
+            source_entity_ids = set((row.source_id, row.entity_id) for row in rows)
+            self._invalidate(lambda method, source_id, medium_id, entity_id, subentity_type_id: (
+                subentity_type_id is None and (
+                    (source_id, entity_id) in source_entity_ids or (None, entity_id) in source_entity_ids
+                )
+            ))
+
+
+class SharedSubscriptionCache(BaseSubscriptionCache):
+    """A cache in front of the `SubscriptionManager` using Django's cache framework.
+
+    Entries are stored in one of the caches configured in the
+    `CACHES` setting, so that with a shared backend, such as
+    memcached, every process serving the application can use them.
+
+    Entries are never deleted. Instead, every key includes a set of
+    generation counters, and a change bumps the relevant counter so
+    that the entries built with its previous value are no longer
+    looked up:
+
+    - Every key includes the generation of its source, which is
+      bumped whenever a subscription for that source changes.
+
+    - Every key includes the generation of its entity, which is
+      bumped whenever an unsubscribe for that entity, or a
+      relationship with it as the sub-entity, or with one of its
+      super-entities as the sub-entity when the `EntityClosure` is
+      maintained, changes.
+
+    - Group keys include the generation of all relationships, which
+      is bumped whenever any relationship changes.
+
+    - Every key includes a global generation, which is bumped when an
+      existing row is edited, since its previous values are unknown,
+      and when the cache is cleared.
+
+    Stale entries are left to expire through the `timeout`, or to be
+    evicted by the cache backend.
+    """
+    def __init__(self, cache_name='default', timeout=300, key_prefix='entity_subscription', manager=None):
+        """Create a cache and start listening for changes.
+
+        Args:
+
+          cache_name - The alias of a cache in the `CACHES` setting,
+          or anything else accepted by `django.core.cache.get_cache`.
+
+          timeout - The number of seconds an entry is valid for, or
+          None for entries that only expire through invalidation.
+
+          key_prefix - A prefix for every key this object stores.
+
+          manager - (Optional) The `SubscriptionManager` to cache.
+          Defaults to `Subscription.objects`.
+
+        """
+        self.cache = get_cache(cache_name)
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        super(SharedSubscriptionCache, self).__init__(manager)
+
+    def clear(self):
+        """Invalidate every entry stored by caches with the same key prefix.
+        """
+        self._bump_generation(self._generation_key('all'))
+
+    def _generation_key(self, *parts):
+        return ':'.join([self.key_prefix, 'generation'] + [str(part) for part in parts])
+
+    def _initial_generation(self):
+        """Return a starting value for a missing generation counter.
+
+        Starting from the current time, rather than from zero, means
+        that a counter evicted by the backend does not bring back
+        entries stored under an earlier value.
+        """
+        return int(time.time() * 1000)
+
+    def _get_generations(self, generation_keys):
+        """Return the current value of each generation counter, in order.
+        """
+        generations = self.cache.get_many(generation_keys)
+        for generation_key in generation_keys:
+            if generation_key not in generations:
+                self.cache.add(generation_key, self._initial_generation(), None)
+                generations[generation_key] = self.cache.get(generation_key)
+        return [generations[generation_key] for generation_key in generation_keys]
+
+    def _bump_generation(self, generation_key):
+        try:
+            self.cache.incr(generation_key)
+        except ValueError:
+            # The counter is missing, so starting it again is enough
+            self.cache.add(generation_key, self._initial_generation(), None)
+
+    def _get_or_compute(self, key, compute):
+        method, source_id, medium_id, entity_id, subentity_type_id = key
+        generation_keys = [
+            self._generation_key('all'),
+            self._generation_key('source', source_id),
+            self._generation_key('entity', entity_id),
+        ]
+        if subentity_type_id is not None:
+            generation_keys.append(self._generation_key('relationships'))
+        generations = self._get_generations(generation_keys)
+        cache_key = ':'.join([self.key_prefix] + [str(part) for part in list(key) + generations])
+
+        # Wrap the value so that a cached False can be told apart from a miss
+        entry = self.cache.get(cache_key)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+
+        value = compute()
+        self.cache.set(cache_key, (value,), self.timeout)
+        return value
+
+    def _subscription_changed(self, sender, instance, created=True, **kwargs):
+        if not created:
+            self.clear()
+        self._bump_generation(self._generation_key('source', instance.source_id))
+
+    def _unsubscribe_changed(self, sender, instance, created=True, **kwargs):
+        if not created:
+            self.clear()
+        self._bump_generation(self._generation_key('entity', instance.entity_id))
+
+    def _relationship_changed(self, sender, instance, created=True, **kwargs):
+        if not created:
+            self.clear()
+        self._relationships_changed([instance])
+
+    def _relationships_changed(self, relationships):
+        for entity_id in _relationship_entity_ids(relationships):
+            self._bump_generation(self._generation_key('entity', entity_id))
+        self._bump_generation(self._generation_key('relationships'))
+
+    def _bulk_changed(self, sender, rows, **kwargs):
+        if sender is EntityRelationship:
+            self._relationships_changed(rows)
+            return
+        if sender is Subscription:
+            generation_keys = set(self._generation_key('source', row.source_id) for row in rows)
+        else:
+            generation_keys = set(self._generation_key('entity', row.entity_id) for row in rows)
+        for generation_key in generation_keys:
+            self._bump_generation(generation_key)
@@ -0,0 +1,105 @@
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.db import close_old_connections, connections
+from django.db.models.query import QuerySet
+
+from entity_subscription.models import Subscription, Unsubscribe
+
+
+def _close_connections(worker_connections):
+    """Close the database connections left open by worker threads that have stopped.
+    """
+    for connection in worker_connections:
+        # The thread that opened the connection is gone, so it can be
+        # closed from this one
+        connection.allow_thread_sharing = True
+        connection.close()
+
+
+class SubscriptionExecutor(object):
+    """Run subscription checks in a bounded pool of threads.
+
+    Each method submits a check to the pool and returns immediately
+    with a `multiprocessing.pool.AsyncResult`, whose `get` method
+    waits for, and returns, the result. Several checks can be in
+    flight at once, up to the number of threads in the pool, so that
+    a worker or event loop is not blocked on each query in turn.
+
+    Methods that return querysets on the managers return lists here,
+    since the queries are run in the worker thread.
+
+    Each thread keeps its database connection open from one check to
+    the next, whatever the `CONN_MAX_AGE` setting, so that checks do
+    not reconnect. A connection is released after a check that
+    failed, if it is no longer usable, and every connection is closed
+    by `shutdown`.
+    """
+    def __init__(self, max_workers=4, initializer=None, initargs=()):
+        """Create the pool of threads.
+
+        Args:
+
+          max_workers - The number of threads, and so the maximum
+          number of checks that run at the same time. Each thread
+          holds its own database connection.
+
+          initializer - (Optional) A callable run in each thread when
+          it starts, with `initargs` as its arguments.
+
+        """
+        self._pool = ThreadPool(max_workers, initializer, initargs)
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def is_subscribed(self, source, medium, entity, subentity_type=None):
+        """Submit `SubscriptionManager.is_subscribed`.
+        """
+        return self._submit(Subscription.objects.is_subscribed, source, medium, entity, subentity_type)
+
+    def mediums_subscribed(self, source, entity, subentity_type=None):
+        """Submit `SubscriptionManager.mediums_subscribed`, with a list of mediums as the result.
+        """
+        return self._submit(Subscription.objects.mediums_subscribed, source, entity, subentity_type)
+
+    def filter_not_subscribed(self, source, medium, entities):
+        """Submit `SubscriptionManager.filter_not_subscribed`, with a list of entities as the result.
+        """
+        return self._submit(Subscription.objects.filter_not_subscribed, source, medium, entities)
+
+    def is_unsubscribed(self, source, medium, entity):
+        """Submit `UnsubscribeManager.is_unsubscribed`.
+        """
+        return self._submit(Unsubscribe.objects.is_unsubscribed, source, medium, entity)
+
+    def shutdown(self):
+        """Wait for the submitted checks to finish, then stop the threads and close their connections.
+        """
+        self._pool.close()
+        self._pool.join()
+        worker_connections, self._connections = self._connections, set()
+        _close_connections(worker_connections)
+
+    def _submit(self, func, *args):
+        return self._pool.apply_async(self._run, (func,) + args)
+
+    def _run(self, func, *args):
+        """Call the function in a worker thread.
+
+        Querysets are evaluated inside the worker, so that no query is
+        left to run in the calling thread.
+        """
+        try:
+            result = func(*args)
+            if isinstance(result, QuerySet):
+                result = list(result)
+            return result
+        except Exception:
+            # A failed query may have left the connection unusable
+            close_old_connections()
+            raise
+        finally:
+            with self._connections_lock:
+                self._connections.update(
+                    connection for connection in connections.all() if connection.connection is not None
+                )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from entity_subscription.models import Unsubscribe
+
+
+class Command(BaseCommand):
+    """Replace per source and medium unsubscriptions with wildcard ones.
+    """
+    help = (
+        'Replace the unsubscriptions covering every source or every medium of an entity with wildcard ones. '
+        'Wildcard unsubscriptions also apply to sources and mediums added later.'
+    )
+
+    def handle(self, *args, **options):
+        removed = Unsubscribe.objects.collapse()
+        self.stdout.write('Removed {0} unsubscriptions.'.format(removed))
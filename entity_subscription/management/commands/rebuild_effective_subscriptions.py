@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from entity_subscription.models import EffectiveSubscription
+
+
+class Command(BaseCommand):
+    """Rebuild, or verify, the `EffectiveSubscription` table.
+    """
+    help = 'Rebuild the effective subscriptions table, or verify it with --verify.'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--verify', action='store_true', dest='verify', default=False,
+            help='Only check that the table is up to date, without changing it.'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            missing, extra = EffectiveSubscription.objects.verify()
+            if missing or extra:
+                msg = '{0} effective subscriptions are missing and {1} should not exist.'
+                raise CommandError(msg.format(len(missing), len(extra)))
+            self.stdout.write('Effective subscriptions are up to date.')
+        else:
+            EffectiveSubscription.objects.rebuild()
+            self.stdout.write('Effective subscriptions rebuilt.')
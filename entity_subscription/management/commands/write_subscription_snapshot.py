@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from entity_subscription.snapshot import write_snapshot_file
+
+
+class Command(BaseCommand):
+    """Write the effective subscriptions to a snapshot file.
+    """
+    args = '<path>'
+    help = 'Write the effective subscriptions to a snapshot file, replacing it atomically.'
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the path of the snapshot file to write.')
+        count = write_snapshot_file(args[0])
+        self.stdout.write('Wrote {0} subscriptions to {1}.'.format(count, args[0]))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Removing duplicate rows, keeping the oldest, so that the unique constraints can be added
+        for table, columns in (
+            (u'entity_subscription_subscription', 'entity_id, source_id, medium_id, subentity_type_id'),
+            (u'entity_subscription_unsubscribe', 'entity_id, source_id, medium_id'),
+        ):
+            db.execute(
+                'DELETE FROM {table} WHERE id NOT IN ('
+                'SELECT id FROM (SELECT MIN(id) AS id FROM {table} GROUP BY {columns}) AS keep'
+                ')'.format(table=table, columns=columns)
+            )
+
+        # Adding unique constraint on 'Subscription', fields ['entity', 'source', 'medium', 'subentity_type']
+        db.create_unique(u'entity_subscription_subscription', ['entity_id', 'source_id', 'medium_id', 'subentity_type_id'])
+
+        # Adding index on 'Subscription', fields ['source', 'medium', 'subentity_type', 'entity']
+        db.create_index(u'entity_subscription_subscription', ['source_id', 'medium_id', 'subentity_type_id', 'entity_id'])
+
+        # Adding unique constraint on 'Unsubscribe', fields ['entity', 'source', 'medium']
+        db.create_unique(u'entity_subscription_unsubscribe', ['entity_id', 'source_id', 'medium_id'])
+
+        # Adding index on 'Unsubscribe', fields ['source', 'medium', 'entity']
+        db.create_index(u'entity_subscription_unsubscribe', ['source_id', 'medium_id', 'entity_id'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Unsubscribe', fields ['source', 'medium', 'entity']
+        db.delete_index(u'entity_subscription_unsubscribe', ['source_id', 'medium_id', 'entity_id'])
+
+        # Removing unique constraint on 'Unsubscribe', fields ['entity', 'source', 'medium']
+        db.delete_unique(u'entity_subscription_unsubscribe', ['entity_id', 'source_id', 'medium_id'])
+
+        # Removing index on 'Subscription', fields ['source', 'medium', 'subentity_type', 'entity']
+        db.delete_index(u'entity_subscription_subscription', ['source_id', 'medium_id', 'subentity_type_id', 'entity_id'])
+
+        # Removing unique constraint on 'Subscription', fields ['entity', 'source', 'medium', 'subentity_type']
+        db.delete_unique(u'entity_subscription_subscription', ['entity_id', 'source_id', 'medium_id', 'subentity_type_id'])
+
+
+    models = {
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'entity.entity': {
+            'Meta': {'object_name': 'Entity'},
+            'entity_id': ('django.db.models.fields.IntegerField', [], {}),
+            'entity_meta': ('jsonfield.fields.JSONField', [], {'null': 'True'}),
+            'entity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'})
+        },
+        u'entity_subscription.effectivesubscription': {
+            'Meta': {'unique_together': "(('source', 'medium', 'entity'),)", 'object_name': 'EffectiveSubscription'},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"})
+        },
+        u'entity_subscription.medium': {
+            'Meta': {'object_name': 'Medium'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'display_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        u'entity_subscription.source': {
+            'Meta': {'object_name': 'Source'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'display_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        u'entity_subscription.subscription': {
+            'Meta': {'unique_together': "(('entity', 'source', 'medium', 'subentity_type'),)", 'object_name': 'Subscription', 'index_together': "[('source', 'medium', 'subentity_type', 'entity')]"},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"}),
+            'subentity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']", 'null': 'True'})
+        },
+        u'entity_subscription.unsubscribe': {
+            'Meta': {'unique_together': "(('entity', 'source', 'medium'),)", 'object_name': 'Unsubscribe', 'index_together': "[('source', 'medium', 'entity')]"},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"})
+        }
+    }
+
+    complete_apps = ['entity_subscription']
\ No newline at end of file
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'EntityClosure'
+        db.create_table(u'entity_subscription_entityclosure', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('super_entity', self.gf('django.db.models.fields.related.ForeignKey')(related_name='sub_closure', to=orm['entity.Entity'])),
+            ('sub_entity', self.gf('django.db.models.fields.related.ForeignKey')(related_name='super_closure', to=orm['entity.Entity'])),
+            ('sub_entity_type', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['contenttypes.ContentType'])),
+        ))
+        db.send_create_signal(u'entity_subscription', ['EntityClosure'])
+
+        # Adding unique constraint on 'EntityClosure', fields ['sub_entity', 'super_entity']
+        db.create_unique(u'entity_subscription_entityclosure', ['sub_entity_id', 'super_entity_id'])
+
+        # Adding index on 'EntityClosure', fields ['super_entity', 'sub_entity_type', 'sub_entity']
+        db.create_index(u'entity_subscription_entityclosure', ['super_entity_id', 'sub_entity_type_id', 'sub_entity_id'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'EntityClosure', fields ['super_entity', 'sub_entity_type', 'sub_entity']
+        db.delete_index(u'entity_subscription_entityclosure', ['super_entity_id', 'sub_entity_type_id', 'sub_entity_id'])
+
+        # Removing unique constraint on 'EntityClosure', fields ['sub_entity', 'super_entity']
+        db.delete_unique(u'entity_subscription_entityclosure', ['sub_entity_id', 'super_entity_id'])
+
+        # Deleting model 'EntityClosure'
+        db.delete_table(u'entity_subscription_entityclosure')
+
+
+    models = {
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'entity.entity': {
+            'Meta': {'object_name': 'Entity'},
+            'entity_id': ('django.db.models.fields.IntegerField', [], {}),
+            'entity_meta': ('jsonfield.fields.JSONField', [], {'null': 'True'}),
+            'entity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'})
+        },
+        u'entity_subscription.effectivesubscription': {
+            'Meta': {'unique_together': "(('source', 'medium', 'entity'),)", 'object_name': 'EffectiveSubscription'},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"})
+        },
+        u'entity_subscription.entityclosure': {
+            'Meta': {'unique_together': "(('sub_entity', 'super_entity'),)", 'object_name': 'EntityClosure', 'index_together': "[('super_entity', 'sub_entity_type', 'sub_entity')]"},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'sub_entity': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'super_closure'", 'to': u"orm['entity.Entity']"}),
+            'sub_entity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            'super_entity': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'sub_closure'", 'to': u"orm['entity.Entity']"})
+        },
+        u'entity_subscription.medium': {
+            'Meta': {'object_name': 'Medium'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'display_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        u'entity_subscription.source': {
+            'Meta': {'object_name': 'Source'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'display_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        u'entity_subscription.subscription': {
+            'Meta': {'unique_together': "(('entity', 'source', 'medium', 'subentity_type'),)", 'object_name': 'Subscription', 'index_together': "[('source', 'medium', 'subentity_type', 'entity')]"},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"}),
+            'subentity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']", 'null': 'True'})
+        },
+        u'entity_subscription.unsubscribe': {
+            'Meta': {'unique_together': "(('entity', 'source', 'medium'),)", 'object_name': 'Unsubscribe', 'index_together': "[('source', 'medium', 'entity')]"},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"})
+        }
+    }
+
+    complete_apps = ['entity_subscription']
\ No newline at end of file
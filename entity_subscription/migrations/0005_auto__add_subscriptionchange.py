@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'SubscriptionChange'
+        db.create_table(u'entity_subscription_subscriptionchange', (
+            ('sequence', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('kind', self.gf('django.db.models.fields.CharField')(max_length=16)),
+            ('deleted', self.gf('django.db.models.fields.BooleanField')(default=False)),
+            ('row_id', self.gf('django.db.models.fields.IntegerField')(null=True)),
+            ('entity_id', self.gf('django.db.models.fields.IntegerField')()),
+            ('source_id', self.gf('django.db.models.fields.IntegerField')(null=True)),
+            ('medium_id', self.gf('django.db.models.fields.IntegerField')(null=True)),
+            ('subentity_type_id', self.gf('django.db.models.fields.IntegerField')(null=True)),
+            ('super_entity_id', self.gf('django.db.models.fields.IntegerField')(null=True)),
+        ))
+        db.send_create_signal(u'entity_subscription', ['SubscriptionChange'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'SubscriptionChange'
+        db.delete_table(u'entity_subscription_subscriptionchange')
+
+
+    models = {
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'entity.entity': {
+            'Meta': {'object_name': 'Entity'},
+            'entity_id': ('django.db.models.fields.IntegerField', [], {}),
+            'entity_meta': ('jsonfield.fields.JSONField', [], {'null': 'True'}),
+            'entity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'})
+        },
+        u'entity_subscription.effectivesubscription': {
+            'Meta': {'unique_together': "(('source', 'medium', 'entity'),)", 'object_name': 'EffectiveSubscription'},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"})
+        },
+        u'entity_subscription.entityclosure': {
+            'Meta': {'unique_together': "(('sub_entity', 'super_entity'),)", 'object_name': 'EntityClosure', 'index_together': "[('super_entity', 'sub_entity_type', 'sub_entity')]"},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'sub_entity': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'super_closure'", 'to': u"orm['entity.Entity']"}),
+            'sub_entity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            'super_entity': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'sub_closure'", 'to': u"orm['entity.Entity']"})
+        },
+        u'entity_subscription.medium': {
+            'Meta': {'object_name': 'Medium'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'display_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        u'entity_subscription.source': {
+            'Meta': {'object_name': 'Source'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'display_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        u'entity_subscription.subscription': {
+            'Meta': {'unique_together': "(('entity', 'source', 'medium', 'subentity_type'),)", 'object_name': 'Subscription', 'index_together': "[('source', 'medium', 'subentity_type', 'entity')]"},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"}),
+            'subentity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']", 'null': 'True'})
+        },
+        u'entity_subscription.subscriptionchange': {
+            'Meta': {'object_name': 'SubscriptionChange'},
+            'deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'entity_id': ('django.db.models.fields.IntegerField', [], {}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '16'}),
+            'medium_id': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'row_id': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'sequence': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'source_id': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'subentity_type_id': ('django.db.models.fields.IntegerField', [], {'null': 'True'}),
+            'super_entity_id': ('django.db.models.fields.IntegerField', [], {'null': 'True'})
+        },
+        u'entity_subscription.unsubscribe': {
+            'Meta': {'unique_together': "(('entity', 'source', 'medium'),)", 'object_name': 'Unsubscribe', 'index_together': "[('source', 'medium', 'entity')]"},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']"}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']"})
+        }
+    }
+
+    complete_apps = ['entity_subscription']
\ No newline at end of file
@@ -1,24 +1,193 @@
+from datetime import timedelta
+from itertools import islice
+from operator import or_
+
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import six, timezone
 from entity import Entity, EntityRelationship
 
+from entity_subscription.routers import reads_primary
+from entity_subscription.signals import bulk_changed, instrumented
+
+
+def _batches(iterable, batch_size):
+    """Yield lists of up to `batch_size` items from an iterable.
+    """
+    iterator = iter(iterable)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
+
+
+@reads_primary
+def _bulk_create_missing(manager, rows, fields, batch_size):
+    """Create the rows that are not already stored, in batches, and return them.
+
+    Rows are compared on the given foreign key fields. Rows already in
+    the table, and repeated rows, are skipped, so that no unique
+    constraint is violated.
+    """
+    created = []
+    seen = set()
+    for batch in _batches(rows, batch_size):
+        keys = [tuple(getattr(row, field + '_id') for field in fields) for row in batch]
+        # Null values never match an IN clause, so those fields are
+        # only compared once the rows are fetched
+        conditions = {}
+        for field, values in zip(fields, zip(*keys)):
+            if None not in values:
+                conditions[field + '__in'] = set(values)
+        seen.update(manager.filter(**conditions).values_list(*fields))
+
+        new_rows = []
+        for key, row in zip(keys, batch):
+            if key not in seen:
+                seen.add(key)
+                new_rows.append(row)
+        manager.bulk_create(new_rows)
+        created.extend(new_rows)
+    return created
+
+
+@reads_primary
+def _bulk_delete_matching(manager, rows, batch_size):
+    """Delete the stored rows with the entity, source and medium of the given rows, in batches, and return them.
+
+    Each batch is fetched with one query and deleted with another,
+    without sending a signal for each row.
+    """
+    deleted = []
+    for batch in _batches(rows, batch_size):
+        entity_ids_by_key = {}
+        for row in batch:
+            entity_ids_by_key.setdefault((row.source_id, row.medium_id), set()).add(row.entity_id)
+        matching = list(manager.filter(reduce(or_, [
+            Q(source=source_id, medium=medium_id, entity__in=entity_ids)
+            for (source_id, medium_id), entity_ids in entity_ids_by_key.items()
+        ])))
+        # Nothing refers to these rows, so they can be deleted directly
+        manager.filter(pk__in=[row.pk for row in matching])._raw_delete(manager.db)
+        deleted.extend(matching)
+    return deleted
+
+
+def _id(obj):
+    """Return the id of a model object, or the id itself.
+    """
+    return getattr(obj, 'pk', obj)
+
+
+def _entity_type_ids(entity):
+    """Return the id of an entity's type, as a list or as a subquery.
+
+    The type of an `Entity` object is known, while that of an entity
+    id is resolved by the database, within the query using it.
+    """
+    if isinstance(entity, Entity):
+        return [entity.entity_type_id]
+    return Entity.objects.filter(id=entity).values('entity_type')
+
+
+def _registered(model, obj):
+    """Return the `Medium` or `Source` registered under a name, or the object itself.
+    """
+    if isinstance(obj, six.string_types):
+        return model.objects.get_by_name(obj)
+    return obj
+
+
+def _entity_links():
+    """Return the model linking super-entities to their sub-entities, with the lookups used to query it.
+
+    When the `EntityClosure` is maintained, its rows link entities at
+    any depth and are used in place of the `EntityRelationship` rows,
+    so that every method agrees with `SubscriptionManager.is_subscribed`.
+
+    Returns:
+
+      A tuple of the model, the lookup of the sub-entity's type on it,
+      and the related name of the rows with an entity as the
+      sub-entity.
+
+    """
+    if closure_enabled():
+        return EntityClosure, 'sub_entity_type', 'super_closure'
+    return EntityRelationship, 'sub_entity__entity_type', 'super_relationships'
+
+
+def _unsubscribes_for(field, value, lookup='exact'):
+    """Return the condition on an `Unsubscribe` source or medium matching a value, or every value.
+
+    An unsubscription with a null source or medium applies to all of
+    them, so it matches whatever value is looked up.
+    """
+    return Q(**{'{0}__{1}'.format(field, lookup): value}) | Q(**{'{0}__isnull'.format(field): True})
+
+
+def _is_unsubscribed_from(unsubscribed, source_id, medium_id, entity_id):
+    """Return True if a set of (source id, medium id, entity id) unsubscriptions covers a triple.
+
+    The set may hold None for the source or medium of wildcard
+    unsubscriptions.
+    """
+    return any(
+        (unsubscribed_source_id, unsubscribed_medium_id, entity_id) in unsubscribed
+        for unsubscribed_source_id in (source_id, None)
+        for unsubscribed_medium_id in (medium_id, None)
+    )
+
+
+def _collapsed_unsubscribe_pairs(pairs, source_ids, medium_ids):
+    """Return the smallest set of (source id, medium id) pairs, with None wildcards, covering the same pairs.
+    """
+    covered = set(
+        (covered_source_id, covered_medium_id)
+        for source_id, medium_id in pairs
+        for covered_source_id in (source_ids if source_id is None else [source_id])
+        for covered_medium_id in (medium_ids if medium_id is None else [medium_id])
+    )
+    if all((source_id, medium_id) in covered for source_id in source_ids for medium_id in medium_ids):
+        return set([(None, None)])
+    full_source_ids = set(
+        source_id for source_id in source_ids
+        if all((source_id, medium_id) in covered for medium_id in medium_ids)
+    )
+    full_medium_ids = set(
+        medium_id for medium_id in medium_ids
+        if all((source_id, medium_id) in covered for source_id in source_ids)
+    )
+    collapsed = set((source_id, None) for source_id in full_source_ids)
+    collapsed.update((None, medium_id) for medium_id in full_medium_ids)
+    collapsed.update(
+        (source_id, medium_id) for source_id, medium_id in covered
+        if source_id not in full_source_ids and medium_id not in full_medium_ids
+    )
+    return collapsed
+
 
 class SubscriptionManager(models.Manager):
+    @instrumented
     def mediums_subscribed(self, source, entity, subentity_type=None):
         """Return all mediums subscribed to for a source.
 
         Args:
 
-          source - A `Source` object. Check the mediums subscribed to,
-          for this source of notifications.
+          source - A `Source` object, its id, or its name. Check the
+          mediums subscribed to, for this source of notifications.
 
-          entity - An `Entity` object. The entity to check
+          entity - An `Entity` object, or its id. The entity to check
           subscriptions for.
 
-          subentity_type - (Optional) A content_type indicating we're
-          interested in the mediums subscribed to by all sub-entities
-          of the `entity` argument matching this subentity_type.
+          subentity_type - (Optional) A content_type, or its id,
+          indicating we're interested in the mediums subscribed to by
+          all sub-entities of the `entity` argument matching this
+          subentity_type.
 
         Returns:
 
@@ -32,28 +201,31 @@ class SubscriptionManager(models.Manager):
            to, *without* any unsubscribed mediums filtered out.
 
         """
+        source = _registered(Source, source)
         if subentity_type is None:
             return self._mediums_subscribed_individual(source, entity)
         else:
             return self._mediums_subscribed_group(source, entity, subentity_type)
 
+    @instrumented
     def is_subscribed(self, source, medium, entity, subentity_type=None):
         """Return True if subscribed to this medium/source combination.
 
         Args:
 
-          source - A `Source` object. Check that there is a
-          subscription for this source and the given medium.
+          source - A `Source` object, its id, or its name. Check that
+          there is a subscription for this source and the given medium.
 
-          medium - A `Medium` object. Check that there is a
-          subscription for this medium and the given source
+          medium - A `Medium` object, its id, or its name. Check that
+          there is a subscription for this medium and the given source
 
-          entity - An `Entity` object. The entity to check
+          entity - An `Entity` object, or its id. The entity to check
           subscriptions for.
 
-          subentity_type - (Optional) A content_type indicating we're
-          interested in the subscriptions by all sub-entities of the
-          `entity` argument matching this subentity_type.
+          subentity_type - (Optional) A content_type, or its id,
+          indicating we're interested in the subscriptions by all
+          sub-entities of the `entity` argument matching this
+          subentity_type.
 
         Returns:
 
@@ -69,125 +241,477 @@ class SubscriptionManager(models.Manager):
            filtered out.
 
         """
+        source, medium = _registered(Source, source), _registered(Medium, medium)
         if subentity_type is None:
             return self._is_subscribed_individual(source, medium, entity)
         else:
             return self._is_subscribed_group(source, medium, entity, subentity_type)
 
+    @instrumented
     def filter_not_subscribed(self, source, medium, entities):
         """Return only the entities subscribed to the source and medium.
 
         Args:
 
-          source - A `Source` object. Check that there is a
-          subscription for this source and the given medium.
+          source - A `Source` object, its id, or its name. Check that
+          there is a subscription for this source and the given medium.
+
+          medium - A `Medium` object, its id, or its name. Check that
+          there is a subscription for this medium and the given source
+
+          entities - An iterable of `Entity` objects, or of their ids.
+          The iterable will be filtered down to only those with a
+          subscription to the source and medium. The entities may be of
+          any mix of types.
+
+        Returns:
+
+          A queryset of entities which are in the initially provided
+          list and are subscribed to the source and medium. The group
+          subscriptions of every entity type are resolved together, by
+          matching each group subscription's `subentity_type` against
+          the type of the sub-entity, so a single query is made
+          whatever the mix of types.
+
+        """
+        source, medium = _registered(Source, source), _registered(Medium, medium)
+        return self._filter_subscribed_entities(
+            source, medium, Entity.objects.filter(id__in=[_id(e) for e in entities])
+        )
+
+    @instrumented
+    def filter_not_subscribed_mediums(self, source, mediums, entities):
+        """Return the entities subscribed to the source, for each medium.
+
+        Args:
+
+          source - A `Source` object, its id, or its name. Check that
+          there is a subscription for this source and each of the given
+          mediums.
+
+          mediums - An iterable of `Medium` objects, their ids, or their
+          names. The entities are filtered separately for each of these
+          mediums.
 
-          medium - A `Medium` object. Check that there is a
-          subscription for this medium and the given source
+          entities - An iterable of `Entity` objects, or of their ids.
+          The iterable will be filtered down to only those with a
+          subscription to the source and each medium.
 
-          entities - An iterable of `Entity` objects. The iterable
-          will be filtered down to only those with a subscription to
-          the source and medium. All entities in this iterable must be
-          of the same type.
+        Returns:
+
+          A dictionary mapping each of the provided mediums, with
+          names replaced by `Medium` objects, to the set of ids of the
+          provided entities that are subscribed to the source and that
+          medium. The group subscriptions, individual subscriptions
+          and unsubscriptions are each fetched in one query for all
+          the mediums together.
 
-        Raises:
+        """
+        source = _registered(Source, source)
+        mediums = [_registered(Medium, medium) for medium in mediums]
+        subscribed = self._subscribed_pairs(source, [_id(m) for m in mediums], [_id(e) for e in entities])
 
-          ValueError - if not all entities provided are of the same
-          type.
+        subscribed_by_medium = dict((_id(m), set()) for m in mediums)
+        for medium_id, entity_id in subscribed:
+            subscribed_by_medium[medium_id].add(entity_id)
+        return dict((m, subscribed_by_medium[_id(m)]) for m in mediums)
+
+    @instrumented
+    def subscription_matrix(self, entities):
+        """Return every source and medium each entity is subscribed to.
+
+        Args:
+
+          entities - An iterable of `Entity` objects, or of their ids,
+          of any mix of types.
 
         Returns:
 
-          A queryset of entities which are in the initially provided
-          list and are subscribed to the source and medium.
+          A dictionary mapping the id of each provided entity to a
+          dictionary of the source ids it is subscribed to, each
+          mapped to the set of medium ids it is subscribed to for that
+          source. Entities with no subscriptions map to an empty
+          dictionary.
+
+          As with `mediums_subscribed`, group subscriptions of the
+          entities' super-entities are taken into account and
+          unsubscribed mediums are left out. The group subscriptions,
+          individual subscriptions and unsubscriptions are each
+          fetched in one query, whatever the number of entities,
+          sources and mediums.
+
+        """
+        entity_ids = [_id(e) for e in entities]
+        matrix = dict((entity_id, {}) for entity_id in entity_ids)
+        for source_id, medium_id, entity_id in self._subscribed_triples(entity_ids=entity_ids):
+            matrix[entity_id].setdefault(source_id, set()).add(medium_id)
+        return matrix
+
+    @instrumented
+    def is_subscribed_many(self, checks):
+        """Return whether each of many source, medium and entity combinations is subscribed.
+
+        Args:
+
+          checks - An iterable of `(source, medium, entity)` or
+          `(source, medium, entity, subentity_type)` tuples, taking
+          the same values as the arguments of `is_subscribed`. The
+          tuples may mix sources, mediums, entities and
+          subentity_types freely.
+
+        Returns:
+
+          A list of booleans, in the same order as the checks, each
+          the result `is_subscribed` would return for that check.
+
+          The checks without a subentity_type are answered with three
+          queries, and those with a subentity_type with a single
+          query, whatever the number of checks.
+
+        """
+        checks = [
+            (_registered(Source, check[0]), _registered(Medium, check[1])) + tuple(check[2:])
+            + (None,) * (4 - len(check))
+            for check in checks
+        ]
+        individual_checks = [check for check in checks if check[3] is None]
+        group_checks = [check for check in checks if check[3] is not None]
+
+        subscribed = set()
+        if individual_checks:
+            sources, mediums, entities, subentity_types = zip(*individual_checks)
+            subscribed |= set(
+                (source_id, medium_id, entity_id, None)
+                for source_id, medium_id, entity_id in self._subscribed_triples(
+                    medium_ids=set(_id(medium) for medium in mediums),
+                    entity_ids=set(_id(entity) for entity in entities),
+                )
+            )
+        if group_checks:
+            subscribed |= self._group_subscribed_quadruples(group_checks)
+
+        return [
+            tuple(_id(obj) for obj in check) in subscribed
+            for check in checks
+        ]
+
+    def _group_subscribed_quadruples(self, group_checks):
+        """Return the subscribed (source id, medium id, entity id, subentity_type id) group combinations.
+
+        A group is subscribed when any of its sub-entities of the
+        subentity_type has a super-entity with a group subscription
+        for that subentity_type, as in `_is_subscribed_group`. Every
+        group is resolved in a single query.
+        """
+        source_ids, medium_ids, entity_ids, subentity_type_ids = [
+            set(_id(obj) for obj in column) for column in zip(*group_checks)
+        ]
+        links, sub_entity_type, super_links = _entity_links()
+        subscription = 'sub_entity__{0}__super_entity__subscription__'.format(super_links)
+        # The subscription conditions must be given to a single filter
+        # call, so that they all apply to the same subscription row
+        group_subscribed = links.objects.filter(**{
+            'super_entity__in': entity_ids,
+            sub_entity_type + '__in': subentity_type_ids,
+            subscription + 'source__in': source_ids,
+            subscription + 'medium__in': medium_ids,
+            subscription + 'subentity_type': F(sub_entity_type),
+        }).values_list(
+            subscription + 'source', subscription + 'medium', 'super_entity', sub_entity_type
+        ).distinct()
+        return set(group_subscribed)
+
+    @instrumented
+    def bulk_subscribe(self, subscriptions, batch_size=500):
+        """Create many subscriptions at once, skipping those that already exist.
+
+        Args:
+
+          subscriptions - An iterable of unsaved `Subscription`
+          objects. Subscriptions with the same entity, source, medium
+          and subentity_type as a stored one, or as an earlier one in
+          the iterable, are skipped.
+
+          batch_size - The number of subscriptions checked and created
+          with each pair of queries.
+          The default keeps the ids in each query within SQLite's
+          limit of 999 parameters.
+
+        Returns:
+
+          The list of subscriptions that were created. As with
+          `bulk_create`, their primary keys may not be set.
+
+          A single `entity_subscription.signals.bulk_changed` signal
+          is sent for all the created subscriptions, rather than a
+          `post_save` signal for each one.
+
+        """
+        created = _bulk_create_missing(
+            self, subscriptions, ('entity', 'source', 'medium', 'subentity_type'), batch_size
+        )
+        if created:
+            bulk_changed.send(sender=self.model, rows=created, created=True)
+        return created
 
+    def _subscribed_pairs(self, source, medium_ids=None, entity_ids=None):
+        """Return the set of subscribed (medium id, entity id) pairs for a source.
         """
-        entity_type_id = entities[0].entity_type_id
-        if not all(e.entity_type_id == entity_type_id for e in entities):
-            msg = 'All entities provided must be of the same type.'
-            raise ValueError(msg)
+        return set(
+            (medium_id, entity_id)
+            for source_id, medium_id, entity_id in self._subscribed_triples(source, medium_ids, entity_ids)
+        )
 
-        group_subs = self.filter(source=source, medium=medium, subentity_type_id=entity_type_id)
-        group_subscribed_entities = EntityRelationship.objects.filter(
-            sub_entity__in=entities, super_entity__in=group_subs.values('entity')
-        ).values_list('sub_entity', flat=True)
+    def _subscribed_triples(self, source=None, medium_ids=None, entity_ids=None):
+        """Return the set of subscribed (source id, medium id, entity id) triples.
 
+        The triples can be limited to a source, some mediums and some
+        entities, and are computed with three queries.
+        """
+        links, sub_entity_type, super_links = _entity_links()
+        # The subscription conditions must be given to a single filter
+        # call, so that they all apply to the same subscription row
+        group_conditions = {
+            'super_entity__subscription__subentity_type': F(sub_entity_type),
+        }
+        individual_subscribed = self.filter(subentity_type=None)
+        relevant_unsubscribes = Unsubscribe.objects.all()
+
+        if source is not None:
+            group_conditions['super_entity__subscription__source'] = source
+            individual_subscribed = individual_subscribed.filter(source=source)
+            relevant_unsubscribes = relevant_unsubscribes.filter(_unsubscribes_for('source', source))
+        if medium_ids is not None:
+            group_conditions['super_entity__subscription__medium__in'] = medium_ids
+            individual_subscribed = individual_subscribed.filter(medium__in=medium_ids)
+            relevant_unsubscribes = relevant_unsubscribes.filter(_unsubscribes_for('medium', medium_ids, 'in'))
+        if entity_ids is not None:
+            group_conditions['sub_entity__in'] = entity_ids
+            individual_subscribed = individual_subscribed.filter(entity__in=entity_ids)
+            relevant_unsubscribes = relevant_unsubscribes.filter(entity__in=entity_ids)
+
+        group_subscribed = links.objects.filter(**group_conditions)
+        subscribed = set(group_subscribed.values_list(
+            'super_entity__subscription__source', 'super_entity__subscription__medium', 'sub_entity'
+        ))
+        subscribed |= set(individual_subscribed.values_list('source', 'medium', 'entity'))
+        unsubscribed = set(relevant_unsubscribes.values_list('source', 'medium', 'entity'))
+        return set(triple for triple in subscribed if not _is_unsubscribed_from(unsubscribed, *triple))
+
+    @instrumented
+    def subscribed_entity_ids(self, source, medium, super_entities=None):
+        """Return the ids of every entity subscribed to the source and medium.
+
+        Args:
+
+          source - A `Source` object, its id, or its name. Check that
+          there is a subscription for this source and the given medium.
+
+          medium - A `Medium` object, its id, or its name. Check that
+          there is a subscription for this medium and the given source
+
+          super_entities - (Optional) An iterable or queryset of
+          `Entity` objects, or of their ids. If given, only the
+          sub-entities of these super-entities are considered, at any
+          depth when the `EntityClosure` is maintained.
+
+        Returns:
+
+          A flat `values_list` queryset of entity ids. Group
+          subscriptions are expanded through the entity relationships
+          and unsubscribed entities are excluded, all within a single
+          query. Call `iterator()` on the result to stream the ids
+          without caching them on the queryset.
+
+        """
+        source, medium = _registered(Source, source), _registered(Medium, medium)
+        entities = Entity.objects.all()
+        if super_entities is not None:
+            links = _entity_links()[0]
+            entities = entities.filter(id__in=links.objects.filter(
+                super_entity__in=super_entities
+            ).values('sub_entity'))
+        return self._filter_subscribed_entities(source, medium, entities).values_list('id', flat=True)
+
+    @instrumented
+    def iter_subscribed_entity_ids(self, source, medium, entity_ids=None, chunk_size=500):
+        """Yield the ids of the entities subscribed to the source and medium, in chunks.
+
+        Args:
+
+          source - A `Source` object, its id, or its name. Check that
+          there is a subscription for this source and the given medium.
+
+          medium - A `Medium` object, its id, or its name. Check that
+          there is a subscription for this medium and the given source
+
+          entity_ids - (Optional) The candidate entities. Either a
+          queryset, of entities or of entity ids, or any other
+          iterable of entity ids, such as a generator. If not given,
+          every entity is a candidate.
+
+          chunk_size - The number of ids in each chunk, and the
+          maximum number of candidate ids sent in a single query.
+
+        Returns:
+
+          A generator of lists of entity ids. Every list but the last
+          holds exactly `chunk_size` ids.
+
+          When the candidates are a queryset, or not given, the
+          subscribed ids are paged through in ascending order, using
+          the last id of each page as the starting point of the next,
+          so the candidates are never loaded into memory. Any other
+          iterable is consumed `chunk_size` ids at a time, and the ids
+          are yielded in the order their chunks were consumed.
+
+        """
+        source, medium = _registered(Source, source), _registered(Medium, medium)
+        if entity_ids is None or isinstance(entity_ids, QuerySet):
+            pages = self._iter_subscribed_pages(source, medium, entity_ids, chunk_size)
+        else:
+            pages = self._iter_subscribed_candidate_chunks(source, medium, iter(entity_ids), chunk_size)
+
+        chunk = []
+        for page in pages:
+            chunk.extend(page)
+            while len(chunk) >= chunk_size:
+                yield chunk[:chunk_size]
+                chunk = chunk[chunk_size:]
+        if chunk:
+            yield chunk
+
+    def _iter_subscribed_pages(self, source, medium, entity_ids, chunk_size):
+        """Page through the subscribed entities of a candidate queryset, by ascending id.
+        """
+        entities = Entity.objects.all()
+        if entity_ids is not None:
+            entities = entities.filter(id__in=entity_ids)
+        subscribed_entity_ids = self._filter_subscribed_entities(
+            source, medium, entities
+        ).order_by('id').values_list('id', flat=True)
+
+        page = list(subscribed_entity_ids[:chunk_size])
+        while page:
+            yield page
+            if len(page) < chunk_size:
+                break
+            page = list(subscribed_entity_ids.filter(id__gt=page[-1])[:chunk_size])
+
+    def _iter_subscribed_candidate_chunks(self, source, medium, entity_ids, chunk_size):
+        """Filter an iterator of candidate entity ids, a chunk at a time.
+        """
+        candidates = list(islice(entity_ids, chunk_size))
+        while candidates:
+            yield self._filter_subscribed_entities(
+                source, medium, Entity.objects.filter(id__in=candidates)
+            ).order_by('id').values_list('id', flat=True)
+            candidates = list(islice(entity_ids, chunk_size))
+
+    def _filter_subscribed_entities(self, source, medium, entities):
+        """Filter an `Entity` queryset down to those subscribed to the source and medium.
+        """
+        links, sub_entity_type = _entity_links()[:2]
+        group_subscribed_entities = links.objects.filter(
+            super_entity__subscription__source=source,
+            super_entity__subscription__medium=medium,
+            super_entity__subscription__subentity_type=F(sub_entity_type),
+        ).values('sub_entity')
         individual_subs = self.filter(
             source=source, medium=medium, subentity_type=None
-        ).values_list('entity', flat=True)
-
+        ).values('entity')
         relevant_unsubscribes = Unsubscribe.objects.filter(
-            source=source, medium=medium, entity__in=entities
-        ).values_list('entity', flat=True)
-
-        subscribed_entities = Entity.objects.filter(
-            Q(pk__in=group_subscribed_entities) | Q(pk__in=individual_subs),
-            id__in=[e.id for e in entities]
+            _unsubscribes_for('source', source), _unsubscribes_for('medium', medium)
+        ).values('entity')
+        return entities.filter(
+            Q(pk__in=group_subscribed_entities) | Q(pk__in=individual_subs)
         ).exclude(pk__in=relevant_unsubscribes)
 
-        return subscribed_entities
-
     def _mediums_subscribed_individual(self, source, entity):
         """Return the mediums a single entity is subscribed to for a source.
         """
-        super_entities = entity.super_relationships.all().values_list('super_entity')
+        super_entities = self._super_entity_ids(entity)
         entity_is_subscribed = Q(subentity_type__isnull=True, entity=entity)
-        super_entity_is_subscribed = Q(subentity_type=entity.entity_type, entity__in=super_entities)
+        super_entity_is_subscribed = Q(subentity_type__in=_entity_type_ids(entity), entity__in=super_entities)
         subscribed_mediums = self.filter(
             entity_is_subscribed | super_entity_is_subscribed, source=source
         ).select_related('medium').values_list('medium', flat=True)
+        # An unsubscription from every medium puts a null in the
+        # subquery, so that no medium passes the NOT IN condition
         unsubscribed_mediums = Unsubscribe.objects.filter(
-            entity=entity, source=source
+            _unsubscribes_for('source', source), entity=entity
         ).select_related('medium').values_list('medium', flat=True)
         return Medium.objects.filter(id__in=subscribed_mediums).exclude(id__in=unsubscribed_mediums)
 
     def _mediums_subscribed_group(self, source, entity, subentity_type):
         """Return all the mediums any subentity in a group is subscrbed to.
         """
-        all_group_sub_entities = entity.sub_relationships.select_related('sub_entity').filter(
-            sub_entity__entity_type=subentity_type
-        ).values_list('sub_entity')
-        related_super_entities = EntityRelationship.objects.filter(
-            sub_entity__in=all_group_sub_entities
-        ).values_list('super_entity')
-        group_subscribed_mediums = self.filter(
-            source=source, subentity_type=subentity_type, entity__in=related_super_entities
-        ).select_related('medium').values_list('medium', flat=True)
+        group_subscribed_mediums = self._group_subscriptions(
+            entity, subentity_type
+        ).filter(source=source).values_list('medium', flat=True)
         return Medium.objects.filter(id__in=group_subscribed_mediums)
 
     def _is_subscribed_individual(self, source, medium, entity):
         """Return true if an entity is subscribed to that source/medium combo.
+
+        The subscriptions and the unsubscription are checked in a
+        single query.
         """
-        super_entities = entity.super_relationships.all().values_list('super_entity')
+        super_entities = self._super_entity_ids(entity)
         entity_is_subscribed = Q(subentity_type__isnull=True, entity=entity)
-        super_entity_is_subscribed = Q(subentity_type=entity.entity_type, entity__in=super_entities)
-        is_subscribed = self.filter(
+        super_entity_is_subscribed = Q(subentity_type__in=_entity_type_ids(entity), entity__in=super_entities)
+        # The subquery holds the source, or a null for an unsubscription
+        # from every source, only when the entity is unsubscribed, in
+        # which case every subscription is excluded
+        unsubscribed_sources = Unsubscribe.objects.filter(
+            _unsubscribes_for('source', source),
+            _unsubscribes_for('medium', medium),
+            entity=entity
+        ).values('source')
+        return self.filter(
             entity_is_subscribed | super_entity_is_subscribed,
             source=source,
             medium=medium,
-        ).exists()
-        unsubscribed = Unsubscribe.objects.filter(
-            source=source,
-            medium=medium,
-            entity=entity
-        ).exists()
-        return is_subscribed and not unsubscribed
+        ).exclude(source__in=unsubscribed_sources).exists()
 
     def _is_subscribed_group(self, source, medium, entity, subentity_type):
         """Return true if any subentity is subscribed to that source & medium.
         """
-        all_group_sub_entities = entity.sub_relationships.select_related('sub_entity').filter(
-            sub_entity__entity_type=subentity_type
+        return self._group_subscriptions(entity, subentity_type).filter(source=source, medium=medium).exists()
+
+    def _super_entity_ids(self, entity):
+        """Return a queryset of the ids of an entity's super-entities.
+
+        When the `EntityClosure` is maintained, these include the
+        super-entities of its super-entities, at any depth.
+        """
+        if closure_enabled():
+            return EntityClosure.objects.filter(sub_entity=entity).values_list('super_entity')
+        return EntityRelationship.objects.filter(sub_entity=entity).values_list('super_entity')
+
+    def _group_subscriptions(self, entity, subentity_type):
+        """Return the group subscriptions covering any sub-entity of the subentity_type in a group.
+
+        When the `EntityClosure` is maintained, the sub-entities of the
+        group, and the super-entities holding the subscriptions, are
+        found at any depth, with a single join through the closure.
+        """
+        if closure_enabled():
+            # From each subscription's entity down to the sub-entities
+            # below it, and from those up to the group. The conditions
+            # on the group must apply to the same closure row.
+            return self.filter(
+                subentity_type=subentity_type,
+                entity__sub_closure__sub_entity__super_closure__super_entity=entity,
+                entity__sub_closure__sub_entity__super_closure__sub_entity_type=subentity_type,
+            )
+        all_group_sub_entities = EntityRelationship.objects.filter(
+            super_entity=entity, sub_entity__entity_type=subentity_type
         ).values_list('sub_entity')
         related_super_entities = EntityRelationship.objects.filter(
             sub_entity__in=all_group_sub_entities,
         ).values_list('super_entity')
-        is_subscribed = self.filter(
-            source=source,
-            medium=medium,
-            subentity_type=subentity_type,
-            entity__in=related_super_entities
-        ).exists()
-        return is_subscribed
+        return self.filter(subentity_type=subentity_type, entity__in=related_super_entities)
 
 
 class Subscription(models.Model):
@@ -209,6 +733,12 @@ class Subscription(models.Model):
 
     objects = SubscriptionManager()
 
+    class Meta:
+        # Databases treat null values as distinct, so only group
+        # subscriptions are guaranteed to be unique by this constraint
+        unique_together = ('entity', 'source', 'medium', 'subentity_type')
+        index_together = [('source', 'medium', 'subentity_type', 'entity')]
+
     def __unicode__(self):
         s = "{entity} to {source} by {medium}"
         entity = self.entity.__unicode__()
@@ -218,32 +748,223 @@ class Subscription(models.Model):
 
 
 class UnsubscribeManager(models.Manager):
+    @instrumented
     def is_unsubscribed(self, source, medium, entity):
         """Return True if the entity is unsubscribed
+
+        Unsubscriptions from every source or every medium are taken
+        into account.
         """
-        return self.filter(source=source, medium=medium, entity=entity).exists()
+        source, medium = _registered(Source, source), _registered(Medium, medium)
+        return self.filter(
+            _unsubscribes_for('source', source), _unsubscribes_for('medium', medium), entity=entity
+        ).exists()
+
+    @instrumented
+    def bulk_unsubscribe(self, unsubscribes, batch_size=500):
+        """Create many unsubscriptions at once, skipping those that already exist.
+
+        Args:
+
+          unsubscribes - An iterable of unsaved `Unsubscribe` objects.
+          Unsubscriptions with the same entity, source and medium as a
+          stored one, or as an earlier one in the iterable, are
+          skipped.
+
+          batch_size - The number of unsubscriptions checked and
+          created with each pair of queries.
+          The default keeps the ids in each query within SQLite's
+          limit of 999 parameters.
+
+        Returns:
+
+          The list of unsubscriptions that were created. As with
+          `bulk_create`, their primary keys may not be set.
+
+          A single `entity_subscription.signals.bulk_changed` signal
+          is sent for all the created unsubscriptions, rather than a
+          `post_save` signal for each one.
+
+        """
+        created = _bulk_create_missing(self, unsubscribes, ('entity', 'source', 'medium'), batch_size)
+        if created:
+            bulk_changed.send(sender=self.model, rows=created, created=True)
+        return created
+
+    @instrumented
+    def bulk_resubscribe(self, unsubscribes, batch_size=500):
+        """Delete many unsubscriptions at once.
+
+        Args:
+
+          unsubscribes - An iterable of `Unsubscribe` objects, saved or
+          not. The stored unsubscriptions with the same entity, source
+          and medium are deleted.
+
+          batch_size - The number of unsubscriptions deleted with each
+          pair of queries.
+          The default keeps the ids in each query within SQLite's
+          limit of 999 parameters.
+
+        Returns:
+
+          The list of unsubscriptions that were deleted.
+
+          A single `entity_subscription.signals.bulk_changed` signal
+          is sent for all the deleted unsubscriptions, rather than a
+          `post_delete` signal for each one.
+
+        """
+        deleted = _bulk_delete_matching(self, unsubscribes, batch_size)
+        if deleted:
+            bulk_changed.send(sender=self.model, rows=deleted, created=False)
+        return deleted
+
+    @instrumented
+    @reads_primary
+    def collapse(self, batch_size=500):
+        """Replace per source and medium unsubscriptions with wildcard ones wherever they cover the same pairs.
+
+        For each entity, the unsubscriptions covering every medium of
+        a source are replaced by one with a null medium, those
+        covering every source for a medium by one with a null source,
+        and those covering every pair by a single one with neither.
+        Entities whose unsubscriptions would not shrink are left
+        alone.
+
+        Note that wildcard unsubscriptions also apply to sources and
+        mediums added afterwards, which the replaced ones did not.
+
+        Args:
+
+          batch_size - The number of entities whose unsubscriptions
+          are read and rewritten at a time.
+
+        Returns:
+
+          The number of unsubscriptions removed, net of the wildcard
+          ones created.
+
+        """
+        source_ids = set(Source.objects.values_list('id', flat=True))
+        medium_ids = set(Medium.objects.values_list('id', flat=True))
+        removed = 0
+        last_entity_id = None
+        while True:
+            entity_ids = self.order_by('entity').values_list('entity', flat=True).distinct()
+            if last_entity_id is not None:
+                entity_ids = entity_ids.filter(entity__gt=last_entity_id)
+            entity_ids = list(entity_ids[:batch_size])
+            if not entity_ids:
+                return removed
+            last_entity_id = entity_ids[-1]
+
+            stored = {}
+            for entity_id, source_id, medium_id in self.filter(entity__in=entity_ids).values_list(
+                'entity', 'source', 'medium'
+            ):
+                stored.setdefault(entity_id, set()).add((source_id, medium_id))
+
+            to_create, to_delete = [], []
+            for entity_id, pairs in stored.items():
+                collapsed = _collapsed_unsubscribe_pairs(pairs, source_ids, medium_ids)
+                if len(collapsed) < len(pairs):
+                    to_create.extend(
+                        Unsubscribe(entity_id=entity_id, source_id=source_id, medium_id=medium_id)
+                        for source_id, medium_id in collapsed - pairs
+                    )
+                    to_delete.extend(
+                        Unsubscribe(entity_id=entity_id, source_id=source_id, medium_id=medium_id)
+                        for source_id, medium_id in pairs - collapsed
+                    )
+            # The wildcards are created first, so that the entities are
+            # never left subscribed in between
+            removed -= len(self.bulk_unsubscribe(to_create, batch_size))
+            removed += len(self.bulk_resubscribe(to_delete, batch_size))
 
 
 class Unsubscribe(models.Model):
     """Individual entity-level unsubscriptions.
 
     Entities can opt-out individually from recieving any notification
-    of a given source/medium combination.
+    of a given source/medium combination. A null source or medium
+    unsubscribes the entity from every source or every medium,
+    including those added later.
     """
     entity = models.ForeignKey(Entity)
-    medium = models.ForeignKey('Medium')
-    source = models.ForeignKey('Source')
+    medium = models.ForeignKey('Medium', null=True, blank=True)
+    source = models.ForeignKey('Source', null=True, blank=True)
 
     objects = UnsubscribeManager()
 
+    class Meta:
+        unique_together = ('entity', 'source', 'medium')
+        index_together = [('source', 'medium', 'entity')]
+
     def __unicode__(self):
         s = "{entity} from {source} by {medium}"
         entity = self.entity.__unicode__()
-        source = self.source.__unicode__()
-        medium = self.medium.__unicode__()
+        source = self.source.__unicode__() if self.source_id is not None else 'all sources'
+        medium = self.medium.__unicode__() if self.medium_id is not None else 'all mediums'
         return s.format(entity=entity, source=source, medium=medium)
 
 
+class RegistryManager(models.Manager):
+    """A manager holding every row of a small, rarely changing table in memory.
+
+    The rows are loaded with a single query, the first time one is
+    looked up, and are then found by name or id without a query. The
+    registry is shared by the whole process, one per database, and is
+    cleared whenever a row is saved or deleted.
+
+    The objects returned are shared, and must not be modified.
+    """
+    def __init__(self):
+        super(RegistryManager, self).__init__()
+        self._registry = {}
+
+    def get_by_name(self, name):
+        """Return the object with the given name.
+
+        Raises `DoesNotExist` if there is no such object.
+        """
+        return self._lookup('name', name)
+
+    def get_by_id(self, id):
+        """Return the object with the given id.
+
+        Raises `DoesNotExist` if there is no such object.
+        """
+        return self._lookup('id', id)
+
+    def clear_cache(self):
+        """Clear the registry, so that the rows are loaded again on the next lookup.
+        """
+        self._registry.clear()
+
+    def _lookup(self, field, value):
+        registry = self._registry.get(self.db)
+        # Rows created by another process are only found by loading
+        # the table again
+        if registry is None or value not in registry[field]:
+            registry = self._load()
+        try:
+            return registry[field][value]
+        except KeyError:
+            raise self.model.DoesNotExist(
+                '{0} matching {1}={2!r} does not exist.'.format(self.model._meta.object_name, field, value)
+            )
+
+    def _load(self):
+        objs = list(self.all())
+        registry = {
+            'name': dict((obj.name, obj) for obj in objs),
+            'id': dict((obj.id, obj) for obj in objs),
+        }
+        self._registry[self.db] = registry
+        return registry
+
+
 class Medium(models.Model):
     """A method of actually delivering the notification to users.
 
@@ -256,6 +977,8 @@ class Medium(models.Model):
     display_name = models.CharField(max_length=64)
     description = models.TextField()
 
+    objects = RegistryManager()
+
     def __unicode__(self):
         return self.display_name
 
@@ -272,5 +995,568 @@ class Source(models.Model):
     display_name = models.CharField(max_length=64)
     description = models.TextField()
 
+    objects = RegistryManager()
+
     def __unicode__(self):
         return self.display_name
+
+
+class EffectiveSubscriptionManager(models.Manager):
+    def is_subscribed(self, source, medium, entity):
+        """Return True if the entity is subscribed to this source/medium combination.
+
+        The answer takes group subscriptions and unsubscriptions into
+        account, like `SubscriptionManager.is_subscribed` without a
+        subentity_type, but only needs a single indexed lookup.
+        """
+        source, medium = _registered(Source, source), _registered(Medium, medium)
+        return self.filter(source=source, medium=medium, entity=entity).exists()
+
+    def mediums_subscribed(self, source, entity):
+        """Return a queryset of the mediums the entity is subscribed to for a source.
+        """
+        source = _registered(Source, source)
+        return Medium.objects.filter(id__in=self.filter(source=source, entity=entity).values('medium'))
+
+    def filter_not_subscribed(self, source, medium, entities):
+        """Return a queryset of the entities subscribed to the source and medium.
+        """
+        source, medium = _registered(Source, source), _registered(Medium, medium)
+        subscribed_entities = self.filter(
+            source=source, medium=medium, entity__in=[_id(e) for e in entities]
+        ).values('entity')
+        return Entity.objects.filter(id__in=subscribed_entities)
+
+    @reads_primary
+    def refresh(self, source, entity_ids=None):
+        """Bring the effective subscriptions of a source up to date.
+
+        Args:
+
+          source - A `Source` object, or its id.
+
+          entity_ids - (Optional) An iterable of entity ids. If given,
+          only the rows of these entities are refreshed.
+
+        """
+        if entity_ids is not None:
+            entity_ids = list(entity_ids)
+        missing, extra = self._differences(source, entity_ids)
+
+        extra_by_medium = {}
+        for medium_id, entity_id in extra:
+            extra_by_medium.setdefault(medium_id, []).append(entity_id)
+        for medium_id, extra_entity_ids in extra_by_medium.items():
+            self.filter(source=source, medium=medium_id, entity__in=extra_entity_ids).delete()
+
+        source_id = _id(source)
+        self.bulk_create([
+            EffectiveSubscription(source_id=source_id, medium_id=medium_id, entity_id=entity_id)
+            for medium_id, entity_id in missing
+        ])
+
+    def rebuild(self):
+        """Bring the effective subscriptions of every source up to date.
+        """
+        for source in Source.objects.all():
+            self.refresh(source)
+
+    def verify(self):
+        """Compare the stored effective subscriptions with the `SubscriptionManager`.
+
+        Returns:
+
+          A tuple of two sets of (source id, medium id, entity id)
+          tuples. The first holds the subscriptions missing from the
+          table, and the second the rows that should not be there.
+          Both are empty when the table is up to date.
+
+        """
+        missing, extra = set(), set()
+        for source in Source.objects.all():
+            source_missing, source_extra = self._differences(source)
+            missing.update((source.id, medium_id, entity_id) for medium_id, entity_id in source_missing)
+            extra.update((source.id, medium_id, entity_id) for medium_id, entity_id in source_extra)
+        return missing, extra
+
+    def _differences(self, source, entity_ids=None):
+        """Return the missing and extra (medium id, entity id) pairs of a source.
+        """
+        stored = self.filter(source=source)
+        if entity_ids is not None:
+            stored = stored.filter(entity__in=entity_ids)
+        stored = set(stored.values_list('medium', 'entity'))
+        expected = Subscription.objects._subscribed_pairs(source, entity_ids=entity_ids)
+        return expected - stored, stored - expected
+
+
+class EffectiveSubscription(models.Model):
+    """The denormalized, effective subscriptions of individual entities.
+
+    Each row states that an entity is subscribed to a source/medium
+    combination, after group subscriptions have been expanded and
+    unsubscriptions removed. The table is only maintained while the
+    `ENTITY_SUBSCRIPTION_MATERIALIZE` setting is True, in which case
+    every change to a `Subscription`, `Unsubscribe` or
+    `EntityRelationship` refreshes the affected rows. The
+    `rebuild_effective_subscriptions` management command rebuilds and
+    verifies the whole table.
+    """
+    entity = models.ForeignKey(Entity)
+    medium = models.ForeignKey('Medium')
+    source = models.ForeignKey('Source')
+
+    objects = EffectiveSubscriptionManager()
+
+    class Meta:
+        unique_together = ('source', 'medium', 'entity')
+
+
+class EntityClosureManager(models.Manager):
+    @reads_primary
+    def refresh(self, entity_ids):
+        """Bring the super-entities of some entities up to date.
+
+        Args:
+
+          entity_ids - An iterable of entity ids. The rows with these
+          entities as the sub-entity are refreshed.
+
+        """
+        entity_ids = set(entity_ids)
+        parents = self._parents(entity_ids)
+        expected = set(
+            (super_entity_id, entity_id)
+            for entity_id in entity_ids
+            for super_entity_id in _ancestors(entity_id, parents)
+        )
+        stored = set()
+        for batch in _batches(entity_ids, 500):
+            stored.update(self.filter(sub_entity__in=batch).values_list('super_entity', 'sub_entity'))
+
+        extra_by_entity = {}
+        for super_entity_id, entity_id in stored - expected:
+            extra_by_entity.setdefault(entity_id, []).append(super_entity_id)
+        for entity_id, super_entity_ids in extra_by_entity.items():
+            self.filter(sub_entity=entity_id, super_entity__in=super_entity_ids).delete()
+
+        missing = expected - stored
+        entity_types = dict(Entity.objects.filter(
+            id__in=set(entity_id for super_entity_id, entity_id in missing)
+        ).values_list('id', 'entity_type'))
+        self.bulk_create([
+            EntityClosure(
+                super_entity_id=super_entity_id, sub_entity_id=entity_id, sub_entity_type_id=entity_types[entity_id]
+            )
+            for super_entity_id, entity_id in missing
+        ])
+
+    def rebuild(self):
+        """Bring the super-entities of every entity up to date.
+        """
+        entity_ids = set(EntityRelationship.objects.values_list('sub_entity', flat=True))
+        entity_ids.update(self.values_list('sub_entity', flat=True))
+        for batch in _batches(entity_ids, 500):
+            self.refresh(batch)
+
+    def _parents(self, entity_ids):
+        """Return the direct super-entity ids of the entities and of all their super-entities.
+        """
+        parents = {}
+        to_fetch = set(entity_ids)
+        while to_fetch:
+            for batch in _batches(to_fetch, 500):
+                for entity_id in batch:
+                    parents[entity_id] = set()
+                for entity_id, super_entity_id in EntityRelationship.objects.filter(
+                    sub_entity__in=batch
+                ).values_list('sub_entity', 'super_entity'):
+                    parents[entity_id].add(super_entity_id)
+            to_fetch = set().union(*parents.values()) - set(parents)
+        return parents
+
+
+class EntityClosure(models.Model):
+    """The transitive closure of the entity relationships.
+
+    Each row states that an entity is a super-entity of a sub-entity,
+    either directly through an `EntityRelationship`, or through a
+    chain of them of any length. The type of the sub-entity is copied
+    onto the row, so that the sub-entities of a type can be found with
+    an index. The table is only maintained while the
+    `ENTITY_SUBSCRIPTION_CLOSURE` setting is True, in which case it
+    is used to resolve the super-entities and sub-entities in every
+    `SubscriptionManager` method and in the `EffectiveSubscription`
+    table.
+    """
+    super_entity = models.ForeignKey(Entity, related_name='sub_closure')
+    sub_entity = models.ForeignKey(Entity, related_name='super_closure')
+    sub_entity_type = models.ForeignKey(ContentType)
+
+    objects = EntityClosureManager()
+
+    class Meta:
+        unique_together = ('sub_entity', 'super_entity')
+        index_together = [('super_entity', 'sub_entity_type', 'sub_entity')]
+
+
+def _ancestors(entity_id, parents):
+    """Return the ids of every super-entity of an entity, at any depth, given the direct super-entities.
+    """
+    ancestors = set()
+    to_visit = list(parents.get(entity_id, ()))
+    while to_visit:
+        super_entity_id = to_visit.pop()
+        if super_entity_id not in ancestors:
+            ancestors.add(super_entity_id)
+            to_visit.extend(parents.get(super_entity_id, ()))
+    # Relationships forming a cycle would make an entity its own super-entity
+    ancestors.discard(entity_id)
+    return ancestors
+
+
+def materializing_enabled():
+    """Return True if the `EffectiveSubscription` table is maintained.
+    """
+    return getattr(settings, 'ENTITY_SUBSCRIPTION_MATERIALIZE', False)
+
+
+def _effective_subscription_scope(instance):
+    """Return the (source id, entity ids) pairs whose effective subscriptions depend on a row.
+    """
+    if isinstance(instance, Subscription):
+        if instance.subentity_type_id is None:
+            entity_ids = [instance.entity_id]
+        else:
+            links, sub_entity_type = _entity_links()[:2]
+            entity_ids = list(links.objects.filter(**{
+                'super_entity': instance.entity_id, sub_entity_type: instance.subentity_type_id
+            }).values_list('sub_entity', flat=True))
+        return [(instance.source_id, entity_ids)]
+    elif isinstance(instance, Unsubscribe):
+        if instance.source_id is None:
+            return [(source_id, [instance.entity_id]) for source_id in Source.objects.values_list('id', flat=True)]
+        return [(instance.source_id, [instance.entity_id])]
+    else:
+        return _relationship_effective_subscription_scope([instance])
+
+
+def _relationship_effective_subscription_scope(relationships):
+    """Return the (source id, entity ids) pairs whose effective subscriptions depend on some relationships.
+    """
+    entity_ids = set(relationship.sub_entity_id for relationship in relationships)
+    if closure_enabled():
+        # Group subscriptions reach the entities below the sub-entities too
+        entity_ids.update(_closure_descendant_ids(entity_ids))
+    return [(source_id, entity_ids) for source_id in Source.objects.values_list('id', flat=True)]
+
+
+@reads_primary
+def capture_effective_subscription_scope(sender, instance, **kwargs):
+    """Remember which effective subscriptions depend on a row before it is edited.
+    """
+    if materializing_enabled() and instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).first()
+        instance._previous_effective_subscription_scope = (
+            _effective_subscription_scope(previous) if previous is not None else []
+        )
+
+
+@reads_primary
+def refresh_effective_subscriptions(sender, instance, **kwargs):
+    """Refresh the effective subscriptions depending on a saved or deleted row.
+
+    The entities are refreshed in batches, since a group subscription
+    may cover any number of them.
+    """
+    if materializing_enabled():
+        scope = _effective_subscription_scope(instance)
+        scope.extend(getattr(instance, '_previous_effective_subscription_scope', []))
+        for source_id, entity_ids in scope:
+            for batch in _batches(entity_ids, 500):
+                EffectiveSubscription.objects.refresh(source_id, batch)
+
+
+@reads_primary
+def refresh_bulk_effective_subscriptions(sender, rows, **kwargs):
+    """Refresh the effective subscriptions depending on rows written in bulk.
+
+    The entities are refreshed once per source, in batches, however
+    many rows were written for them.
+    """
+    if materializing_enabled():
+        if sender is EntityRelationship:
+            # Relationships synced in bulk share one scope, rather than
+            # a few queries each
+            scope = _relationship_effective_subscription_scope(rows)
+        else:
+            scope = [pair for row in rows for pair in _effective_subscription_scope(row)]
+        entity_ids_by_source = {}
+        for source_id, entity_ids in scope:
+            entity_ids_by_source.setdefault(source_id, set()).update(entity_ids)
+        for source_id, entity_ids in entity_ids_by_source.items():
+            for batch in _batches(entity_ids, 500):
+                EffectiveSubscription.objects.refresh(source_id, batch)
+
+
+def closure_enabled():
+    """Return True if the `EntityClosure` table is maintained and used.
+    """
+    return getattr(settings, 'ENTITY_SUBSCRIPTION_CLOSURE', False)
+
+
+def _closure_descendant_ids(entity_ids):
+    """Return the ids of every entity below some entities, at any depth, according to the `EntityClosure`.
+    """
+    descendant_ids = set()
+    for batch in _batches(entity_ids, 500):
+        descendant_ids.update(EntityClosure.objects.filter(
+            super_entity__in=batch
+        ).values_list('sub_entity', flat=True))
+    return descendant_ids
+
+
+@reads_primary
+def capture_entity_closure_scope(sender, instance, **kwargs):
+    """Remember the sub-entity of a relationship before it is edited.
+    """
+    if closure_enabled() and instance.pk is not None:
+        instance._previous_closure_sub_entity_ids = list(
+            sender.objects.filter(pk=instance.pk).values_list('sub_entity', flat=True)
+        )
+
+
+@reads_primary
+def refresh_entity_closure(sender, instance, **kwargs):
+    """Refresh the closure rows of a saved or deleted relationship's sub-entity and everything below it.
+    """
+    if closure_enabled():
+        entity_ids = set([instance.sub_entity_id])
+        entity_ids.update(getattr(instance, '_previous_closure_sub_entity_ids', []))
+        entity_ids.update(EntityClosure.objects.filter(
+            super_entity__in=entity_ids
+        ).values_list('sub_entity', flat=True))
+        EntityClosure.objects.refresh(entity_ids)
+
+
+@reads_primary
+def refresh_bulk_entity_closure(sender, rows, **kwargs):
+    """Refresh the closure rows of the sub-entities of relationships written in bulk, and everything below them.
+    """
+    if closure_enabled() and sender is EntityRelationship:
+        entity_ids = set(row.sub_entity_id for row in rows)
+        entity_ids.update(_closure_descendant_ids(entity_ids))
+        for batch in _batches(entity_ids, 500):
+            EntityClosure.objects.refresh(batch)
+
+
+@reads_primary
+def relationships_synced(entities=None):
+    """Bring everything kept in step with the entity relationships up to date after entities are synced.
+
+    django-entity's `sync_entities` creates relationships in bulk,
+    which sends no `post_save` signal, so the `EntityClosure`, the
+    `EffectiveSubscription` rows, the `SubscriptionChange` log and the
+    subscription caches miss them. Call this after syncing to send a
+    `bulk_changed` signal for the current relationships of the synced
+    entities, in batches. Relationships deleted by the sync send their
+    own `post_delete` signals.
+
+    Args:
+
+      entities - (Optional) The synced entities, as `Entity` objects or
+      ids. Defaults to every entity with a super-entity, after syncing
+      the whole project.
+
+    """
+    if entities is None:
+        entity_ids = EntityRelationship.objects.values_list('sub_entity', flat=True).distinct()
+    else:
+        entity_ids = [_id(entity) for entity in entities]
+    for batch in _batches(entity_ids, 500):
+        relationships = list(EntityRelationship.objects.filter(sub_entity__in=batch))
+        if relationships:
+            bulk_changed.send(sender=EntityRelationship, rows=relationships, created=True)
+
+
+def update_entity_closure_type(sender, instance, **kwargs):
+    """Copy a saved entity's type onto the closure rows it is the sub-entity of.
+    """
+    if closure_enabled():
+        EntityClosure.objects.filter(sub_entity=instance).exclude(
+            sub_entity_type=instance.entity_type_id
+        ).update(sub_entity_type=instance.entity_type_id)
+
+
+pre_save.connect(capture_entity_closure_scope, sender=EntityRelationship)
+post_save.connect(refresh_entity_closure, sender=EntityRelationship)
+post_delete.connect(refresh_entity_closure, sender=EntityRelationship)
+post_save.connect(update_entity_closure_type, sender=Entity)
+bulk_changed.connect(refresh_bulk_entity_closure)
+# Connected after the closure maintenance, so that relationship changes
+# are refreshed with an up to date closure
+for model in (Subscription, Unsubscribe, EntityRelationship):
+    pre_save.connect(capture_effective_subscription_scope, sender=model)
+    post_save.connect(refresh_effective_subscriptions, sender=model)
+    post_delete.connect(refresh_effective_subscriptions, sender=model)
+bulk_changed.connect(refresh_bulk_effective_subscriptions)
+
+
+def clear_registry(sender, **kwargs):
+    """Clear the registry of a saved or deleted `Medium` or `Source`.
+    """
+    sender.objects.clear_cache()
+
+
+for model in (Medium, Source):
+    post_save.connect(clear_registry, sender=model)
+    post_delete.connect(clear_registry, sender=model)
+
+
+class SubscriptionChangeManager(models.Manager):
+    def changes_since(self, sequence=0, batch_size=1000, settle_seconds=None):
+        """Yield the changes recorded after a sequence number, in batches.
+
+        Sequence numbers are assigned when a change is written, not when
+        its transaction commits, so a change may become visible after
+        changes with higher sequence numbers. Changes are only returned
+        once they, and every change after them, are older than the
+        settle window, so that a consumer resuming from the last
+        sequence number it read never skips a change committed late.
+
+        Args:
+
+          sequence - The sequence number of the last change already
+          seen, or 0 to read every change in the log.
+
+          batch_size - The number of changes in each batch, and so
+          fetched with each query.
+
+          settle_seconds - (Optional) The age, in seconds, a change
+          must reach before it is returned. It must be longer than the
+          transactions writing subscriptions, including bulk imports.
+          Defaults to the `ENTITY_SUBSCRIPTION_CHANGEFEED_SETTLE_SECONDS`
+          setting, or 600 seconds.
+
+        Returns:
+
+          A generator of lists of `SubscriptionChange` objects, in
+          ascending sequence order. Every list but the last holds
+          exactly `batch_size` changes. The sequence number of the
+          last change of the last batch is the one to resume from.
+
+        """
+        if settle_seconds is None:
+            settle_seconds = getattr(settings, 'ENTITY_SUBSCRIPTION_CHANGEFEED_SETTLE_SECONDS', 600)
+        changes = self.filter(sequence__gt=sequence)
+        # Nothing from the first unsettled change onwards is returned,
+        # since changes before it may still be committed
+        first_unsettled = changes.filter(
+            created_at__gt=timezone.now() - timedelta(seconds=settle_seconds)
+        ).aggregate(first=models.Min('sequence'))['first']
+        if first_unsettled is not None:
+            changes = changes.filter(sequence__lt=first_unsettled)
+
+        batch = list(changes.order_by('sequence')[:batch_size])
+        while batch:
+            yield batch
+            if len(batch) < batch_size:
+                break
+            batch = list(changes.filter(sequence__gt=batch[-1].sequence).order_by('sequence')[:batch_size])
+
+    def latest_sequence(self):
+        """Return the sequence number of the latest change, or 0 if none was recorded.
+        """
+        return self.aggregate(latest=models.Max('sequence'))['latest'] or 0
+
+    def record(self, rows, deleted=False):
+        """Append a change to the log for each of some `Subscription`, `Unsubscribe` or `EntityRelationship` rows.
+        """
+        self.bulk_create([SubscriptionChange.for_row(row, deleted) for row in rows])
+
+
+class SubscriptionChange(models.Model):
+    """An append-only log of the changes to subscriptions, unsubscriptions and entity relationships.
+
+    Each saved or deleted `Subscription`, `Unsubscribe` or
+    `EntityRelationship`, including those written in bulk by this app
+    or passed to `relationships_synced`, appends a
+    change holding the values of the row after it was saved, or before
+    it was deleted. Changes are numbered by their `sequence`, which
+    only increases, so that a consumer can store the last sequence it
+    has seen and read only the changes after it, and by the time they
+    were written, `created_at`. The log is only
+    written while the `ENTITY_SUBSCRIPTION_CHANGEFEED` setting is True.
+
+    Changes to relationships record the sub-entity as the `entity_id`
+    and the super-entity as the `super_entity_id`. Rows created in
+    bulk may have no `row_id` on databases that do not return the
+    primary keys of bulk inserts.
+    """
+    SUBSCRIPTION = 'subscription'
+    UNSUBSCRIBE = 'unsubscribe'
+    RELATIONSHIP = 'relationship'
+    KIND_CHOICES = (
+        (SUBSCRIPTION, 'Subscription'),
+        (UNSUBSCRIBE, 'Unsubscribe'),
+        (RELATIONSHIP, 'Entity relationship'),
+    )
+
+    sequence = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    deleted = models.BooleanField(default=False)
+    row_id = models.IntegerField(null=True)
+    entity_id = models.IntegerField()
+    source_id = models.IntegerField(null=True)
+    medium_id = models.IntegerField(null=True)
+    subentity_type_id = models.IntegerField(null=True)
+    super_entity_id = models.IntegerField(null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = SubscriptionChangeManager()
+
+    @classmethod
+    def for_row(cls, row, deleted=False):
+        """Return an unsaved change recording a saved or deleted row.
+        """
+        if isinstance(row, Subscription):
+            return cls(
+                kind=cls.SUBSCRIPTION, deleted=deleted, row_id=row.pk, entity_id=row.entity_id,
+                source_id=row.source_id, medium_id=row.medium_id, subentity_type_id=row.subentity_type_id,
+            )
+        elif isinstance(row, Unsubscribe):
+            return cls(
+                kind=cls.UNSUBSCRIBE, deleted=deleted, row_id=row.pk, entity_id=row.entity_id,
+                source_id=row.source_id, medium_id=row.medium_id,
+            )
+        else:
+            return cls(
+                kind=cls.RELATIONSHIP, deleted=deleted, row_id=row.pk, entity_id=row.sub_entity_id,
+                super_entity_id=row.super_entity_id,
+            )
+
+
+def changefeed_enabled():
+    """Return True if the `SubscriptionChange` log is written.
+    """
+    return getattr(settings, 'ENTITY_SUBSCRIPTION_CHANGEFEED', False)
+
+
+def record_change(sender, instance, signal, **kwargs):
+    """Append a change for a saved or deleted row.
+    """
+    if changefeed_enabled():
+        SubscriptionChange.objects.record([instance], deleted=signal is post_delete)
+
+
+def record_bulk_changes(sender, rows, created, **kwargs):
+    """Append a change for each row written in bulk.
+    """
+    if changefeed_enabled():
+        SubscriptionChange.objects.record(rows, deleted=not created)
+
+
+for model in (Subscription, Unsubscribe, EntityRelationship):
+    post_save.connect(record_change, sender=model)
+    post_delete.connect(record_change, sender=model)
+bulk_changed.connect(record_bulk_changes)
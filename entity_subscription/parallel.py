@@ -0,0 +1,76 @@
+from multiprocessing import Pool
+
+from django.db import connections
+from entity import Entity
+
+from entity_subscription.models import Subscription, _batches, _id
+
+
+def _subscribed_ids_in_shard(shard):
+    """Return the subscribed ids of a shard of candidates, in ascending order.
+
+    This runs in a worker process, with the worker's own database
+    connection.
+    """
+    source_id, medium_id, entity_ids = shard
+    return list(Subscription.objects._filter_subscribed_entities(
+        source_id, medium_id, Entity.objects.filter(id__in=entity_ids)
+    ).order_by('id').values_list('id', flat=True))
+
+
+def parallel_subscribed_entity_ids(source, medium, entity_ids, workers=4, chunk_size=500, pool=None):
+    """Yield the ids of the candidate entities subscribed to the source and medium, using a pool of processes.
+
+    Args:
+
+      source - A `Source` object, or its id.
+
+      medium - A `Medium` object, or its id.
+
+      entity_ids - An iterable of candidate entity ids, such as a
+      generator or a flat `values_list` queryset. It is consumed
+      `chunk_size` ids at a time.
+
+      workers - The number of worker processes.
+
+      chunk_size - The number of candidate ids in each shard sent to
+      a worker, and so in each query.
+
+      pool - (Optional) A pool to run the shards in, such as a
+      `multiprocessing.Pool`, with a `map` method. The caller
+      remains responsible for it. If not given, a pool of `workers`
+      processes is created and closed once every id is yielded.
+
+    Returns:
+
+      A generator of the subscribed entity ids, with the same
+      semantics as `SubscriptionManager.filter_not_subscribed`.
+      `workers` shards are evaluated in parallel at a time, but their
+      results are yielded in the order the shards were taken from the
+      candidates, and the ids of each shard in ascending order, so the
+      output is the same on every run.
+
+    A new pool forks the current process, so the connections of this
+    process are closed first, for each worker to open its own rather
+    than share the inherited sockets. It must not be created inside a
+    transaction.
+    """
+    source_id, medium_id = _id(source), _id(medium)
+    shards = ((source_id, medium_id, batch) for batch in _batches(entity_ids, chunk_size))
+
+    owns_pool = pool is None
+    if owns_pool:
+        for connection in connections.all():
+            connection.close()
+        pool = Pool(workers)
+    try:
+        # The candidates are read here, rather than in the pool's task
+        # thread, and only as many shards as there are workers at a time
+        for window in _batches(shards, workers):
+            for subscribed_ids in pool.map(_subscribed_ids_in_shard, window):
+                for entity_id in subscribed_ids:
+                    yield entity_id
+    finally:
+        if owns_pool:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,85 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+_state = threading.local()
+
+
+@contextmanager
+def use_primary():
+    """Send every subscription read in the current thread to the primary database, while in the block.
+
+    Use this for reads that must see writes just made, such as
+    rendering the preferences a user has just changed, since a read
+    database may lag behind the primary. Blocks can be nested.
+    """
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+
+
+def reading_from_primary():
+    """Return True if the current thread is inside a `use_primary` block.
+    """
+    return getattr(_state, 'depth', 0) > 0
+
+
+def reads_primary(func):
+    """Decorate a function so that it reads from the primary database, as in a `use_primary` block.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_primary():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class SubscriptionRouter(object):
+    """A database router sending subscription reads to a read-only database.
+
+    Reads of the models of the `app_labels` go to the database alias in
+    the `ENTITY_SUBSCRIPTION_READ_DATABASE` setting, unless it is not
+    set, or to the primary database below when the read is made inside
+    a `use_primary` block. The entity
+    models are included, since subscription queries join them in
+    subqueries, which must run on the same database.
+
+    Writes of those models, including saving or deleting an object
+    read from the read database, go to the alias in the
+    `ENTITY_SUBSCRIPTION_PRIMARY_DATABASE` setting, `default` unless
+    set, and relations between them are allowed whichever database
+    they were read from. Every other model is left to the other
+    routers.
+
+    Add it, first, to the `DATABASE_ROUTERS` setting:
+
+        DATABASE_ROUTERS = ['entity_subscription.routers.SubscriptionRouter']
+
+    """
+    app_labels = ('entity_subscription', 'entity')
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in self.app_labels:
+            if reading_from_primary():
+                return self._primary_database()
+            return getattr(settings, 'ENTITY_SUBSCRIPTION_READ_DATABASE', None)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in self.app_labels:
+            return self._primary_database()
+        return None
+
+    def _primary_database(self):
+        return getattr(settings, 'ENTITY_SUBSCRIPTION_PRIMARY_DATABASE', DEFAULT_DB_ALIAS)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.app_label in self.app_labels and obj2._meta.app_label in self.app_labels:
+            return True
+        return None
@@ -0,0 +1,147 @@
+import time
+from copy import copy
+from contextlib import contextmanager
+from functools import wraps
+from inspect import getcallargs
+from types import GeneratorType
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.dispatch import Signal
+from django.test.utils import CaptureQueriesContext
+
+
+# Sent after each call to an instrumented manager method, with the
+# manager's model as the sender. `source` is the source, and `medium`
+# the medium or list of mediums, the method was called with, if any.
+# `queries` is the number of SQL queries the call ran, `duration` its
+# wall time in seconds, and `cardinality` the length of its result, or
+# None for results that are not sized, such as booleans and counts.
+# Lazy querysets and generators are measured, and the signal sent, once
+# they have been iterated through.
+manager_method_called = Signal(providing_args=[
+    'method', 'source', 'medium', 'queries', 'duration', 'cardinality'
+])
+
+# Sent once after a bulk write through `SubscriptionManager.bulk_subscribe`,
+# `UnsubscribeManager.bulk_unsubscribe` or `UnsubscribeManager.bulk_resubscribe`,
+# and for each batch of relationships passed to `models.relationships_synced`,
+# with the model as the sender, in place of a `post_save` or `post_delete`
+# signal for each row. `rows` is the list of rows created, when `created` is
+# True, or deleted, when it is False.
+bulk_changed = Signal(providing_args=['rows', 'created'])
+
+
+class _Measurement(object):
+    """The number of queries run, and the wall time spent, on a connection within some blocks.
+    """
+    def __init__(self, db):
+        self.connection = connections[db]
+        self.queries = 0
+        self.duration = 0.0
+
+    @contextmanager
+    def measuring(self):
+        connection = self.connection
+        logging_queries = connection.use_debug_cursor or (connection.use_debug_cursor is None and settings.DEBUG)
+        start = time.time()
+        with CaptureQueriesContext(connection) as queries:
+            yield
+        self.duration += time.time() - start
+        self.queries += len(queries)
+        if not logging_queries:
+            # Don't keep the captured queries around when nothing else is recording them
+            del connection.queries[queries.initial_queries:]
+
+
+def _measured_iteration(items, measurement, report, size):
+    """Yield the items of an iterator, measuring only the work done to produce them.
+
+    The report is called with the total size of the items once the
+    iterator is exhausted.
+    """
+    cardinality = 0
+    while True:
+        with measurement.measuring():
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+        cardinality += size(item)
+        yield item
+    report(measurement, cardinality)
+
+
+class _InstrumentedQuerySetMixin(object):
+    """Send `manager_method_called` when a queryset returned by an instrumented method is evaluated.
+
+    Querysets derived from it, by filtering it or otherwise, are not
+    instrumented.
+    """
+    def iterator(self):
+        iterator = super(_InstrumentedQuerySetMixin, self).iterator()
+        instrumentation = getattr(self, '_instrumentation', None)
+        if instrumentation is None:
+            return iterator
+        # Each evaluation adds its own work to that of the method call
+        call_measurement, report = instrumentation
+        return _measured_iteration(iterator, copy(call_measurement), report, lambda row: 1)
+
+
+_instrumented_queryset_classes = {}
+
+
+def _instrumented_queryset(queryset, measurement, report):
+    """Return a copy of a queryset that calls the report when it is evaluated.
+    """
+    queryset_class = queryset.__class__
+    if queryset_class not in _instrumented_queryset_classes:
+        _instrumented_queryset_classes[queryset_class] = type(
+            str('Instrumented{0}'.format(queryset_class.__name__)), (_InstrumentedQuerySetMixin, queryset_class), {}
+        )
+    return queryset._clone(klass=_instrumented_queryset_classes[queryset_class], _instrumentation=(measurement, report))
+
+
+def instrumented(method):
+    """Decorate a manager method so that it sends `manager_method_called`.
+
+    Nothing is measured unless a receiver is connected, so the
+    instrumentation is free until it is opted into. The source and
+    medium are read from the method's `source` and `medium` or
+    `mediums` arguments, when it has them.
+
+    The signal is sent when the method returns, or for a method
+    returning a lazy queryset or a generator, once the result has been
+    iterated through, with the queries and time spent evaluating it.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not manager_method_called.has_listeners(self.model):
+            return method(self, *args, **kwargs)
+
+        call_args = getcallargs(method, self, *args, **kwargs)
+
+        def report(measurement, cardinality):
+            manager_method_called.send(
+                sender=self.model,
+                method=method.__name__,
+                source=call_args.get('source'),
+                medium=call_args.get('medium', call_args.get('mediums')),
+                queries=measurement.queries,
+                duration=measurement.duration,
+                cardinality=cardinality,
+            )
+
+        measurement = _Measurement(self.db)
+        with measurement.measuring():
+            result = method(self, *args, **kwargs)
+
+        if isinstance(result, QuerySet):
+            return _instrumented_queryset(result, measurement, report)
+        if isinstance(result, GeneratorType):
+            # The chunks of a generator are counted by their lengths
+            return _measured_iteration(result, measurement, report, len)
+        report(measurement, len(result) if hasattr(result, '__len__') else None)
+        return result
+    return wrapper
@@ -0,0 +1,386 @@
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+
+from entity import Entity
+
+from entity_subscription.models import Source, Subscription, Unsubscribe, _entity_links, _id
+
+
+# A snapshot file starts with a header holding a magic string, the
+# format version and the number of records, followed by the records
+# sorted by source id, medium id and entity id
+SNAPSHOT_FILE_MAGIC = b'ESSNAP'
+SNAPSHOT_FILE_VERSION = 1
+_HEADER = struct.Struct('<6sHQ')
+_RECORD = struct.Struct('<iiq')
+
+
+def _sorted_ids(ids):
+    """Return a compact, sorted array of distinct ids.
+    """
+    return array('l', sorted(set(ids)))
+
+
+def _contains(sorted_ids, value):
+    """Return True if the value is in a sorted array.
+    """
+    index = bisect_left(sorted_ids, value)
+    return index < len(sorted_ids) and sorted_ids[index] == value
+
+
+class _IdMultiMap(object):
+    """An immutable mapping of ids to sorted arrays of ids, stored in three flat arrays.
+
+    The keys are sorted, and the values of the key at position i are
+    `values[offsets[i]:offsets[i + 1]]`.
+    """
+    def __init__(self, pairs):
+        self.keys = array('l')
+        self.offsets = array('l', [0])
+        self.values = array('l')
+        for key, key_pairs in groupby(sorted(set(pairs)), key=lambda pair: pair[0]):
+            self.keys.append(key)
+            self.values.extend(value for key, value in key_pairs)
+            self.offsets.append(len(self.values))
+
+    def get(self, key):
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self.values[self.offsets[index]:self.offsets[index + 1]]
+        return ()
+
+
+class SubscriptionSnapshot(object):
+    """An in-memory copy of the subscription tables, answering queries without the database.
+
+    A snapshot is loaded with a handful of bulk reads, after which
+    `is_subscribed`, `mediums_subscribed`, `filter_not_subscribed`
+    and `subscribed_entity_ids` give the same answers as the
+    `SubscriptionManager` methods of the same name, as ids. It is
+    meant for offline jobs, such as digests, that check every entity
+    against every source.
+
+    Ids are held in sorted arrays rather than sets, to keep memory
+    low, so that lookups are binary searches. Only the relationships,
+    and the entity types, that a group subscription could match are
+    loaded. They are loaded from the `EntityClosure` when it is
+    enabled, as the manager resolves them.
+
+    The snapshot is not updated when the tables change afterwards.
+    Entities, sources and mediums may be given as objects or as ids.
+    """
+    def __init__(self, subscriptions, unsubscribes, relationships, entity_types):
+        """Build a snapshot from rows of ids.
+
+        Args:
+
+          subscriptions - An iterable of (source id, medium id, entity
+          id, subentity_type id) tuples, with a subentity_type id of
+          None for individual subscriptions.
+
+          unsubscribes - An iterable of (source id, medium id, entity
+          id) tuples.
+
+          relationships - An iterable of (sub_entity id,
+          super_entity id) tuples.
+
+          entity_types - An iterable of (entity id, entity_type id)
+          tuples.
+
+        """
+        individual, group = {}, {}
+        for source_id, medium_id, entity_id, subentity_type_id in subscriptions:
+            if subentity_type_id is None:
+                individual.setdefault((source_id, medium_id), []).append(entity_id)
+            else:
+                group.setdefault((source_id, medium_id, subentity_type_id), []).append(entity_id)
+        self._individual = dict((key, _sorted_ids(ids)) for key, ids in individual.items())
+        self._group = dict((key, _sorted_ids(ids)) for key, ids in group.items())
+
+        unsubscribed = {}
+        for source_id, medium_id, entity_id in unsubscribes:
+            unsubscribed.setdefault((source_id, medium_id), []).append(entity_id)
+        self._unsubscribed = dict((key, _sorted_ids(ids)) for key, ids in unsubscribed.items())
+
+        self._mediums_by_source = {}
+        for source_id, medium_id in list(self._individual) + [key[:2] for key in self._group]:
+            self._mediums_by_source.setdefault(source_id, set()).add(medium_id)
+
+        relationships = list(relationships)
+        self._super_entities = _IdMultiMap(relationships)
+        self._sub_entities = _IdMultiMap((super_id, sub_id) for sub_id, super_id in relationships)
+
+        entity_types = sorted(entity_types)
+        self._entity_ids = array('l', [entity_id for entity_id, entity_type_id in entity_types])
+        self._entity_type_ids = array('l', [entity_type_id for entity_id, entity_type_id in entity_types])
+
+    @classmethod
+    def load(cls):
+        """Load a snapshot of the current subscription tables, with four queries.
+        """
+        subscriptions = list(Subscription.objects.values_list('source', 'medium', 'entity', 'subentity_type'))
+        subentity_type_ids = set(row[3] for row in subscriptions if row[3] is not None)
+        # With the closure, the relationships hold every super-entity at any depth
+        links, sub_entity_type = _entity_links()[:2]
+        return cls(
+            subscriptions,
+            Unsubscribe.objects.values_list('source', 'medium', 'entity').iterator(),
+            links.objects.filter(**{
+                sub_entity_type + '__in': subentity_type_ids
+            }).values_list('sub_entity', 'super_entity').iterator(),
+            Entity.objects.filter(
+                entity_type__in=subentity_type_ids
+            ).values_list('id', 'entity_type').iterator(),
+        )
+
+    def is_subscribed(self, source, medium, entity, subentity_type=None):
+        """Return the answer of `SubscriptionManager.is_subscribed`.
+        """
+        source_id, medium_id, entity_id = _id(source), _id(medium), _id(entity)
+        if subentity_type is None:
+            return self._is_subscribed_individual(source_id, medium_id, entity_id)
+        return self._is_subscribed_group(source_id, medium_id, entity_id, _id(subentity_type))
+
+    def mediums_subscribed(self, source, entity, subentity_type=None):
+        """Return the ids of the mediums `SubscriptionManager.mediums_subscribed` would return, as a set.
+        """
+        source_id, entity_id = _id(source), _id(entity)
+        medium_ids = self._mediums_by_source.get(source_id, ())
+        if subentity_type is None:
+            return set(
+                medium_id for medium_id in medium_ids
+                if self._is_subscribed_individual(source_id, medium_id, entity_id)
+            )
+        return set(
+            medium_id for medium_id in medium_ids
+            if self._is_subscribed_group(source_id, medium_id, entity_id, _id(subentity_type))
+        )
+
+    def filter_not_subscribed(self, source, medium, entities):
+        """Return the ids of the entities `SubscriptionManager.filter_not_subscribed` would return.
+
+        The ids are returned as a list, in the order of the given
+        entities.
+        """
+        source_id, medium_id = _id(source), _id(medium)
+        return [
+            _id(entity) for entity in entities
+            if self._is_subscribed_individual(source_id, medium_id, _id(entity))
+        ]
+
+    def subscribed_entity_ids(self, source, medium):
+        """Return the ids of every entity subscribed to the source and medium, as a set.
+        """
+        source_id, medium_id = _id(source), _id(medium)
+        subscribed = set(self._individual.get((source_id, medium_id), ()))
+        for (group_source_id, group_medium_id, subentity_type_id), entity_ids in self._group.items():
+            if (group_source_id, group_medium_id) == (source_id, medium_id):
+                subscribed.update(
+                    sub_entity_id
+                    for entity_id in entity_ids
+                    for sub_entity_id in self._sub_entities.get(entity_id)
+                    if self._entity_type_id(sub_entity_id) == subentity_type_id
+                )
+        for key in self._unsubscribe_keys(source_id, medium_id):
+            subscribed.difference_update(self._unsubscribed.get(key, ()))
+        return subscribed
+
+    def _unsubscribe_keys(self, source_id, medium_id):
+        """Return the (source id, medium id) keys of the unsubscriptions applying to a source and medium.
+
+        Unsubscriptions from every source or every medium are held
+        under a None source or medium id.
+        """
+        return [
+            (unsubscribed_source_id, unsubscribed_medium_id)
+            for unsubscribed_source_id in (source_id, None)
+            for unsubscribed_medium_id in (medium_id, None)
+        ]
+
+    def _entity_type_id(self, entity_id):
+        index = bisect_left(self._entity_ids, entity_id)
+        if index < len(self._entity_ids) and self._entity_ids[index] == entity_id:
+            return self._entity_type_ids[index]
+        return None
+
+    def _is_subscribed_individual(self, source_id, medium_id, entity_id):
+        if any(
+            _contains(self._unsubscribed.get(key, ()), entity_id)
+            for key in self._unsubscribe_keys(source_id, medium_id)
+        ):
+            return False
+        if _contains(self._individual.get((source_id, medium_id), ()), entity_id):
+            return True
+        group_entity_ids = self._group.get((source_id, medium_id, self._entity_type_id(entity_id)), ())
+        return any(
+            _contains(group_entity_ids, super_entity_id)
+            for super_entity_id in self._super_entities.get(entity_id)
+        )
+
+    def _is_subscribed_group(self, source_id, medium_id, entity_id, subentity_type_id):
+        group_entity_ids = self._group.get((source_id, medium_id, subentity_type_id), ())
+        return any(
+            _contains(group_entity_ids, super_entity_id)
+            for sub_entity_id in self._sub_entities.get(entity_id)
+            if self._entity_type_id(sub_entity_id) == subentity_type_id
+            for super_entity_id in self._super_entities.get(sub_entity_id)
+        )
+
+
+def write_snapshot_file(path, mode=0o644):
+    """Write the effective subscriptions of every entity to a snapshot file, and return their number.
+
+    The file holds one fixed-width (source id, medium id, entity id)
+    record for each entity subscribed to a source and medium, after
+    group subscriptions are expanded and unsubscriptions removed, as
+    `SubscriptionManager.is_subscribed` decides without a
+    subentity_type. The subscriptions are computed one source at a
+    time, with three queries each.
+
+    The file is written to a temporary file in the same directory,
+    then renamed over the path, so that readers never see a partial
+    file. Readers that have the previous file open keep reading it
+    until they open the path again. The file, then the directory, are
+    synced to disk, so that the new file survives a crash.
+
+    The file is given the permission bits of `mode`, readable by every
+    user by default, so that workers running as other users can map
+    it.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + name, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(SNAPSHOT_FILE_MAGIC, SNAPSHOT_FILE_VERSION, 0))
+            count = 0
+            for source_id in Source.objects.order_by('id').values_list('id', flat=True):
+                for triple in sorted(Subscription.objects._subscribed_triples(source=source_id)):
+                    f.write(_RECORD.pack(*triple))
+                    count += 1
+            f.seek(0)
+            f.write(_HEADER.pack(SNAPSHOT_FILE_MAGIC, SNAPSHOT_FILE_VERSION, count))
+            f.flush()
+            # The temporary file is only readable by its owner
+            os.fchmod(f.fileno(), mode)
+            os.fsync(f.fileno())
+        os.rename(temp_path, path)
+        _fsync_directory(directory)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return count
+
+
+def _fsync_directory(directory):
+    """Sync a directory to disk, so that the files renamed into it are kept after a crash.
+    """
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class MappedSubscriptionSnapshot(object):
+    """A snapshot file written by `write_snapshot_file`, memory-mapped for reading.
+
+    Lookups are binary searches over the records of the file, which
+    are read straight from the mapped pages, without loading the file
+    into memory or querying the database. Processes on the same host
+    mapping the same file share its pages through the operating
+    system's page cache.
+
+    Only individual subscriptions are answered, as with a
+    subentity_type of None on the `SubscriptionManager`. Entities,
+    sources and mediums may be given as objects or as ids.
+    """
+    def __init__(self, path):
+        """Map a snapshot file.
+
+        Raises a `ValueError` if the file is not a snapshot file of
+        the current version.
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise ValueError('{0} is not a subscription snapshot file'.format(path))
+        magic, version, self._count = _HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_FILE_MAGIC or version != SNAPSHOT_FILE_VERSION:
+            self.close()
+            raise ValueError('{0} is not a version {1} subscription snapshot file'.format(path, SNAPSHOT_FILE_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        """Unmap the file.
+        """
+        self._map.close()
+
+    def is_subscribed(self, source, medium, entity):
+        """Return the answer of `SubscriptionManager.is_subscribed` without a subentity_type.
+        """
+        record = (_id(source), _id(medium), _id(entity))
+        index = self._lower_bound(record)
+        return index < self._count and self._record(index) == record
+
+    def mediums_subscribed(self, source, entity):
+        """Return the ids of the mediums the entity is subscribed to for the source, as a set.
+        """
+        source_id, entity_id = _id(source), _id(entity)
+        medium_ids = set()
+        index, end = self._lower_bound((source_id,)), self._lower_bound((source_id + 1,))
+        while index < end:
+            medium_id = self._record(index)[1]
+            if self.is_subscribed(source_id, medium_id, entity_id):
+                medium_ids.add(medium_id)
+            index = self._lower_bound((source_id, medium_id + 1))
+        return medium_ids
+
+    def filter_not_subscribed(self, source, medium, entities):
+        """Return the ids of the given entities subscribed to the source and medium, in their order.
+        """
+        source_id, medium_id = _id(source), _id(medium)
+        return [
+            _id(entity) for entity in entities
+            if self.is_subscribed(source_id, medium_id, _id(entity))
+        ]
+
+    def subscribed_entity_ids(self, source, medium):
+        """Yield the ids of every entity subscribed to the source and medium, in ascending order.
+        """
+        source_id, medium_id = _id(source), _id(medium)
+        index, end = self._lower_bound((source_id, medium_id)), self._lower_bound((source_id, medium_id + 1))
+        while index < end:
+            yield self._record(index)[2]
+            index += 1
+
+    def _record(self, index):
+        return _RECORD.unpack_from(self._map, _HEADER.size + index * _RECORD.size)
+
+    def _lower_bound(self, key):
+        """Return the index of the first record not sorting before the key.
+
+        A key shorter than a record compares before every record
+        starting with it.
+        """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
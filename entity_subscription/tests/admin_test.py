@@ -1,5 +1,10 @@
 from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django_dynamic_fixture import G
+from entity.models import Entity
+from mock import MagicMock, patch
 
 from entity_subscription import admin
 from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
@@ -8,9 +13,93 @@ from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
 class AdminTest(TestCase):
     def setUp(self):
         self.site = AdminSite()
+        self.user = G(User, is_superuser=True)
 
     def test_all_can_be_called(self):
         admin.MediumAdmin(Medium, self.site)
         admin.SourceAdmin(Source, self.site)
         admin.SubscriptionAdmin(Subscription, self.site)
         admin.UnsubscribeAdmin(Unsubscribe, self.site)
+
+    def get_changelist(self, model_admin, params=None):
+        request = RequestFactory().get('/', params or {})
+        request.user = self.user
+        return model_admin.get_changelist(request)(
+            request, model_admin.model, model_admin.list_display, model_admin.list_display_links,
+            model_admin.list_filter, model_admin.date_hierarchy, model_admin.search_fields,
+            model_admin.list_select_related, model_admin.list_per_page, model_admin.list_max_show_all,
+            model_admin.list_editable, model_admin,
+        )
+
+    def test_changelist_rows_joined(self):
+        for i in range(3):
+            G(Subscription, entity=G(Entity), source=G(Source), medium=G(Medium))
+        changelist = self.get_changelist(admin.SubscriptionAdmin(Subscription, self.site))
+        with self.assertNumQueries(1):
+            rows = [unicode(row) for row in changelist.result_list]
+        self.assertEqual(len(rows), 3)
+
+    def test_changelist_filtered_by_source(self):
+        unsubscribe = G(Unsubscribe)
+        G(Unsubscribe)
+        changelist = self.get_changelist(
+            admin.UnsubscribeAdmin(Unsubscribe, self.site), {'source__id__exact': unsubscribe.source_id}
+        )
+        self.assertEqual(list(changelist.result_list), [unsubscribe])
+        self.assertEqual(changelist.result_count, 1)
+        self.assertEqual(changelist.full_result_count, 2)
+
+    def test_filtered_changelist_estimates_full_count(self):
+        unsubscribe = G(Unsubscribe)
+        G(Unsubscribe)
+        model_admin = admin.UnsubscribeAdmin(Unsubscribe, self.site)
+        connection = MagicMock(vendor='postgresql')
+        connection.cursor.return_value.fetchone.return_value = (2.5e6,)
+        with patch('entity_subscription.admin.connections', {'default': connection}):
+            # The source and medium filter choices, and the filtered count
+            with self.assertNumQueries(3):
+                changelist = self.get_changelist(model_admin, {'source__id__exact': unsubscribe.source_id})
+        self.assertEqual(changelist.result_count, 1)
+        self.assertEqual(changelist.full_result_count, 2500000)
+        self.assertEqual(list(changelist.root_queryset.order_by('id')), list(Unsubscribe.objects.order_by('id')))
+
+    def test_filtered_small_table_counted_exactly(self):
+        unsubscribe = G(Unsubscribe)
+        G(Unsubscribe)
+        changelist = self.get_changelist(
+            admin.UnsubscribeAdmin(Unsubscribe, self.site), {'medium__id__exact': unsubscribe.medium_id}
+        )
+        self.assertEqual(changelist.full_result_count, 2)
+
+
+class EstimatedCountPaginatorTest(TestCase):
+    def setUp(self):
+        G(Subscription)
+        G(Subscription)
+
+    def mock_postgresql(self, reltuples):
+        connection = MagicMock(vendor='postgresql')
+        connection.cursor.return_value.fetchone.return_value = reltuples
+        return patch('entity_subscription.admin.connections', {'default': connection})
+
+    def test_counted_exactly(self):
+        self.assertEqual(admin.EstimatedCountPaginator(Subscription.objects.all(), 10).count, 2)
+
+    def test_estimated(self):
+        with self.mock_postgresql((2.5e6,)):
+            paginator = admin.EstimatedCountPaginator(Subscription.objects.all(), 10)
+            self.assertEqual(paginator.count, 2500000)
+            self.assertEqual(paginator.num_pages, 250000)
+
+    def test_small_table_counted_exactly(self):
+        with self.mock_postgresql((1000.0,)):
+            self.assertEqual(admin.EstimatedCountPaginator(Subscription.objects.all(), 10).count, 2)
+
+    def test_missing_table_counted_exactly(self):
+        with self.mock_postgresql(None):
+            self.assertEqual(admin.EstimatedCountPaginator(Subscription.objects.all(), 10).count, 2)
+
+    def test_filtered_counted_exactly(self):
+        with self.mock_postgresql((2.5e6,)):
+            paginator = admin.EstimatedCountPaginator(Subscription.objects.filter(entity__isnull=False), 10)
+            self.assertEqual(paginator.count, 2)
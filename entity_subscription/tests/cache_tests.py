@@ -0,0 +1,318 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.test.utils import override_settings
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship
+from mock import patch
+
+from entity_subscription.cache import SharedSubscriptionCache, SubscriptionCache
+from entity_subscription.models import (
+    EntityClosure, Medium, Source, Subscription, Unsubscribe, relationships_synced
+)
+
+
+class SubscriptionCacheTest(TestCase):
+    def setUp(self):
+        self.ct = G(ContentType)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        self.other_source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_type=self.ct)
+        self.other_e = G(Entity, entity_type=self.ct)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.sub_e)
+        G(Subscription, entity=self.super_e, source=self.source, medium=self.medium, subentity_type=self.ct)
+        self.cache = SubscriptionCache()
+
+    def test_is_subscribed_cached(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_names(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.mediums_subscribed(self.source, self.sub_e)
+        # One query to load each registry
+        with self.assertNumQueries(2):
+            self.assertTrue(self.cache.is_subscribed(self.source.name, self.medium.name, self.sub_e))
+            self.assertEqual(self.cache.mediums_subscribed(self.source.name, self.sub_e), [self.medium])
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_ids(self):
+        self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.cache.is_subscribed(self.source.id, self.medium.id, self.super_e.id, self.ct.id))
+
+    def test_is_subscribed_group_cached(self):
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct))
+
+    def test_mediums_subscribed_cached(self):
+        self.assertEqual(self.cache.mediums_subscribed(self.source, self.sub_e), [self.medium])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.mediums_subscribed(self.source, self.sub_e), [self.medium])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_unsubscribe_invalidates_entity(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+        G(Unsubscribe, entity=self.sub_e, source=self.source, medium=self.medium)
+        self.assertEqual(len(self.cache), 2)
+        self.assertFalse(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+
+    def test_unsubscribe_delete_invalidates_entity(self):
+        unsubscribe = G(Unsubscribe, entity=self.sub_e, source=self.source, medium=self.medium)
+        self.assertFalse(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        unsubscribe.delete()
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+
+    def test_wildcard_unsubscribe_invalidates_every_source(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.other_source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        G(Unsubscribe, entity=self.sub_e, source=None, medium=self.medium)
+        self.assertEqual(len(self.cache), 1)
+        self.assertFalse(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+
+    def test_bulk_wildcard_unsubscribe_invalidates_every_source(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.other_source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        Unsubscribe.objects.bulk_unsubscribe([Unsubscribe(entity=self.sub_e, source=None, medium=None)])
+        self.assertEqual(len(self.cache), 1)
+        self.assertFalse(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+
+    def test_subscription_invalidates_source(self):
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.other_source, self.medium, self.other_e)
+        G(Subscription, entity=self.other_e, source=self.source, medium=self.medium, subentity_type=None)
+        self.assertEqual(len(self.cache), 1)
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.other_e))
+
+    def test_relationship_invalidates_sub_entity_and_groups(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.other_e)
+        self.assertEqual(len(self.cache), 1)
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.other_e))
+
+    @override_settings(ENTITY_SUBSCRIPTION_CLOSURE=True)
+    def test_relationship_invalidates_entities_below_with_closure(self):
+        EntityClosure.objects.rebuild()
+        company = G(Entity)
+        G(EntityRelationship, super_entity=company, sub_entity=self.super_e)
+        G(Subscription, entity=company, source=self.other_source, medium=self.medium, subentity_type=self.ct)
+        self.assertTrue(self.cache.is_subscribed(self.other_source, self.medium, self.sub_e))
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        EntityRelationship.objects.get(super_entity=company).delete()
+        self.assertEqual(len(self.cache), 1)
+        self.assertFalse(self.cache.is_subscribed(self.other_source, self.medium, self.sub_e))
+        self.assertFalse(Subscription.objects.is_subscribed(self.other_source, self.medium, self.sub_e))
+
+    def test_synced_relationships_invalidate_sub_entities_and_groups(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+        EntityRelationship.objects.bulk_create([EntityRelationship(super_entity=self.super_e, sub_entity=self.other_e)])
+        relationships_synced([self.other_e])
+        self.assertEqual(len(self.cache), 1)
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.other_e))
+
+    def test_bulk_subscribe_invalidates_sources(self):
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.other_source, self.medium, self.other_e)
+        Subscription.objects.bulk_subscribe([
+            Subscription(entity=self.other_e, source=self.source, medium=self.medium, subentity_type=None)
+        ])
+        self.assertEqual(len(self.cache), 1)
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.other_e))
+
+    def test_bulk_unsubscribe_invalidates_entities(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.other_source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+        unsubscribes = [Unsubscribe(entity=self.sub_e, source=self.source, medium=self.medium)]
+        Unsubscribe.objects.bulk_unsubscribe(unsubscribes)
+        self.assertEqual(len(self.cache), 3)
+        self.assertFalse(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        Unsubscribe.objects.bulk_resubscribe(unsubscribes)
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+
+    def test_edit_clears_cache(self):
+        unsubscribe = G(Unsubscribe, entity=self.other_e, source=self.source, medium=self.medium)
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        unsubscribe.entity = self.sub_e
+        unsubscribe.save()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidation_during_compute_not_stored(self):
+        def is_subscribed(*args):
+            self.cache.clear()
+            return True
+
+        with patch.object(self.cache.manager, 'is_subscribed', side_effect=is_subscribed):
+            self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        self.assertEqual(len(self.cache), 0)
+
+    @patch('entity_subscription.cache.time.time')
+    def test_ttl_expiry(self, time_mock):
+        cache = SubscriptionCache(ttl=10)
+        time_mock.return_value = 100
+        cache.is_subscribed(self.source, self.medium, self.sub_e)
+        time_mock.return_value = 109
+        cache.is_subscribed(self.source, self.medium, self.sub_e)
+        time_mock.return_value = 111
+        cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_no_ttl(self):
+        cache = SubscriptionCache(ttl=None)
+        cache.is_subscribed(self.source, self.medium, self.sub_e)
+        cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.assertEqual(cache.hits, 1)
+
+    def test_lru_eviction(self):
+        cache = SubscriptionCache(max_size=2)
+        cache.is_subscribed(self.source, self.medium, self.sub_e)
+        cache.is_subscribed(self.source, self.medium, self.other_e)
+        # Touch sub_e so that other_e is the least recently used
+        cache.is_subscribed(self.source, self.medium, self.sub_e)
+        cache.is_subscribed(self.source, self.medium, self.super_e)
+        self.assertEqual(len(cache), 2)
+        with self.assertNumQueries(0):
+            cache.is_subscribed(self.source, self.medium, self.sub_e)
+
+
+class SharedSubscriptionCacheTest(TestCase):
+    def setUp(self):
+        self.ct = G(ContentType)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        self.other_source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_type=self.ct)
+        self.other_e = G(Entity, entity_type=self.ct)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.sub_e)
+        G(Subscription, entity=self.super_e, source=self.source, medium=self.medium, subentity_type=self.ct)
+        self.cache = SharedSubscriptionCache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.cache.clear()
+
+    def test_is_subscribed_cached(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_false_result_cached(self):
+        self.assertFalse(self.cache.is_subscribed(self.other_source, self.medium, self.sub_e))
+        with self.assertNumQueries(0):
+            self.assertFalse(self.cache.is_subscribed(self.other_source, self.medium, self.sub_e))
+
+    def test_shared_between_instances(self):
+        other_cache = SharedSubscriptionCache('django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(self.cache.mediums_subscribed(self.source, self.sub_e), [self.medium])
+        with self.assertNumQueries(0):
+            self.assertEqual(other_cache.mediums_subscribed(self.source, self.sub_e), [self.medium])
+
+    def test_group_cached(self):
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct))
+
+    def test_unsubscribe_bumps_entity(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        G(Unsubscribe, entity=self.sub_e, source=self.source, medium=self.medium)
+        self.assertFalse(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        with self.assertNumQueries(0):
+            self.cache.is_subscribed(self.source, self.medium, self.other_e)
+
+    def test_subscription_bumps_source(self):
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.other_source, self.medium, self.other_e)
+        G(Subscription, entity=self.other_e, source=self.source, medium=self.medium, subentity_type=None)
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.other_e))
+        with self.assertNumQueries(0):
+            self.cache.is_subscribed(self.other_source, self.medium, self.other_e)
+
+    @override_settings(ENTITY_SUBSCRIPTION_CLOSURE=True)
+    def test_relationship_bumps_entities_below_with_closure(self):
+        EntityClosure.objects.rebuild()
+        company = G(Entity)
+        G(EntityRelationship, super_entity=company, sub_entity=self.super_e)
+        G(Subscription, entity=company, source=self.other_source, medium=self.medium, subentity_type=self.ct)
+        self.assertTrue(self.cache.is_subscribed(self.other_source, self.medium, self.sub_e))
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        EntityRelationship.objects.get(super_entity=company).delete()
+        self.assertFalse(self.cache.is_subscribed(self.other_source, self.medium, self.sub_e))
+        with self.assertNumQueries(0):
+            self.cache.is_subscribed(self.source, self.medium, self.other_e)
+
+    def test_relationship_bumps_sub_entity_and_groups(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.other_e)
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.other_e))
+        with self.assertNumQueries(0):
+            self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        with self.assertNumQueries(1):
+            self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+
+    def test_synced_relationships_bump_sub_entities_and_groups(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+        EntityRelationship.objects.bulk_create([EntityRelationship(super_entity=self.super_e, sub_entity=self.other_e)])
+        relationships_synced([self.other_e])
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.other_e))
+        with self.assertNumQueries(0):
+            self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        with self.assertNumQueries(1):
+            self.cache.is_subscribed(self.source, self.medium, self.super_e, self.ct)
+
+    def test_bulk_subscribe_bumps_sources(self):
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        self.cache.is_subscribed(self.other_source, self.medium, self.other_e)
+        Subscription.objects.bulk_subscribe([
+            Subscription(entity=self.other_e, source=self.source, medium=self.medium, subentity_type=None)
+        ])
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.other_e))
+        with self.assertNumQueries(0):
+            self.cache.is_subscribed(self.other_source, self.medium, self.other_e)
+
+    def test_bulk_unsubscribe_bumps_entities(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        unsubscribes = [Unsubscribe(entity=self.sub_e, source=self.source, medium=self.medium)]
+        Unsubscribe.objects.bulk_unsubscribe(unsubscribes)
+        self.assertFalse(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+        with self.assertNumQueries(0):
+            self.cache.is_subscribed(self.source, self.medium, self.other_e)
+        Unsubscribe.objects.bulk_resubscribe(unsubscribes)
+        self.assertTrue(self.cache.is_subscribed(self.source, self.medium, self.sub_e))
+
+    def test_edit_clears_cache(self):
+        unsubscribe = G(Unsubscribe, entity=self.other_e, source=self.source, medium=self.medium)
+        subscription = G(Subscription, entity=self.other_e, source=self.other_source, medium=self.medium)
+        relationship = G(EntityRelationship, super_entity=self.other_e, sub_entity=self.super_e)
+        for row in [unsubscribe, subscription, relationship]:
+            self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+            row.save()
+            with self.assertNumQueries(1):
+                self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+
+    def test_evicted_generation_does_not_revive_entries(self):
+        self.cache.is_subscribed(self.source, self.medium, self.sub_e)
+        self.cache.cache.delete(self.cache._generation_key('entity', self.sub_e.id))
+        with patch('entity_subscription.cache.time.time', return_value=10 ** 10):
+            self.cache._bump_generation(self.cache._generation_key('entity', self.sub_e.id))
+            with self.assertNumQueries(1):
+                self.cache.is_subscribed(self.source, self.medium, self.sub_e)
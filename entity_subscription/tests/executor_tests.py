@@ -0,0 +1,82 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.test import TestCase
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship
+from mock import MagicMock, patch
+
+from entity_subscription.executor import SubscriptionExecutor, _close_connections
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+def share_connection(connection):
+    """Use the test database connection in a worker thread, since an in-memory database is per connection.
+    """
+    connections[connection.alias] = connection
+
+
+class SubscriptionExecutorTest(TestCase):
+    def setUp(self):
+        # The test connection is shared with the worker, so it must not be closed
+        for name in ['close_old_connections', '_close_connections']:
+            patcher = patch('entity_subscription.executor.' + name)
+            setattr(self, name + '_mock', patcher.start())
+            self.addCleanup(patcher.stop)
+        self.ct = G(ContentType)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_type=self.ct)
+        self.other_e = G(Entity, entity_type=self.ct)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.sub_e)
+        G(Subscription, entity=self.super_e, source=self.source, medium=self.medium, subentity_type=self.ct)
+        G(Unsubscribe, entity=self.other_e, source=self.source, medium=self.medium)
+
+        connection = connections['default']
+        connection.allow_thread_sharing = True
+        self.addCleanup(setattr, connection, 'allow_thread_sharing', False)
+        # A single thread, since the threads share one connection
+        self.executor = SubscriptionExecutor(max_workers=1, initializer=share_connection, initargs=(connection,))
+        self.addCleanup(self.executor.shutdown)
+
+    def test_is_subscribed(self):
+        self.assertTrue(self.executor.is_subscribed(self.source, self.medium, self.sub_e).get(timeout=5))
+        self.assertTrue(self.executor.is_subscribed(self.source, self.medium, self.super_e, self.ct).get(timeout=5))
+
+    def test_connection_kept_until_shutdown(self):
+        self.executor.is_subscribed(self.source, self.medium, self.sub_e).get(timeout=5)
+        self.executor.is_unsubscribed(self.source, self.medium, self.sub_e).get(timeout=5)
+        self.assertFalse(self.close_old_connections_mock.called)
+        self.assertFalse(self._close_connections_mock.called)
+        self.executor.shutdown()
+        self._close_connections_mock.assert_called_once_with(set([connections['default']]))
+
+    def test_mediums_subscribed(self):
+        result = self.executor.mediums_subscribed(self.source, self.sub_e)
+        self.assertEqual(result.get(timeout=5), [self.medium])
+
+    def test_filter_not_subscribed(self):
+        result = self.executor.filter_not_subscribed(self.source, self.medium, [self.sub_e, self.other_e])
+        self.assertEqual(result.get(timeout=5), [self.sub_e])
+
+    def test_is_unsubscribed(self):
+        results = [
+            self.executor.is_unsubscribed(self.source, self.medium, entity)
+            for entity in [self.sub_e, self.other_e]
+        ]
+        self.assertEqual([result.get(timeout=5) for result in results], [False, True])
+
+    def test_error_raised_and_connection_released(self):
+        with patch.object(Subscription.objects, 'is_subscribed', side_effect=ValueError):
+            result = self.executor.is_subscribed(self.source, self.medium, self.sub_e)
+            with self.assertRaises(ValueError):
+                result.get(timeout=5)
+        self.assertEqual(self.close_old_connections_mock.call_count, 1)
+
+
+class CloseConnectionsTest(TestCase):
+    def test_close_connections(self):
+        connection = MagicMock(allow_thread_sharing=False)
+        _close_connections([connection])
+        self.assertTrue(connection.allow_thread_sharing)
+        connection.close.assert_called_once_with()
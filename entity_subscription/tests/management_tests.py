@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django_dynamic_fixture import G
+from entity.models import Entity
+
+from entity_subscription.models import EffectiveSubscription, Medium, Source, Subscription, Unsubscribe
+from entity_subscription.snapshot import MappedSubscriptionSnapshot
+
+
+class RebuildEffectiveSubscriptionsTest(TestCase):
+    def setUp(self):
+        self.entity = G(Entity)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        with override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=False):
+            G(Subscription, entity=self.entity, source=self.source, medium=self.medium, subentity_type=None)
+
+    def test_verify_out_of_date(self):
+        with self.assertRaises(CommandError):
+            call_command('rebuild_effective_subscriptions', verify=True)
+
+    def test_rebuild_and_verify(self):
+        call_command('rebuild_effective_subscriptions')
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source, self.medium, self.entity))
+        call_command('rebuild_effective_subscriptions', verify=True)
+
+
+class WriteSubscriptionSnapshotTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_write(self):
+        entity, source, medium = G(Entity), G(Source), G(Medium)
+        G(Subscription, entity=entity, source=source, medium=medium, subentity_type=None)
+        path = os.path.join(self.directory, 'subscriptions.snapshot')
+        stdout = StringIO()
+        call_command('write_subscription_snapshot', path, stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'Wrote 1 subscriptions to {0}.'.format(path))
+        with MappedSubscriptionSnapshot(path) as snapshot:
+            self.assertTrue(snapshot.is_subscribed(source, medium, entity))
+
+    def test_path_required(self):
+        with self.assertRaises(CommandError):
+            call_command('write_subscription_snapshot')
+
+
+class CollapseUnsubscribesTest(TestCase):
+    def test_collapse(self):
+        entity, source = G(Entity), G(Source)
+        G(Source)
+        for medium in [G(Medium), G(Medium)]:
+            G(Unsubscribe, entity=entity, source=source, medium=medium)
+        stdout = StringIO()
+        call_command('collapse_unsubscribes', stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'Removed 1 unsubscriptions.')
+        self.assertEqual(list(Unsubscribe.objects.values_list('source', 'medium')), [(source.id, None)])
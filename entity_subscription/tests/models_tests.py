@@ -1,10 +1,22 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 from django_dynamic_fixture import G, N
 from entity.models import Entity, EntityRelationship
-from mock import patch
+from mock import MagicMock, patch
 
-from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+from entity_subscription.models import (
+    EffectiveSubscription, EntityClosure, Medium, Source, Subscription, SubscriptionChange, Unsubscribe,
+    relationships_synced,
+)
+from entity_subscription.signals import bulk_changed
 
 
 class SubscriptionManagerMediumsSubscribedTest(TestCase):
@@ -303,10 +315,293 @@ class SubscriptionFilterNotSubscribedTest(TestCase):
         filtered_entities = Subscription.objects.filter_not_subscribed(self.source, self.medium, entities)
         self.assertEqual(set(filtered_entities), set(entities))
 
-    def test_different_entity_types_raises_error(self):
-        entities = [self.sub_e1, self.super_e1]
-        with self.assertRaises(ValueError):
-            Subscription.objects.filter_not_subscribed(self.source, self.medium, entities)
+    def test_different_entity_types(self):
+        super_super_e = G(Entity)
+        G(EntityRelationship, sub_entity=self.super_e1, super_entity=super_super_e)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=super_super_e)
+        G(Subscription, entity=super_super_e, source=self.source, medium=self.medium, subentity_type=self.super_ct)
+        G(Subscription, entity=self.super_e2, source=self.source, medium=self.medium, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.ind_e1, source=self.source, medium=self.medium, subentity_type=None)
+        G(Unsubscribe, entity=self.sub_e4, source=self.source, medium=self.medium)
+        entities = [self.sub_e1, self.super_e1, self.super_e2, self.sub_e3, self.sub_e4, self.ind_e1]
+        with self.assertNumQueries(1):
+            filtered_entities = set(Subscription.objects.filter_not_subscribed(self.source, self.medium, entities))
+        # sub_e1 is a sub-entity of super_super_e, but of the wrong type for its group subscription
+        self.assertEqual(filtered_entities, set([self.super_e1, self.sub_e3, self.ind_e1]))
+
+    def test_no_entities(self):
+        self.assertEqual(list(Subscription.objects.filter_not_subscribed(self.source, self.medium, [])), [])
+
+
+class SubscriptionFilterNotSubscribedMediumsTest(TestCase):
+    def setUp(self):
+        self.super_ct = G(ContentType)
+        self.sub_ct = G(ContentType)
+        self.super_e1 = G(Entity, entity_type=self.super_ct)
+        self.sub_e1 = G(Entity, entity_type=self.sub_ct)
+        self.sub_e2 = G(Entity, entity_type=self.sub_ct)
+        self.ind_e1 = G(Entity, entity_type=self.sub_ct)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.medium_3 = G(Medium)
+        self.source = G(Source)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e1)
+
+    def test_subscriptions_grouped_by_medium(self):
+        G(Subscription, entity=self.super_e1, source=self.source, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.ind_e1, source=self.source, medium=self.medium_2, subentity_type=None)
+        G(Unsubscribe, entity=self.sub_e2, source=self.source, medium=self.medium_1)
+        entities = [self.sub_e1, self.sub_e2, self.ind_e1]
+        subscribed = Subscription.objects.filter_not_subscribed_mediums(
+            self.source, [self.medium_1, self.medium_2, self.medium_3], entities
+        )
+        expected = {
+            self.medium_1: set([self.sub_e1.id]),
+            self.medium_2: set([self.ind_e1.id]),
+            self.medium_3: set(),
+        }
+        self.assertEqual(subscribed, expected)
+
+    def test_matches_filter_not_subscribed(self):
+        G(Subscription, entity=self.super_e1, source=self.source, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.super_e1, source=self.source, medium=self.medium_2, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.ind_e1, source=G(Source), medium=self.medium_2, subentity_type=None)
+        G(Unsubscribe, entity=self.sub_e1, source=self.source, medium=self.medium_2)
+        entities = [self.sub_e1, self.sub_e2, self.ind_e1]
+        subscribed = Subscription.objects.filter_not_subscribed_mediums(
+            self.source, [self.medium_1, self.medium_2], entities
+        )
+        for medium in [self.medium_1, self.medium_2]:
+            expected = Subscription.objects.filter_not_subscribed(self.source, medium, entities)
+            self.assertEqual(subscribed[medium], set(expected.values_list('id', flat=True)))
+
+    def test_query_count_independent_of_mediums(self):
+        entities = [self.sub_e1, self.sub_e2, self.ind_e1]
+        with self.assertNumQueries(3):
+            Subscription.objects.filter_not_subscribed_mediums(
+                self.source, [self.medium_1, self.medium_2, self.medium_3], entities
+            )
+
+
+class SubscriptionMatrixTest(TestCase):
+    def setUp(self):
+        self.super_ct = G(ContentType)
+        self.sub_ct = G(ContentType)
+        self.super_e = G(Entity, entity_type=self.super_ct)
+        self.sub_e = G(Entity, entity_type=self.sub_ct)
+        self.ind_e = G(Entity, entity_type=self.sub_ct)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        G(EntityRelationship, sub_entity=self.sub_e, super_entity=self.super_e)
+
+    def test_matrix(self):
+        G(Subscription, entity=self.super_e, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.super_e, source=self.source_1, medium=self.medium_2, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.super_e, source=self.source_2, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.sub_e, source=self.source_2, medium=self.medium_2, subentity_type=None)
+        G(Subscription, entity=self.ind_e, source=self.source_1, medium=self.medium_1, subentity_type=None)
+        G(Unsubscribe, entity=self.sub_e, source=self.source_1, medium=self.medium_2)
+        with self.assertNumQueries(3):
+            matrix = Subscription.objects.subscription_matrix([self.super_e, self.sub_e, self.ind_e])
+        self.assertEqual(matrix, {
+            self.super_e.id: {},
+            self.sub_e.id: {
+                self.source_1.id: set([self.medium_1.id]),
+                self.source_2.id: set([self.medium_1.id, self.medium_2.id]),
+            },
+            self.ind_e.id: {self.source_1.id: set([self.medium_1.id])},
+        })
+
+    def test_wrong_subentity_type_ignored(self):
+        G(Subscription, entity=self.super_e, source=self.source_1, medium=self.medium_1, subentity_type=self.super_ct)
+        self.assertEqual(Subscription.objects.subscription_matrix([self.sub_e]), {self.sub_e.id: {}})
+
+    def test_matches_mediums_subscribed(self):
+        G(Subscription, entity=self.super_e, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.sub_e, source=self.source_2, medium=self.medium_2, subentity_type=None)
+        G(Unsubscribe, entity=self.sub_e, source=self.source_2, medium=self.medium_2)
+        matrix = Subscription.objects.subscription_matrix([self.sub_e])
+        for source in [self.source_1, self.source_2]:
+            expected = set(m.id for m in Subscription.objects.mediums_subscribed(source, self.sub_e))
+            self.assertEqual(matrix[self.sub_e.id].get(source.id, set()), expected)
+
+
+class SubscriptionIsSubscribedManyTest(TestCase):
+    def setUp(self):
+        self.super_ct = G(ContentType)
+        self.sub_ct = G(ContentType)
+        self.super_e1 = G(Entity, entity_type=self.super_ct)
+        self.super_e2 = G(Entity, entity_type=self.super_ct)
+        self.sub_e1 = G(Entity, entity_type=self.sub_ct)
+        self.sub_e2 = G(Entity, entity_type=self.sub_ct)
+        self.ind_e = G(Entity, entity_type=self.sub_ct)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e2)
+        G(Subscription, entity=self.super_e2, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.super_e1, source=self.source_2, medium=self.medium_2, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.ind_e, source=self.source_1, medium=self.medium_2, subentity_type=None)
+        G(Unsubscribe, entity=self.sub_e2, source=self.source_1, medium=self.medium_1)
+
+    def test_matches_is_subscribed(self):
+        checks = []
+        for source in [self.source_1, self.source_2]:
+            for medium in [self.medium_1, self.medium_2]:
+                for entity in [self.sub_e1, self.sub_e2, self.ind_e, self.super_e1]:
+                    checks.append((source, medium, entity))
+                for entity in [self.super_e1, self.super_e2, self.sub_e1]:
+                    checks.append((source, medium, entity, self.sub_ct))
+        expected = [Subscription.objects.is_subscribed(*check) for check in checks]
+        self.assertIn(True, expected)
+        with self.assertNumQueries(4):
+            self.assertEqual(Subscription.objects.is_subscribed_many(checks), expected)
+
+    def test_individual_only(self):
+        checks = [(self.source_1, self.medium_2, self.ind_e), (self.source_1, self.medium_1, self.sub_e2)]
+        with self.assertNumQueries(3):
+            self.assertEqual(Subscription.objects.is_subscribed_many(checks), [True, False])
+
+    def test_group_only(self):
+        checks = [
+            (self.source_1, self.medium_1, self.super_e1, self.sub_ct),
+            (self.source_1, self.medium_1, self.super_e1, self.super_ct),
+        ]
+        with self.assertNumQueries(1):
+            self.assertEqual(Subscription.objects.is_subscribed_many(checks), [True, False])
+
+    def test_no_checks(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(Subscription.objects.is_subscribed_many([]), [])
+
+
+class SubscriptionSubscribedEntityIdsTest(TestCase):
+    def setUp(self):
+        self.super_ct = G(ContentType)
+        self.sub_ct = G(ContentType)
+        self.other_ct = G(ContentType)
+        self.super_e1 = G(Entity, entity_type=self.super_ct)
+        self.super_e2 = G(Entity, entity_type=self.super_ct)
+        self.sub_e1 = G(Entity, entity_type=self.sub_ct)
+        self.sub_e2 = G(Entity, entity_type=self.sub_ct)
+        self.sub_e3 = G(Entity, entity_type=self.sub_ct)
+        self.other_e1 = G(Entity, entity_type=self.other_ct)
+        self.ind_e1 = G(Entity, entity_type=self.sub_ct)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.other_e1, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e3, super_entity=self.super_e2)
+
+    def test_group_and_individual_subscription(self):
+        G(Subscription, entity=self.ind_e1, source=self.source, medium=self.medium, subentity_type=None)
+        G(Subscription, entity=self.super_e1, source=self.source, medium=self.medium, subentity_type=self.sub_ct)
+        entity_ids = Subscription.objects.subscribed_entity_ids(self.source, self.medium)
+        self.assertEqual(set(entity_ids), set([self.sub_e1.id, self.sub_e2.id, self.ind_e1.id]))
+
+    def test_unsubscribe_filtered_out(self):
+        G(Subscription, entity=self.super_e1, source=self.source, medium=self.medium, subentity_type=self.sub_ct)
+        G(Unsubscribe, entity=self.sub_e1, source=self.source, medium=self.medium)
+        entity_ids = Subscription.objects.subscribed_entity_ids(self.source, self.medium)
+        self.assertEqual(set(entity_ids), set([self.sub_e2.id]))
+
+    def test_filters_source_and_medium(self):
+        G(Subscription, entity=self.super_e1, source=self.source, medium=G(Medium), subentity_type=self.sub_ct)
+        G(Subscription, entity=self.ind_e1, source=G(Source), medium=self.medium, subentity_type=None)
+        entity_ids = Subscription.objects.subscribed_entity_ids(self.source, self.medium)
+        self.assertEqual(set(entity_ids), set())
+
+    def test_filters_super_entities(self):
+        G(Subscription, entity=self.ind_e1, source=self.source, medium=self.medium, subentity_type=None)
+        G(Subscription, entity=self.super_e1, source=self.source, medium=self.medium, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.super_e2, source=self.source, medium=self.medium, subentity_type=self.sub_ct)
+        entity_ids = Subscription.objects.subscribed_entity_ids(
+            self.source, self.medium, super_entities=[self.super_e2]
+        )
+        self.assertEqual(set(entity_ids), set([self.sub_e3.id]))
+
+    def test_single_query(self):
+        G(Subscription, entity=self.ind_e1, source=self.source, medium=self.medium, subentity_type=None)
+        G(Subscription, entity=self.super_e1, source=self.source, medium=self.medium, subentity_type=self.sub_ct)
+        super_entities = Entity.objects.filter(id=self.super_e1.id)
+        with self.assertNumQueries(1):
+            list(Subscription.objects.subscribed_entity_ids(self.source, self.medium, super_entities).iterator())
+
+
+class SubscriptionIterSubscribedEntityIdsTest(TestCase):
+    def setUp(self):
+        self.super_ct = G(ContentType)
+        self.sub_ct = G(ContentType)
+        self.super_e = G(Entity, entity_type=self.super_ct)
+        self.sub_entities = [G(Entity, entity_type=self.sub_ct) for i in range(7)]
+        self.medium = G(Medium)
+        self.source = G(Source)
+        for sub_e in self.sub_entities:
+            G(EntityRelationship, sub_entity=sub_e, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, source=self.source, medium=self.medium, subentity_type=self.sub_ct)
+        G(Unsubscribe, entity=self.sub_entities[0], source=self.source, medium=self.medium)
+        self.subscribed_ids = [e.id for e in self.sub_entities[1:]]
+
+    def test_all_entities(self):
+        chunks = list(Subscription.objects.iter_subscribed_entity_ids(self.source, self.medium, chunk_size=4))
+        self.assertEqual(chunks, [self.subscribed_ids[:4], self.subscribed_ids[4:]])
+
+    def test_queryset_keyset_pagination(self):
+        candidates = Entity.objects.filter(entity_type=self.sub_ct).values_list('id', flat=True)
+        with self.assertNumQueries(2):
+            chunks = list(Subscription.objects.iter_subscribed_entity_ids(
+                self.source, self.medium, candidates, chunk_size=4
+            ))
+        self.assertEqual(chunks, [self.subscribed_ids[:4], self.subscribed_ids[4:]])
+
+    def test_exact_pages_stop_on_empty_page(self):
+        candidates = Entity.objects.filter(id__in=self.subscribed_ids[:4])
+        with self.assertNumQueries(3):
+            chunks = list(Subscription.objects.iter_subscribed_entity_ids(
+                self.source, self.medium, candidates, chunk_size=2
+            ))
+        self.assertEqual(chunks, [self.subscribed_ids[:2], self.subscribed_ids[2:4]])
+
+    def test_generator_of_ids(self):
+        candidates = (e.id for e in self.sub_entities + [self.super_e])
+        with self.assertNumQueries(2):
+            chunks = list(Subscription.objects.iter_subscribed_entity_ids(
+                self.source, self.medium, candidates, chunk_size=4
+            ))
+        self.assertEqual(chunks, [self.subscribed_ids[:4], self.subscribed_ids[4:]])
+
+    def test_no_subscribed_entities(self):
+        chunks = list(Subscription.objects.iter_subscribed_entity_ids(
+            self.source, self.medium, [self.super_e.id, self.sub_entities[0].id]
+        ))
+        self.assertEqual(chunks, [])
+
+
+class UniqueConstraintsTest(TestCase):
+    def setUp(self):
+        self.entity, self.source, self.medium = G(Entity), G(Source), G(Medium)
+
+    def test_duplicate_unsubscribe(self):
+        G(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Unsubscribe.objects.create(entity=self.entity, source=self.source, medium=self.medium)
+
+    def test_duplicate_group_subscription(self):
+        ct = G(ContentType)
+        G(Subscription, entity=self.entity, source=self.source, medium=self.medium, subentity_type=ct)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Subscription.objects.create(
+                    entity=self.entity, source=self.source, medium=self.medium, subentity_type=ct
+                )
 
 
 class UnsubscribeManagerIsUnsubscribed(TestCase):
@@ -322,6 +617,343 @@ class UnsubscribeManagerIsUnsubscribed(TestCase):
         self.assertFalse(is_unsubscribed)
 
 
+class WildcardUnsubscribeTest(TestCase):
+    def setUp(self):
+        self.ct = G(ContentType)
+        self.super_e = G(Entity)
+        self.entity = G(Entity, entity_type=self.ct)
+        self.other_e = G(Entity, entity_type=self.ct)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.entity)
+        self.s1, self.s2 = G(Source), G(Source)
+        self.m1, self.m2 = G(Medium), G(Medium)
+        for source in [self.s1, self.s2]:
+            for medium in [self.m1, self.m2]:
+                G(Subscription, entity=self.entity, source=source, medium=medium, subentity_type=None)
+                G(Subscription, entity=self.other_e, source=source, medium=medium, subentity_type=None)
+
+    def test_all_mediums(self):
+        G(Unsubscribe, entity=self.entity, source=self.s1, medium=None)
+        self.assertTrue(Unsubscribe.objects.is_unsubscribed(self.s1, self.m2, self.entity))
+        self.assertFalse(Unsubscribe.objects.is_unsubscribed(self.s2, self.m2, self.entity))
+        self.assertFalse(Subscription.objects.is_subscribed(self.s1, self.m1, self.entity))
+        self.assertTrue(Subscription.objects.is_subscribed(self.s2, self.m1, self.entity))
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.s1, self.entity)), [])
+        self.assertEqual(set(Subscription.objects.mediums_subscribed(self.s2, self.entity)), set([self.m1, self.m2]))
+
+    def test_all_sources(self):
+        G(Unsubscribe, entity=self.entity, source=None, medium=self.m1)
+        self.assertTrue(Unsubscribe.objects.is_unsubscribed(self.s2, self.m1, self.entity))
+        self.assertFalse(Unsubscribe.objects.is_unsubscribed(self.s2, self.m2, self.entity))
+        self.assertFalse(Subscription.objects.is_subscribed(self.s2, self.m1, self.entity))
+        self.assertTrue(Subscription.objects.is_subscribed(self.s2, self.m2, self.entity))
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.s1, self.entity)), [self.m2])
+        self.assertEqual(
+            list(Subscription.objects.filter_not_subscribed(self.s1, self.m1, [self.entity, self.other_e])),
+            [self.other_e]
+        )
+
+    def test_everything(self):
+        G(Unsubscribe, entity=self.entity, source=None, medium=None)
+        self.assertTrue(Unsubscribe.objects.is_unsubscribed(self.s2, self.m2, self.entity))
+        self.assertFalse(Subscription.objects.is_subscribed(self.s2, self.m2, self.entity))
+        self.assertEqual(set(Subscription.objects.subscribed_entity_ids(self.s1, self.m2)), set([self.other_e.id]))
+        self.assertEqual(Subscription.objects._subscribed_triples(entity_ids=[self.entity.id]), set())
+
+    def test_subscribed_triples(self):
+        G(Unsubscribe, entity=self.entity, source=self.s1, medium=None)
+        G(Unsubscribe, entity=self.entity, source=None, medium=self.m2)
+        self.assertEqual(
+            Subscription.objects._subscribed_triples(entity_ids=[self.entity.id]),
+            set([(self.s2.id, self.m1.id, self.entity.id)])
+        )
+        self.assertEqual(
+            Subscription.objects._subscribed_triples(source=self.s2.id, medium_ids=[self.m2.id]),
+            set([(self.s2.id, self.m2.id, self.other_e.id)])
+        )
+
+    @override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=True)
+    def test_effective_subscriptions(self):
+        EffectiveSubscription.objects.rebuild()
+        unsubscribe = G(Unsubscribe, entity=self.entity, source=None, medium=self.m1)
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.s2, self.m1, self.entity))
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.s2, self.m2, self.entity))
+        unsubscribe.delete()
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.s2, self.m1, self.entity))
+        self.assertEqual(EffectiveSubscription.objects.verify(), (set(), set()))
+
+    def test_unicode(self):
+        unsubscribe = G(Unsubscribe, entity=self.entity, source=None, medium=None)
+        self.assertEqual(
+            unsubscribe.__unicode__(),
+            '{0} from all sources by all mediums'.format(self.entity.__unicode__())
+        )
+
+
+class UnsubscribeCollapseTest(TestCase):
+    def setUp(self):
+        self.entity = G(Entity)
+        self.other_e = G(Entity)
+        self.s1, self.s2 = G(Source), G(Source)
+        self.m1, self.m2 = G(Medium), G(Medium)
+
+    def unsubscribe(self, entity, pairs):
+        for source, medium in pairs:
+            G(Unsubscribe, entity=entity, source=source, medium=medium)
+
+    def stored(self, entity):
+        return set(Unsubscribe.objects.filter(entity=entity).values_list('source', 'medium'))
+
+    def test_every_pair(self):
+        self.unsubscribe(self.entity, [(self.s1, self.m1), (self.s1, self.m2), (self.s2, self.m1), (self.s2, None)])
+        self.assertEqual(Unsubscribe.objects.collapse(), 3)
+        self.assertEqual(self.stored(self.entity), set([(None, None)]))
+
+    def test_full_source_and_medium(self):
+        self.unsubscribe(self.entity, [(self.s1, self.m1), (self.s1, self.m2), (self.s2, self.m1)])
+        self.assertEqual(Unsubscribe.objects.collapse(), 1)
+        self.assertEqual(self.stored(self.entity), set([(self.s1.id, None), (None, self.m1.id)]))
+        self.assertFalse(Subscription.objects.is_subscribed(self.s2, self.m1, self.entity))
+        self.assertFalse(Unsubscribe.objects.is_unsubscribed(self.s2, self.m2, self.entity))
+
+    def test_nothing_to_collapse(self):
+        self.unsubscribe(self.entity, [(self.s1, self.m1), (self.s2, self.m2)])
+        with patch('entity_subscription.models.bulk_changed.send') as send:
+            self.assertEqual(Unsubscribe.objects.collapse(), 0)
+        self.assertFalse(send.called)
+        self.assertEqual(self.stored(self.entity), set([(self.s1.id, self.m1.id), (self.s2.id, self.m2.id)]))
+
+    def test_batches(self):
+        self.unsubscribe(self.entity, [(self.s1, self.m1), (self.s1, self.m2)])
+        self.unsubscribe(self.other_e, [(self.s1, self.m1), (self.s2, self.m1)])
+        self.assertEqual(Unsubscribe.objects.collapse(batch_size=1), 2)
+        self.assertEqual(self.stored(self.entity), set([(self.s1.id, None)]))
+        self.assertEqual(self.stored(self.other_e), set([(None, self.m1.id)]))
+
+
+class RegistryManagerTest(TestCase):
+    def setUp(self):
+        self.medium = G(Medium, name='email')
+        self.source = G(Source, name='comments')
+        self.entity = G(Entity)
+        Medium.objects.clear_cache()
+
+    def test_get_by_name(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Medium.objects.get_by_name('email'), self.medium)
+            self.assertEqual(Medium.objects.get_by_name('email'), self.medium)
+
+    def test_get_by_id(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Medium.objects.get_by_name('email'), self.medium)
+            self.assertEqual(Medium.objects.get_by_id(self.medium.id), self.medium)
+
+    def test_does_not_exist(self):
+        with self.assertRaises(Medium.DoesNotExist):
+            Medium.objects.get_by_name('sms')
+
+    def test_reloaded_on_miss(self):
+        Medium.objects.get_by_name('email')
+        other_medium = Medium.objects.bulk_create([N(Medium, name='sms')])
+        self.assertEqual(Medium.objects.get_by_name('sms').name, other_medium[0].name)
+
+    def test_cleared_on_save(self):
+        Medium.objects.get_by_name('email')
+        self.medium.display_name = 'Email'
+        self.medium.save()
+        self.assertEqual(Medium.objects.get_by_name('email').display_name, 'Email')
+
+    def test_cleared_on_delete(self):
+        Medium.objects.get_by_name('email')
+        self.medium.delete()
+        with self.assertRaises(Medium.DoesNotExist):
+            Medium.objects.get_by_id(self.medium.id)
+
+    def test_separate_models(self):
+        self.assertEqual(Source.objects.get_by_name('comments'), self.source)
+        with self.assertRaises(Source.DoesNotExist):
+            Source.objects.get_by_name('email')
+
+    def test_names_in_manager_methods(self):
+        G(Subscription, entity=self.entity, source=self.source, medium=self.medium, subentity_type=None)
+        Medium.objects.get_by_name('email')
+        Source.objects.get_by_name('comments')
+        with self.assertNumQueries(1):
+            self.assertTrue(Subscription.objects.is_subscribed('comments', 'email', self.entity))
+        self.assertEqual(list(Subscription.objects.mediums_subscribed('comments', self.entity)), [self.medium])
+        self.assertEqual(
+            list(Subscription.objects.filter_not_subscribed('comments', 'email', [self.entity])), [self.entity]
+        )
+        self.assertEqual(
+            Subscription.objects.filter_not_subscribed_mediums('comments', ['email'], [self.entity]),
+            {self.medium: set([self.entity.id])}
+        )
+        self.assertEqual(Subscription.objects.is_subscribed_many([('comments', 'email', self.entity)]), [True])
+        self.assertEqual(list(Subscription.objects.subscribed_entity_ids('comments', 'email')), [self.entity.id])
+        self.assertEqual(
+            list(Subscription.objects.iter_subscribed_entity_ids('comments', 'email')), [[self.entity.id]]
+        )
+        self.assertFalse(Unsubscribe.objects.is_unsubscribed('comments', 'email', self.entity))
+
+
+class SubscriptionManagerIdsTest(TestCase):
+    def setUp(self):
+        self.ct = G(ContentType)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_type=self.ct)
+        self.unsubscribed_e = G(Entity, entity_type=self.ct)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.sub_e)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.unsubscribed_e)
+        G(Subscription, entity=self.super_e, source=self.source, medium=self.medium, subentity_type=self.ct)
+        G(Unsubscribe, entity=self.unsubscribed_e, source=self.source, medium=self.medium)
+
+    def test_is_subscribed(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(Subscription.objects.is_subscribed(self.source.id, self.medium.id, self.sub_e.id))
+        self.assertFalse(Subscription.objects.is_subscribed(self.source.id, self.medium.id, self.unsubscribed_e.id))
+        self.assertFalse(Subscription.objects.is_subscribed(self.source.id, self.medium.id, self.super_e.id))
+
+    def test_is_subscribed_group(self):
+        self.assertTrue(
+            Subscription.objects.is_subscribed(self.source.id, self.medium.id, self.super_e.id, self.ct.id)
+        )
+
+    def test_mediums_subscribed(self):
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.source.id, self.sub_e.id)), [self.medium])
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.source.id, self.unsubscribed_e.id)), [])
+        self.assertEqual(
+            list(Subscription.objects.mediums_subscribed(self.source.id, self.super_e.id, self.ct.id)), [self.medium]
+        )
+
+    def test_filter_not_subscribed(self):
+        entity_ids = [self.sub_e.id, self.unsubscribed_e.id]
+        self.assertEqual(
+            list(Subscription.objects.filter_not_subscribed(self.source.id, self.medium.id, entity_ids)), [self.sub_e]
+        )
+        self.assertEqual(
+            Subscription.objects.filter_not_subscribed_mediums(self.source.id, [self.medium.id], entity_ids),
+            {self.medium.id: set([self.sub_e.id])}
+        )
+
+    def test_subscription_matrix(self):
+        self.assertEqual(Subscription.objects.subscription_matrix([self.sub_e.id, self.unsubscribed_e.id]), {
+            self.sub_e.id: {self.source.id: set([self.medium.id])},
+            self.unsubscribed_e.id: {},
+        })
+
+    def test_is_subscribed_many(self):
+        self.assertEqual(Subscription.objects.is_subscribed_many([
+            (self.source.id, self.medium.id, self.sub_e.id),
+            (self.source.id, self.medium.id, self.unsubscribed_e.id),
+            (self.source.id, self.medium.id, self.super_e.id, self.ct.id),
+        ]), [True, False, True])
+
+    def test_subscribed_entity_ids(self):
+        self.assertEqual(
+            list(Subscription.objects.subscribed_entity_ids(self.source.id, self.medium.id, [self.super_e.id])),
+            [self.sub_e.id]
+        )
+
+    def test_is_unsubscribed(self):
+        self.assertTrue(Unsubscribe.objects.is_unsubscribed(self.source.id, self.medium.id, self.unsubscribed_e.id))
+
+
+class BulkWriteTest(TestCase):
+    def setUp(self):
+        self.ct = G(ContentType)
+        self.entities = [G(Entity) for i in range(3)]
+        self.medium = G(Medium)
+        self.source = G(Source)
+        self.other_source = G(Source)
+        self.receiver = MagicMock()
+        bulk_changed.connect(self.receiver)
+        self.addCleanup(bulk_changed.disconnect, self.receiver)
+
+    def test_default_batch_size(self):
+        subscriptions = [Subscription(entity=self.entities[0], source=self.source, medium=self.medium)]
+        unsubscribes = [Unsubscribe(entity=self.entities[0], source=self.source, medium=self.medium)]
+        with patch('entity_subscription.models._bulk_create_missing', return_value=[]) as create_missing:
+            Subscription.objects.bulk_subscribe(subscriptions)
+            Unsubscribe.objects.bulk_unsubscribe(unsubscribes)
+        with patch('entity_subscription.models._bulk_delete_matching', return_value=[]) as delete_matching:
+            Unsubscribe.objects.bulk_resubscribe(unsubscribes)
+        self.assertEqual([args[-1] for args, kwargs in create_missing.call_args_list], [500, 500])
+        self.assertEqual(delete_matching.call_args[0][-1], 500)
+
+    def test_bulk_subscribe(self):
+        G(Subscription, entity=self.entities[0], source=self.source, medium=self.medium, subentity_type=None)
+        G(Subscription, entity=self.entities[1], source=self.source, medium=self.medium, subentity_type=self.ct)
+        subscriptions = [
+            Subscription(entity=entity, source=self.source, medium=self.medium, subentity_type=subentity_type)
+            for entity in self.entities
+            for subentity_type in [None, self.ct]
+        ]
+        # Repeated subscriptions are only created once
+        subscriptions.append(
+            Subscription(entity=self.entities[2], source=self.source, medium=self.medium, subentity_type=None)
+        )
+        with self.assertNumQueries(4):
+            created = Subscription.objects.bulk_subscribe(subscriptions, batch_size=4)
+        self.assertEqual(created, [subscriptions[1], subscriptions[2], subscriptions[4], subscriptions[5]])
+        self.assertEqual(Subscription.objects.count(), 6)
+        self.assertEqual(self.receiver.call_count, 1)
+        self.assertEqual(self.receiver.call_args[1]['sender'], Subscription)
+        self.assertEqual(self.receiver.call_args[1]['rows'], created)
+        self.assertTrue(self.receiver.call_args[1]['created'])
+
+    def test_bulk_subscribe_nothing_created(self):
+        G(Subscription, entity=self.entities[0], source=self.source, medium=self.medium, subentity_type=self.ct)
+        created = Subscription.objects.bulk_subscribe([
+            Subscription(entity=self.entities[0], source=self.source, medium=self.medium, subentity_type=self.ct)
+        ])
+        self.assertEqual(created, [])
+        self.assertFalse(self.receiver.called)
+
+    def test_bulk_unsubscribe(self):
+        G(Unsubscribe, entity=self.entities[0], source=self.source, medium=self.medium)
+        unsubscribes = [
+            Unsubscribe(entity=entity, source=source, medium=self.medium)
+            for entity in self.entities
+            for source in [self.source, self.other_source]
+        ]
+        created = Unsubscribe.objects.bulk_unsubscribe(unsubscribes + unsubscribes)
+        self.assertEqual(created, unsubscribes[1:])
+        self.assertEqual(Unsubscribe.objects.count(), 6)
+        self.assertEqual(self.receiver.call_count, 1)
+        self.assertEqual(self.receiver.call_args[1]['sender'], Unsubscribe)
+
+    def test_bulk_unsubscribe_nothing_created(self):
+        self.assertEqual(Unsubscribe.objects.bulk_unsubscribe([]), [])
+        self.assertFalse(self.receiver.called)
+
+    def test_bulk_resubscribe(self):
+        kept = G(Unsubscribe, entity=self.entities[0], source=self.other_source, medium=self.medium)
+        removed = [
+            G(Unsubscribe, entity=entity, source=self.source, medium=self.medium)
+            for entity in self.entities
+        ]
+        post_delete_receiver = MagicMock()
+        post_delete.connect(post_delete_receiver, sender=Unsubscribe)
+        self.addCleanup(post_delete.disconnect, post_delete_receiver, sender=Unsubscribe)
+
+        resubscribes = [Unsubscribe(entity=entity, source=self.source, medium=self.medium) for entity in self.entities]
+        with self.assertNumQueries(4):
+            deleted = Unsubscribe.objects.bulk_resubscribe(resubscribes, batch_size=2)
+        self.assertEqual(set(deleted), set(removed))
+        self.assertEqual(list(Unsubscribe.objects.all()), [kept])
+        self.assertFalse(post_delete_receiver.called)
+        self.assertEqual(self.receiver.call_count, 1)
+        self.assertFalse(self.receiver.call_args[1]['created'])
+
+    def test_bulk_resubscribe_nothing_deleted(self):
+        deleted = Unsubscribe.objects.bulk_resubscribe([
+            Unsubscribe(entity=self.entities[0], source=self.source, medium=self.medium)
+        ])
+        self.assertEqual(deleted, [])
+        self.assertFalse(self.receiver.called)
+
+
 class NumberOfQueriesTests(TestCase):
     def test_query_count(self):
         ct = G(ContentType)
@@ -366,9 +998,17 @@ class NumberOfQueriesTests(TestCase):
             mediums = Subscription.objects._mediums_subscribed_group(source=s1, entity=e6, subentity_type=ct)
             list(mediums)
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):
             Subscription.objects._is_subscribed_individual(source=s1, medium=m1, entity=e1)
 
+        G(Unsubscribe, entity=e1, source=s1, medium=m2)
+        with self.assertNumQueries(1):
+            self.assertTrue(Subscription.objects.is_subscribed(source=s1, medium=m1, entity=e1))
+        with self.assertNumQueries(1):
+            self.assertFalse(Subscription.objects.is_subscribed(source=s1, medium=m2, entity=e1))
+        with self.assertNumQueries(1):
+            self.assertEqual(set(Subscription.objects.mediums_subscribed(source=s1, entity=e1)), set([m1, m3, m4, m5]))
+
         with self.assertNumQueries(1):
             Subscription.objects._is_subscribed_group(source=s1, medium=m1, entity=e6, subentity_type=ct)
 
@@ -406,3 +1046,449 @@ class UnicodeMethodTests(TestCase):
     def test_source_unicode(self):
         expected_unicode = 'Test'
         self.assertEqual(self.source.__unicode__(), expected_unicode)
+
+
+@override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=True)
+class EffectiveSubscriptionTest(TestCase):
+    def setUp(self):
+        self.super_ct = G(ContentType)
+        self.sub_ct = G(ContentType)
+        self.super_e1 = G(Entity, entity_type=self.super_ct)
+        self.super_e2 = G(Entity, entity_type=self.super_ct)
+        self.sub_e1 = G(Entity, entity_type=self.sub_ct)
+        self.sub_e2 = G(Entity, entity_type=self.sub_ct)
+        self.ind_e1 = G(Entity, entity_type=self.sub_ct)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e1)
+
+    def assertUpToDate(self):
+        self.assertEqual(EffectiveSubscription.objects.verify(), (set(), set()))
+
+    def test_group_subscription_materialized(self):
+        G(Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e2))
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.super_e1))
+        self.assertUpToDate()
+
+    def test_large_group_refreshed_in_batches(self):
+        scope = [(self.source_1.id, range(1200))]
+        with patch('entity_subscription.models._effective_subscription_scope', return_value=scope):
+            with patch.object(EffectiveSubscription.objects, 'refresh') as refresh:
+                G(Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1,
+                  subentity_type=self.sub_ct)
+        self.assertEqual(
+            [(args[0], len(args[1])) for args, kwargs in refresh.call_args_list],
+            [(self.source_1.id, 500), (self.source_1.id, 500), (self.source_1.id, 200)]
+        )
+
+    def test_individual_subscription_materialized(self):
+        G(Subscription, entity=self.ind_e1, source=self.source_1, medium=self.medium_1, subentity_type=None)
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.ind_e1))
+        self.assertUpToDate()
+
+    def test_names(self):
+        G(Subscription, entity=self.ind_e1, source=self.source_1, medium=self.medium_1, subentity_type=None)
+        source_name, medium_name = self.source_1.name, self.medium_1.name
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(source_name, medium_name, self.ind_e1))
+        self.assertEqual(
+            list(EffectiveSubscription.objects.mediums_subscribed(source_name, self.ind_e1)), [self.medium_1]
+        )
+        self.assertEqual(
+            list(EffectiveSubscription.objects.filter_not_subscribed(source_name, medium_name, [self.ind_e1])),
+            [self.ind_e1]
+        )
+
+    def test_unsubscribe_and_resubscribe(self):
+        G(Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        unsubscribe = G(Unsubscribe, entity=self.sub_e1, source=self.source_1, medium=self.medium_1)
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertUpToDate()
+        unsubscribe.delete()
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertUpToDate()
+
+    def test_subscription_deleted(self):
+        subscription = G(
+            Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct
+        )
+        subscription.delete()
+        self.assertFalse(EffectiveSubscription.objects.exists())
+
+    def test_subscription_edited(self):
+        subscription = G(
+            Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct
+        )
+        subscription.source = self.source_2
+        subscription.save()
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_2, self.medium_1, self.sub_e1))
+        self.assertUpToDate()
+
+    def test_relationship_changes(self):
+        G(Subscription, entity=self.super_e2, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        relationship = G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e2)
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        relationship.super_entity = self.super_e1
+        relationship.save()
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertUpToDate()
+
+    def test_synced_relationships(self):
+        G(Subscription, entity=self.super_e2, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        EntityRelationship.objects.bulk_create([
+            EntityRelationship(sub_entity=self.sub_e1, super_entity=self.super_e2),
+            EntityRelationship(sub_entity=self.ind_e1, super_entity=self.super_e2),
+        ])
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.ind_e1))
+        relationships_synced([self.sub_e1, self.ind_e1])
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.ind_e1))
+        self.assertUpToDate()
+
+    def test_mediums_subscribed(self):
+        G(Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_2, subentity_type=self.sub_ct)
+        G(Unsubscribe, entity=self.sub_e1, source=self.source_1, medium=self.medium_2)
+        mediums = EffectiveSubscription.objects.mediums_subscribed(self.source_1, self.sub_e1)
+        self.assertEqual(list(mediums), [self.medium_1])
+
+    def test_filter_not_subscribed(self):
+        G(Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Unsubscribe, entity=self.sub_e2, source=self.source_1, medium=self.medium_1)
+        entities = [self.sub_e1, self.sub_e2, self.ind_e1]
+        with self.assertNumQueries(1):
+            subscribed = list(EffectiveSubscription.objects.filter_not_subscribed(
+                self.source_1, self.medium_1, entities
+            ))
+        self.assertEqual(subscribed, [self.sub_e1])
+
+    def test_rebuild(self):
+        G(Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        with override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=False):
+            G(Subscription, entity=self.ind_e1, source=self.source_2, medium=self.medium_2, subentity_type=None)
+            G(Unsubscribe, entity=self.sub_e1, source=self.source_1, medium=self.medium_1)
+        missing, extra = EffectiveSubscription.objects.verify()
+        self.assertEqual(missing, set([(self.source_2.id, self.medium_2.id, self.ind_e1.id)]))
+        self.assertEqual(extra, set([(self.source_1.id, self.medium_1.id, self.sub_e1.id)]))
+        EffectiveSubscription.objects.rebuild()
+        self.assertUpToDate()
+
+    def test_bulk_writes(self):
+        Subscription.objects.bulk_subscribe([
+            Subscription(entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct),
+            Subscription(entity=self.ind_e1, source=self.source_2, medium=self.medium_2, subentity_type=None),
+        ])
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertUpToDate()
+        unsubscribes = [
+            Unsubscribe(entity=self.sub_e1, source=self.source_1, medium=self.medium_1),
+            Unsubscribe(entity=self.ind_e1, source=self.source_2, medium=self.medium_2),
+        ]
+        Unsubscribe.objects.bulk_unsubscribe(unsubscribes)
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertUpToDate()
+        Unsubscribe.objects.bulk_resubscribe(unsubscribes)
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertUpToDate()
+
+    @override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=False)
+    def test_bulk_writes_not_maintained_when_disabled(self):
+        Subscription.objects.bulk_subscribe([
+            Subscription(entity=self.ind_e1, source=self.source_1, medium=self.medium_1, subentity_type=None),
+        ])
+        self.assertFalse(EffectiveSubscription.objects.exists())
+
+    @override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=False)
+    def test_not_maintained_when_disabled(self):
+        G(Subscription, entity=self.ind_e1, source=self.source_1, medium=self.medium_1, subentity_type=None)
+        self.assertFalse(EffectiveSubscription.objects.exists())
+
+
+@override_settings(ENTITY_SUBSCRIPTION_CLOSURE=True)
+class EntityClosureTest(TestCase):
+    def setUp(self):
+        self.company_ct = G(ContentType)
+        self.team_ct = G(ContentType)
+        self.user_ct = G(ContentType)
+        self.company = G(Entity, entity_type=self.company_ct)
+        self.team = G(Entity, entity_type=self.team_ct)
+        self.user = G(Entity, entity_type=self.user_ct)
+        self.other_user = G(Entity, entity_type=self.user_ct)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        # Only direct relationships, so the company is two levels above the users
+        G(EntityRelationship, sub_entity=self.team, super_entity=self.company)
+        G(EntityRelationship, sub_entity=self.user, super_entity=self.team)
+
+    def closure(self):
+        return set(EntityClosure.objects.values_list('super_entity', 'sub_entity', 'sub_entity_type'))
+
+    def test_closure_maintained(self):
+        self.assertEqual(self.closure(), set([
+            (self.company.id, self.team.id, self.team_ct.id),
+            (self.team.id, self.user.id, self.user_ct.id),
+            (self.company.id, self.user.id, self.user_ct.id),
+        ]))
+
+    def test_deep_group_subscription(self):
+        G(Subscription, entity=self.company, source=self.source, medium=self.medium, subentity_type=self.user_ct)
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium, self.user))
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium, self.other_user))
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.source, self.user)), [self.medium])
+        with self.assertNumQueries(1):
+            self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium, self.team, self.user_ct))
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium, self.team, self.team_ct))
+        self.assertEqual(
+            list(Subscription.objects.mediums_subscribed(self.source, self.company, self.user_ct)), [self.medium]
+        )
+
+    def test_many_entity_methods_follow_closure(self):
+        G(Subscription, entity=self.company, source=self.source, medium=self.medium, subentity_type=self.user_ct)
+        users = [self.user, self.other_user]
+        self.assertEqual(
+            Subscription.objects.is_subscribed_many([
+                (self.source, self.medium, self.user),
+                (self.source, self.medium, self.other_user),
+                (self.source, self.medium, self.team, self.user_ct),
+                (self.source, self.medium, self.team, self.team_ct),
+            ]),
+            [True, False, True, False]
+        )
+        self.assertEqual(list(Subscription.objects.filter_not_subscribed(self.source, self.medium, users)), [self.user])
+        self.assertEqual(
+            Subscription.objects.subscription_matrix(users),
+            {self.user.id: {self.source.id: set([self.medium.id])}, self.other_user.id: {}}
+        )
+        self.assertEqual(list(Subscription.objects.subscribed_entity_ids(self.source, self.medium)), [self.user.id])
+        self.assertEqual(
+            list(Subscription.objects.subscribed_entity_ids(self.source, self.medium, [self.company])), [self.user.id]
+        )
+
+    @override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=True)
+    def test_effective_subscriptions_follow_closure(self):
+        G(Subscription, entity=self.company, source=self.source, medium=self.medium, subentity_type=self.user_ct)
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source, self.medium, self.user))
+        EntityRelationship.objects.get(sub_entity=self.team, super_entity=self.company).delete()
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.source, self.medium, self.user))
+        G(EntityRelationship, sub_entity=self.team, super_entity=self.company)
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source, self.medium, self.user))
+        self.assertEqual(EffectiveSubscription.objects.verify(), (set(), set()))
+
+    @override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=True)
+    def test_synced_relationships_refresh_effective_subscriptions_below(self):
+        G(Subscription, entity=self.company, source=self.source, medium=self.medium, subentity_type=self.user_ct)
+        EntityRelationship.objects.get(sub_entity=self.team, super_entity=self.company).delete()
+        EntityRelationship.objects.bulk_create([EntityRelationship(sub_entity=self.team, super_entity=self.company)])
+        self.assertFalse(EffectiveSubscription.objects.is_subscribed(self.source, self.medium, self.user))
+        relationships_synced([self.team])
+        self.assertTrue(EffectiveSubscription.objects.is_subscribed(self.source, self.medium, self.user))
+        self.assertEqual(EffectiveSubscription.objects.verify(), (set(), set()))
+
+    def test_relationship_deleted(self):
+        G(EntityRelationship, sub_entity=self.team, super_entity=self.other_user)
+        EntityRelationship.objects.get(sub_entity=self.team, super_entity=self.company).delete()
+        self.assertEqual(self.closure(), set([
+            (self.other_user.id, self.team.id, self.team_ct.id),
+            (self.team.id, self.user.id, self.user_ct.id),
+            (self.other_user.id, self.user.id, self.user_ct.id),
+        ]))
+
+    def test_relationship_edited(self):
+        relationship = EntityRelationship.objects.get(sub_entity=self.user)
+        relationship.sub_entity = self.other_user
+        relationship.save()
+        self.assertEqual(self.closure(), set([
+            (self.company.id, self.team.id, self.team_ct.id),
+            (self.team.id, self.other_user.id, self.user_ct.id),
+            (self.company.id, self.other_user.id, self.user_ct.id),
+        ]))
+
+    def test_synced_relationships(self):
+        G(Subscription, entity=self.company, source=self.source, medium=self.medium, subentity_type=self.user_ct)
+        # django-entity syncs relationships in bulk, without signals
+        EntityRelationship.objects.bulk_create([
+            EntityRelationship(sub_entity=self.other_user, super_entity=self.team)
+        ])
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium, self.other_user))
+        relationships_synced([self.other_user])
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium, self.other_user))
+        self.assertEqual(self.closure(), set([
+            (self.company.id, self.team.id, self.team_ct.id),
+            (self.team.id, self.user.id, self.user_ct.id),
+            (self.company.id, self.user.id, self.user_ct.id),
+            (self.team.id, self.other_user.id, self.user_ct.id),
+            (self.company.id, self.other_user.id, self.user_ct.id),
+        ]))
+
+    def test_every_relationship_synced(self):
+        EntityRelationship.objects.filter(sub_entity=self.team).delete()
+        EntityRelationship.objects.bulk_create([EntityRelationship(sub_entity=self.team, super_entity=self.company)])
+        relationships_synced()
+        self.assertEqual(len(self.closure()), 3)
+        # The company has no super-entity, so nothing is refreshed
+        with self.assertNumQueries(1):
+            relationships_synced([self.company])
+
+    def test_entity_type_changed(self):
+        self.user.entity_type = self.team_ct
+        self.user.save()
+        self.assertEqual(
+            set(EntityClosure.objects.filter(sub_entity=self.user).values_list('sub_entity_type', flat=True)),
+            set([self.team_ct.id])
+        )
+
+    def test_cycle(self):
+        G(EntityRelationship, sub_entity=self.company, super_entity=self.user)
+        self.assertEqual(len(self.closure()), 6)
+        self.assertFalse(EntityClosure.objects.filter(sub_entity=F('super_entity')).exists())
+
+    def test_rebuild(self):
+        with override_settings(ENTITY_SUBSCRIPTION_CLOSURE=False):
+            G(EntityRelationship, sub_entity=self.other_user, super_entity=self.team)
+            EntityRelationship.objects.get(sub_entity=self.team).delete()
+        EntityClosure.objects.rebuild()
+        self.assertEqual(self.closure(), set([
+            (self.team.id, self.user.id, self.user_ct.id),
+            (self.team.id, self.other_user.id, self.user_ct.id),
+        ]))
+
+    @override_settings(ENTITY_SUBSCRIPTION_CLOSURE=False)
+    def test_not_maintained_when_disabled(self):
+        EntityClosure.objects.all().delete()
+        relationship = G(EntityRelationship, sub_entity=self.other_user, super_entity=self.team)
+        relationship.save()
+        self.other_user.save()
+        self.assertFalse(EntityClosure.objects.exists())
+
+
+@override_settings(ENTITY_SUBSCRIPTION_CHANGEFEED=True, ENTITY_SUBSCRIPTION_CHANGEFEED_SETTLE_SECONDS=0)
+class SubscriptionChangeTest(TestCase):
+    def setUp(self):
+        self.ct = G(ContentType)
+        self.entity = G(Entity)
+        self.other_entity = G(Entity)
+        self.medium = G(Medium)
+        self.source = G(Source)
+
+    def changes(self, sequence=0, settle_seconds=None):
+        return [
+            (change.kind, change.deleted, change.entity_id)
+            for batch in SubscriptionChange.objects.changes_since(sequence, settle_seconds=settle_seconds)
+            for change in batch
+        ]
+
+    def test_subscription_saved_and_deleted(self):
+        subscription = G(
+            Subscription, entity=self.entity, source=self.source, medium=self.medium, subentity_type=self.ct
+        )
+        subscription_id = subscription.id
+        subscription.delete()
+        changes = list(SubscriptionChange.objects.all())
+        self.assertEqual(
+            [
+                (c.kind, c.deleted, c.row_id, c.entity_id, c.source_id, c.medium_id, c.subentity_type_id)
+                for c in changes
+            ],
+            [
+                ('subscription', False, subscription_id, self.entity.id, self.source.id, self.medium.id, self.ct.id),
+                ('subscription', True, subscription_id, self.entity.id, self.source.id, self.medium.id, self.ct.id),
+            ]
+        )
+
+    def test_unsubscribe_and_relationship(self):
+        G(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        relationship = G(EntityRelationship, sub_entity=self.entity, super_entity=self.other_entity)
+        relationship.delete()
+        self.assertEqual(self.changes(), [
+            ('unsubscribe', False, self.entity.id),
+            ('relationship', False, self.entity.id),
+            ('relationship', True, self.entity.id),
+        ])
+        self.assertEqual(SubscriptionChange.objects.last().super_entity_id, self.other_entity.id)
+
+    def test_synced_relationships(self):
+        EntityRelationship.objects.bulk_create([
+            EntityRelationship(sub_entity=self.entity, super_entity=self.other_entity)
+        ])
+        self.assertEqual(self.changes(), [])
+        relationships_synced([self.entity])
+        self.assertEqual(self.changes(), [('relationship', False, self.entity.id)])
+        self.assertEqual(SubscriptionChange.objects.get().super_entity_id, self.other_entity.id)
+
+    def test_bulk_changes(self):
+        Subscription.objects.bulk_subscribe([
+            N(Subscription, entity=entity, source=self.source, medium=self.medium, subentity_type=None)
+            for entity in [self.entity, self.other_entity]
+        ])
+        unsubscribe = N(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        Unsubscribe.objects.bulk_unsubscribe([unsubscribe])
+        Unsubscribe.objects.bulk_resubscribe([unsubscribe])
+        self.assertEqual(self.changes(), [
+            ('subscription', False, self.entity.id),
+            ('subscription', False, self.other_entity.id),
+            ('unsubscribe', False, self.entity.id),
+            ('unsubscribe', True, self.entity.id),
+        ])
+
+    def test_changes_since_in_batches(self):
+        for entity in [self.entity, self.other_entity, G(Entity)]:
+            G(Unsubscribe, entity=entity, source=self.source, medium=self.medium)
+        first_sequence = SubscriptionChange.objects.first().sequence
+        # The unsettled changes are looked up first, and the last, empty,
+        # batch is only known to be empty once queried
+        with self.assertNumQueries(4):
+            batches = list(SubscriptionChange.objects.changes_since(first_sequence, batch_size=1))
+        self.assertEqual([[change.entity_id for change in batch] for batch in batches], [
+            [self.other_entity.id], [Entity.objects.last().id],
+        ])
+        self.assertEqual(
+            [len(batch) for batch in SubscriptionChange.objects.changes_since(batch_size=2)], [2, 1]
+        )
+
+    def test_unsettled_changes_held_back(self):
+        for entity in [self.entity, self.other_entity, G(Entity)]:
+            G(Unsubscribe, entity=entity, source=self.source, medium=self.medium)
+        first, second, third = SubscriptionChange.objects.order_by('sequence')
+        now = timezone.now()
+        # The second change was written last, as by a transaction committing late
+        SubscriptionChange.objects.filter(sequence=first.sequence).update(created_at=now - timedelta(seconds=60))
+        SubscriptionChange.objects.filter(sequence=second.sequence).update(created_at=now - timedelta(seconds=5))
+        SubscriptionChange.objects.filter(sequence=third.sequence).update(created_at=now - timedelta(seconds=30))
+        self.assertEqual(self.changes(settle_seconds=10), [('unsubscribe', False, self.entity.id)])
+        self.assertEqual(self.changes(settle_seconds=1), [
+            ('unsubscribe', False, self.entity.id),
+            ('unsubscribe', False, self.other_entity.id),
+            ('unsubscribe', False, Entity.objects.last().id),
+        ])
+
+    def test_settle_seconds_setting(self):
+        G(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        with override_settings(ENTITY_SUBSCRIPTION_CHANGEFEED_SETTLE_SECONDS=60):
+            self.assertEqual(self.changes(), [])
+        with override_settings(ENTITY_SUBSCRIPTION_CHANGEFEED_SETTLE_SECONDS=None):
+            del settings.ENTITY_SUBSCRIPTION_CHANGEFEED_SETTLE_SECONDS
+            # Long enough for a bulk import in a transaction
+            SubscriptionChange.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+            self.assertEqual(self.changes(), [])
+            SubscriptionChange.objects.update(created_at=timezone.now() - timedelta(minutes=11))
+            self.assertEqual(self.changes(), [('unsubscribe', False, self.entity.id)])
+
+    def test_latest_sequence(self):
+        self.assertEqual(SubscriptionChange.objects.latest_sequence(), 0)
+        G(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        latest_sequence = SubscriptionChange.objects.latest_sequence()
+        self.assertEqual(latest_sequence, SubscriptionChange.objects.get().sequence)
+        self.assertEqual(self.changes(latest_sequence), [])
+
+    @override_settings(ENTITY_SUBSCRIPTION_CHANGEFEED=False)
+    def test_disabled(self):
+        G(Subscription, entity=self.entity, source=self.source, medium=self.medium, subentity_type=None)
+        Unsubscribe.objects.bulk_unsubscribe([
+            N(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        ])
+        self.assertFalse(SubscriptionChange.objects.exists())
@@ -0,0 +1,65 @@
+from multiprocessing.pool import ThreadPool
+
+from django.db import connections
+from django.test import TestCase
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship
+from mock import MagicMock, patch
+
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+from entity_subscription.parallel import parallel_subscribed_entity_ids
+from entity_subscription.tests.executor_tests import share_connection
+
+
+class ParallelSubscribedEntityIdsTest(TestCase):
+    def setUp(self):
+        self.medium = G(Medium)
+        self.source = G(Source)
+        self.group = G(Entity)
+        self.entities = [G(Entity) for i in range(7)]
+        for entity in self.entities[:4]:
+            G(EntityRelationship, sub_entity=entity, super_entity=self.group)
+        G(Subscription, entity=self.group, source=self.source, medium=self.medium,
+          subentity_type=self.entities[0].entity_type)
+        G(Subscription, entity=self.entities[5], source=self.source, medium=self.medium, subentity_type=None)
+        G(Unsubscribe, entity=self.entities[1], source=self.source, medium=self.medium)
+
+        connection = connections['default']
+        connection.allow_thread_sharing = True
+        self.addCleanup(setattr, connection, 'allow_thread_sharing', False)
+        # A single thread stands in for the worker processes, since it must share the test connection
+        self.pool = ThreadPool(1, share_connection, (connection,))
+        self.addCleanup(self.pool.terminate)
+
+    def expected_ids(self, entities):
+        return sorted(e.id for e in Subscription.objects.filter_not_subscribed(self.source, self.medium, entities))
+
+    def test_matches_filter_not_subscribed(self):
+        entity_ids = [e.id for e in self.entities]
+        subscribed = parallel_subscribed_entity_ids(
+            self.source, self.medium, iter(entity_ids), workers=2, chunk_size=3, pool=self.pool
+        )
+        self.assertEqual(list(subscribed), self.expected_ids(self.entities))
+
+    def test_deterministic_shard_order(self):
+        # Shards are yielded in the order they were taken, each in ascending order
+        entity_ids = [e.id for e in reversed(self.entities)]
+        subscribed = parallel_subscribed_entity_ids(
+            self.source.id, self.medium.id, entity_ids, workers=3, chunk_size=3, pool=self.pool
+        )
+        self.assertEqual(
+            list(subscribed),
+            self.expected_ids(self.entities[4:]) + self.expected_ids(self.entities[1:4]) +
+            self.expected_ids(self.entities[:1])
+        )
+
+    @patch('entity_subscription.parallel.connections')
+    @patch('entity_subscription.parallel.Pool')
+    def test_own_pool(self, pool_mock, connections_mock):
+        pool_mock.return_value = self.pool
+        connection_mock = MagicMock()
+        connections_mock.all.return_value = [connection_mock]
+        subscribed = parallel_subscribed_entity_ids(self.source, self.medium, [e.id for e in self.entities], workers=2)
+        self.assertEqual(list(subscribed), self.expected_ids(self.entities))
+        pool_mock.assert_called_once_with(2)
+        connection_mock.close.assert_called_once_with()
@@ -0,0 +1,125 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import router
+from django.test import TestCase
+from django.test.utils import override_settings
+from django_dynamic_fixture import G, N
+from entity.models import Entity, EntityRelationship
+from mock import patch
+
+from entity_subscription.cache import SharedSubscriptionCache, SubscriptionCache
+from entity_subscription.models import EffectiveSubscription, Medium, Source, Subscription, Unsubscribe
+from entity_subscription.routers import SubscriptionRouter, reading_from_primary, use_primary
+
+
+@override_settings(ENTITY_SUBSCRIPTION_READ_DATABASE='replica')
+class SubscriptionRouterTest(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.ct = G(ContentType)
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_type=self.ct)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.sub_e)
+        G(Subscription, entity=self.super_e, source=self.source, medium=self.medium, subentity_type=self.ct)
+        patcher = patch.object(router, 'routers', [SubscriptionRouter()])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_from_replica(self):
+        # Nothing is replicated between the test databases
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e))
+        self.assertEqual(list(Subscription.objects.filter_not_subscribed(self.source, self.medium, [self.sub_e])), [])
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.source, self.sub_e)), [])
+        self.assertFalse(Unsubscribe.objects.is_unsubscribed(self.source, self.medium, self.sub_e))
+
+    def test_use_primary(self):
+        with use_primary():
+            self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e))
+            self.assertEqual(list(Subscription.objects.mediums_subscribed(self.source, self.sub_e)), [self.medium])
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e))
+
+    def test_use_primary_nested(self):
+        with use_primary():
+            with use_primary():
+                self.assertTrue(reading_from_primary())
+            self.assertTrue(reading_from_primary())
+        self.assertFalse(reading_from_primary())
+
+    def test_writes_to_primary(self):
+        Unsubscribe.objects.create(entity=self.sub_e, source=self.source, medium=self.medium)
+        self.assertEqual(Unsubscribe.objects.using('default').count(), 1)
+        self.assertEqual(Unsubscribe.objects.count(), 0)
+
+    def test_read_objects_written_to_primary(self):
+        unsubscribe = G(Unsubscribe, entity=self.sub_e, source=self.source, medium=self.medium)
+        # Copy the rows to the replica, as replication would
+        unsubscribe.save(using='replica')
+        self.sub_e.save(using='replica')
+
+        read_unsubscribe = Unsubscribe.objects.get(pk=unsubscribe.pk)
+        self.assertEqual(read_unsubscribe._state.db, 'replica')
+        read_unsubscribe.save()
+        read_unsubscribe.delete()
+        self.assertEqual(Unsubscribe.objects.using('default').count(), 0)
+        self.assertEqual(Unsubscribe.objects.using('replica').count(), 1)
+
+        read_entity = Entity.objects.get(pk=self.sub_e.pk)
+        self.assertEqual(read_entity._state.db, 'replica')
+        Unsubscribe(entity=read_entity, source=self.source, medium=self.medium).save()
+        self.assertEqual(Unsubscribe.objects.using('default').count(), 1)
+
+        primary_subscription = Subscription.objects.using('default').get()
+        primary_subscription.entity = read_entity
+        primary_subscription.save()
+        self.assertEqual(Subscription.objects.using('default').get().entity_id, self.sub_e.id)
+
+    def test_other_apps_not_routed_for_writes(self):
+        self.assertIsNone(SubscriptionRouter().db_for_write(ContentType))
+        self.assertIsNone(SubscriptionRouter().allow_relation(self.ct, self.sub_e))
+
+    @override_settings(ENTITY_SUBSCRIPTION_PRIMARY_DATABASE='replica', ENTITY_SUBSCRIPTION_READ_DATABASE='default')
+    def test_primary_database_setting(self):
+        self.assertEqual(SubscriptionRouter().db_for_write(Unsubscribe), 'replica')
+        self.assertEqual(SubscriptionRouter().db_for_read(Unsubscribe), 'default')
+        with use_primary():
+            self.assertEqual(SubscriptionRouter().db_for_read(Unsubscribe), 'replica')
+
+        # Reads inside use_primary see the writes just made
+        self.sub_e.save(using='replica')
+        self.source.save(using='replica')
+        self.medium.save(using='replica')
+        Unsubscribe.objects.create(entity=self.sub_e, source=self.source, medium=self.medium)
+        self.assertFalse(Unsubscribe.objects.is_unsubscribed(self.source, self.medium, self.sub_e))
+        with use_primary():
+            self.assertTrue(Unsubscribe.objects.is_unsubscribed(self.source, self.medium, self.sub_e))
+
+    def test_cache_misses_read_primary(self):
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e))
+        shared_cache = SharedSubscriptionCache('django.core.cache.backends.locmem.LocMemCache')
+        shared_cache.cache.clear()
+        for cache in [SubscriptionCache(), shared_cache]:
+            self.assertTrue(cache.is_subscribed(self.source, self.medium, self.sub_e))
+            self.assertEqual(cache.mediums_subscribed(self.source, self.sub_e), [self.medium])
+            self.assertFalse(reading_from_primary())
+
+    def test_bulk_writes_read_primary(self):
+        G(Unsubscribe, entity=self.sub_e, source=self.source, medium=self.medium)
+        unsubscribe = N(Unsubscribe, entity=self.sub_e, source=self.source, medium=self.medium)
+        self.assertEqual(Unsubscribe.objects.bulk_unsubscribe([unsubscribe]), [])
+        self.assertEqual(len(Unsubscribe.objects.bulk_resubscribe([unsubscribe])), 1)
+
+    @override_settings(ENTITY_SUBSCRIPTION_MATERIALIZE=True)
+    def test_maintenance_reads_primary(self):
+        G(Subscription, entity=self.sub_e, source=self.source, medium=self.medium, subentity_type=None)
+        self.assertEqual(
+            list(EffectiveSubscription.objects.using('default').values_list('entity', flat=True)), [self.sub_e.id]
+        )
+
+    def test_other_apps_not_routed(self):
+        self.assertIsNone(SubscriptionRouter().db_for_read(ContentType))
+
+    @override_settings(ENTITY_SUBSCRIPTION_READ_DATABASE=None)
+    def test_no_read_database(self):
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e))
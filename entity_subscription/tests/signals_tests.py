@@ -0,0 +1,136 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from django_dynamic_fixture import G
+from entity.models import Entity
+from mock import MagicMock
+
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+from entity_subscription.signals import manager_method_called
+
+
+class ManagerMethodCalledTest(TestCase):
+    def setUp(self):
+        self.medium = G(Medium)
+        self.other_medium = G(Medium)
+        self.source = G(Source)
+        self.entity = G(Entity)
+        self.other_entity = G(Entity, entity_type=self.entity.entity_type)
+        G(Subscription, entity=self.entity, source=self.source, medium=self.medium, subentity_type=None)
+        self.receiver = MagicMock()
+        manager_method_called.connect(self.receiver)
+
+    def tearDown(self):
+        manager_method_called.disconnect(self.receiver)
+
+    def call_kwargs(self):
+        kwargs = self.receiver.call_args[1]
+        self.assertGreaterEqual(kwargs.pop('duration'), 0)
+        kwargs.pop('signal')
+        return kwargs
+
+    def test_is_subscribed(self):
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium, self.entity))
+        self.assertEqual(self.call_kwargs(), {
+            'sender': Subscription,
+            'method': 'is_subscribed',
+            'source': self.source,
+            'medium': self.medium,
+            'queries': 1,
+            'cardinality': None,
+        })
+
+    def test_keyword_arguments(self):
+        Subscription.objects.is_subscribed(medium=self.medium, source=self.source, entity=self.entity)
+        kwargs = self.call_kwargs()
+        self.assertEqual((kwargs['source'], kwargs['medium']), (self.source, self.medium))
+
+    def test_mediums_subscribed_measured_when_evaluated(self):
+        mediums = Subscription.objects.mediums_subscribed(self.source, self.entity)
+        self.assertFalse(self.receiver.called)
+        self.assertEqual(list(mediums), [self.medium])
+        kwargs = self.call_kwargs()
+        self.assertEqual((kwargs['method'], kwargs['medium'], kwargs['queries'], kwargs['cardinality']), (
+            'mediums_subscribed', None, 1, 1
+        ))
+        # The result is cached on the queryset, so it is reported once
+        list(mediums)
+        self.assertEqual(self.receiver.call_count, 1)
+
+    def test_filter_not_subscribed_measured_when_evaluated(self):
+        entities = Subscription.objects.filter_not_subscribed(
+            self.source, self.medium, [self.entity, self.other_entity]
+        )
+        self.assertEqual(list(entities), [self.entity])
+        kwargs = self.call_kwargs()
+        self.assertEqual((kwargs['queries'], kwargs['cardinality']), (1, 1))
+
+    def test_subscribed_entity_ids_streamed(self):
+        entity_ids = Subscription.objects.subscribed_entity_ids(self.source, self.medium)
+        self.assertEqual(list(entity_ids.iterator()), [self.entity.id])
+        self.assertEqual(list(entity_ids.iterator()), [self.entity.id])
+        self.assertEqual(self.receiver.call_count, 2)
+        kwargs = self.call_kwargs()
+        self.assertEqual((kwargs['queries'], kwargs['cardinality']), (1, 1))
+
+    def test_derived_queryset_not_measured(self):
+        mediums = Subscription.objects.mediums_subscribed(self.source, self.entity)
+        self.assertEqual(list(mediums.filter(id=self.medium.id)), [self.medium])
+        self.assertFalse(self.receiver.called)
+
+    def test_iter_subscribed_entity_ids_measured_when_consumed(self):
+        G(Subscription, entity=self.other_entity, source=self.source, medium=self.medium, subentity_type=None)
+        chunks = Subscription.objects.iter_subscribed_entity_ids(self.source, self.medium, chunk_size=1)
+        self.assertEqual(list(chunks), [[self.entity.id], [self.other_entity.id]])
+        kwargs = self.call_kwargs()
+        self.assertEqual((kwargs['method'], kwargs['queries'], kwargs['cardinality']), (
+            'iter_subscribed_entity_ids', 3, 2
+        ))
+
+    def test_bulk_writes(self):
+        unsubscribes = [Unsubscribe(entity=self.entity, source=self.source, medium=self.medium)]
+        Unsubscribe.objects.bulk_unsubscribe(unsubscribes)
+        kwargs = self.call_kwargs()
+        self.assertEqual((kwargs['method'], kwargs['queries'], kwargs['cardinality']), ('bulk_unsubscribe', 2, 1))
+        Unsubscribe.objects.collapse()
+        kwargs = self.call_kwargs()
+        self.assertEqual((kwargs['method'], kwargs['cardinality']), ('collapse', None))
+
+    def test_filter_not_subscribed_mediums(self):
+        Subscription.objects.filter_not_subscribed_mediums(
+            self.source, [self.medium, self.other_medium], [self.entity]
+        )
+        kwargs = self.call_kwargs()
+        self.assertEqual(kwargs['medium'], [self.medium, self.other_medium])
+        self.assertEqual(kwargs['queries'], 3)
+        self.assertEqual(kwargs['cardinality'], 2)
+
+    def test_is_unsubscribed(self):
+        Unsubscribe.objects.is_unsubscribed(self.source, self.medium, self.entity)
+        kwargs = self.call_kwargs()
+        self.assertEqual((kwargs['sender'], kwargs['method'], kwargs['queries']), (Unsubscribe, 'is_unsubscribed', 1))
+
+    def test_sender_filter(self):
+        receiver = MagicMock()
+        manager_method_called.connect(receiver, sender=Unsubscribe)
+        self.addCleanup(manager_method_called.disconnect, receiver, sender=Unsubscribe)
+        Subscription.objects.is_subscribed(self.source, self.medium, self.entity)
+        self.assertFalse(receiver.called)
+
+    def test_captured_queries_not_kept(self):
+        num_queries = len(connection.queries)
+        Subscription.objects.is_subscribed(self.source, self.medium, self.entity)
+        self.assertEqual(len(connection.queries), num_queries)
+
+    @override_settings(DEBUG=True)
+    def test_captured_queries_kept_when_debugging(self):
+        num_queries = len(connection.queries)
+        Subscription.objects.is_subscribed(self.source, self.medium, self.entity)
+        self.assertEqual(len(connection.queries), num_queries + 1)
+
+
+class ManagerMethodNotCalledTest(TestCase):
+    def test_no_receivers(self):
+        source, medium, entity = G(Source), G(Medium), G(Entity)
+        with self.assertNumQueries(1):
+            self.assertFalse(Unsubscribe.objects.is_unsubscribed(source, medium, entity))
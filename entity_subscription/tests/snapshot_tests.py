@@ -0,0 +1,240 @@
+import os
+import shutil
+import stat
+import tempfile
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.test.utils import override_settings
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship
+from mock import patch
+
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+from entity_subscription.snapshot import MappedSubscriptionSnapshot, SubscriptionSnapshot, write_snapshot_file
+
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        self.super_ct = G(ContentType)
+        self.sub_ct = G(ContentType)
+        self.super_e1 = G(Entity, entity_type=self.super_ct)
+        self.super_e2 = G(Entity, entity_type=self.super_ct)
+        self.sub_e1 = G(Entity, entity_type=self.sub_ct)
+        self.sub_e2 = G(Entity, entity_type=self.sub_ct)
+        self.sub_e3 = G(Entity, entity_type=self.sub_ct)
+        self.ind_e = G(Entity, entity_type=self.sub_ct)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e2)
+        G(EntityRelationship, sub_entity=self.sub_e3, super_entity=self.super_e2)
+        G(EntityRelationship, sub_entity=self.super_e2, super_entity=self.super_e1)
+        G(Subscription, entity=self.super_e1, source=self.source_1, medium=self.medium_1, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.super_e2, source=self.source_1, medium=self.medium_2, subentity_type=self.sub_ct)
+        G(Subscription, entity=self.super_e1, source=self.source_2, medium=self.medium_2, subentity_type=self.super_ct)
+        G(Subscription, entity=self.ind_e, source=self.source_2, medium=self.medium_1, subentity_type=None)
+        G(Subscription, entity=self.sub_e3, source=self.source_1, medium=self.medium_1, subentity_type=None)
+        G(Unsubscribe, entity=self.sub_e2, source=self.source_1, medium=self.medium_1)
+        G(Unsubscribe, entity=self.ind_e, source=self.source_2, medium=self.medium_2)
+        self.entities = [self.super_e1, self.super_e2, self.sub_e1, self.sub_e2, self.sub_e3, self.ind_e]
+        self.sources = [self.source_1, self.source_2]
+        self.mediums = [self.medium_1, self.medium_2]
+
+
+class SubscriptionSnapshotTest(SnapshotTestCase):
+    def test_load_queries(self):
+        with self.assertNumQueries(4):
+            SubscriptionSnapshot.load()
+
+    def test_is_subscribed_matches_manager(self):
+        snapshot = SubscriptionSnapshot.load()
+        for source in self.sources:
+            for medium in self.mediums:
+                for entity in self.entities:
+                    for subentity_type in [None, self.sub_ct, self.super_ct]:
+                        self.assertEqual(
+                            snapshot.is_subscribed(source, medium, entity, subentity_type),
+                            Subscription.objects.is_subscribed(source, medium, entity, subentity_type),
+                        )
+
+    def test_mediums_subscribed_matches_manager(self):
+        snapshot = SubscriptionSnapshot.load()
+        for source in self.sources:
+            for entity in self.entities:
+                for subentity_type in [None, self.sub_ct]:
+                    self.assertEqual(
+                        snapshot.mediums_subscribed(source, entity, subentity_type),
+                        set(m.id for m in Subscription.objects.mediums_subscribed(source, entity, subentity_type)),
+                    )
+
+    def test_filter_not_subscribed_matches_manager(self):
+        snapshot = SubscriptionSnapshot.load()
+        for source in self.sources:
+            for medium in self.mediums:
+                self.assertEqual(
+                    set(snapshot.filter_not_subscribed(source, medium, self.entities)),
+                    set(e.id for e in Subscription.objects.filter_not_subscribed(source, medium, self.entities)),
+                )
+
+    def test_subscribed_entity_ids_matches_manager(self):
+        snapshot = SubscriptionSnapshot.load()
+        for source in self.sources:
+            for medium in self.mediums:
+                self.assertEqual(
+                    snapshot.subscribed_entity_ids(source, medium),
+                    set(Subscription.objects.subscribed_entity_ids(source, medium)),
+                )
+
+    def test_wildcard_unsubscribes_match_manager(self):
+        G(Unsubscribe, entity=self.sub_e1, source=self.source_1, medium=None)
+        G(Unsubscribe, entity=self.ind_e, source=None, medium=self.medium_1)
+        snapshot = SubscriptionSnapshot.load()
+        for source in self.sources:
+            for medium in self.mediums:
+                self.assertEqual(
+                    snapshot.subscribed_entity_ids(source, medium),
+                    set(Subscription.objects.subscribed_entity_ids(source, medium)),
+                )
+                for entity in self.entities:
+                    self.assertEqual(
+                        snapshot.is_subscribed(source, medium, entity),
+                        Subscription.objects.is_subscribed(source, medium, entity),
+                    )
+
+    def test_ids_accepted(self):
+        snapshot = SubscriptionSnapshot.load()
+        with self.assertNumQueries(0):
+            self.assertTrue(snapshot.is_subscribed(self.source_1.id, self.medium_1.id, self.sub_e1.id))
+            self.assertEqual(
+                snapshot.filter_not_subscribed(self.source_1.id, self.medium_1.id, [self.sub_e3.id, self.sub_e2.id]),
+                [self.sub_e3.id]
+            )
+
+    def test_unknown_ids(self):
+        snapshot = SubscriptionSnapshot.load()
+        self.assertFalse(snapshot.is_subscribed(G(Source), self.medium_1, G(Entity)))
+        self.assertEqual(snapshot.mediums_subscribed(G(Source), self.sub_e1), set())
+
+
+@override_settings(ENTITY_SUBSCRIPTION_CLOSURE=True)
+class ClosureSubscriptionSnapshotTest(SubscriptionSnapshotTest):
+    def setUp(self):
+        super(ClosureSubscriptionSnapshotTest, self).setUp()
+        # Two levels below the group subscription of super_e1
+        self.deep_e = G(Entity, entity_type=self.sub_ct)
+        G(EntityRelationship, sub_entity=self.deep_e, super_entity=self.super_e2)
+        self.entities.append(self.deep_e)
+
+    def test_deep_group_subscription(self):
+        snapshot = SubscriptionSnapshot.load()
+        self.assertTrue(Subscription.objects.is_subscribed(self.source_1, self.medium_1, self.deep_e))
+        self.assertTrue(snapshot.is_subscribed(self.source_1, self.medium_1, self.deep_e))
+        self.assertIn(self.deep_e.id, snapshot.filter_not_subscribed(self.source_1, self.medium_1, [self.deep_e]))
+        self.assertIn(self.deep_e.id, snapshot.subscribed_entity_ids(self.source_1, self.medium_1))
+
+
+class MappedSubscriptionSnapshotTest(SnapshotTestCase):
+    def setUp(self):
+        super(MappedSubscriptionSnapshotTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'subscriptions.snapshot')
+
+    def write_and_map(self):
+        write_snapshot_file(self.path)
+        snapshot = MappedSubscriptionSnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_write_queries(self):
+        with self.assertNumQueries(7):
+            self.assertEqual(write_snapshot_file(self.path), 6)
+        self.assertEqual(os.listdir(self.directory), ['subscriptions.snapshot'])
+
+    def test_is_subscribed_matches_manager(self):
+        snapshot = self.write_and_map()
+        for source in self.sources:
+            for medium in self.mediums:
+                for entity in self.entities:
+                    self.assertEqual(
+                        snapshot.is_subscribed(source, medium, entity),
+                        Subscription.objects.is_subscribed(source, medium, entity),
+                    )
+
+    def test_wildcard_unsubscribes(self):
+        G(Unsubscribe, entity=self.sub_e3, source=None, medium=None)
+        snapshot = self.write_and_map()
+        self.assertEqual(len(snapshot), 4)
+        self.assertFalse(snapshot.is_subscribed(self.source_1, self.medium_1, self.sub_e3))
+
+    def test_mediums_subscribed_matches_manager(self):
+        snapshot = self.write_and_map()
+        for source in self.sources + [G(Source)]:
+            for entity in self.entities:
+                self.assertEqual(
+                    snapshot.mediums_subscribed(source, entity),
+                    set(m.id for m in Subscription.objects.mediums_subscribed(source, entity)),
+                )
+
+    def test_audiences_match_manager(self):
+        snapshot = self.write_and_map()
+        with self.assertNumQueries(0):
+            audiences = [
+                list(snapshot.subscribed_entity_ids(source, medium))
+                for source in self.sources for medium in self.mediums
+            ]
+        self.assertEqual(audiences, [
+            sorted(Subscription.objects.subscribed_entity_ids(source, medium))
+            for source in self.sources for medium in self.mediums
+        ])
+        self.assertEqual(
+            snapshot.filter_not_subscribed(self.source_1.id, self.medium_1.id, [self.sub_e3.id, self.sub_e2.id]),
+            [self.sub_e3.id]
+        )
+
+    def test_rewritten_atomically(self):
+        with self.write_and_map() as snapshot:
+            G(Unsubscribe, entity=self.sub_e3, source=self.source_1, medium=self.medium_1)
+            write_snapshot_file(self.path)
+            self.assertTrue(snapshot.is_subscribed(self.source_1, self.medium_1, self.sub_e3))
+            with MappedSubscriptionSnapshot(self.path) as new_snapshot:
+                self.assertEqual(len(new_snapshot), len(snapshot) - 1)
+                self.assertFalse(new_snapshot.is_subscribed(self.source_1, self.medium_1, self.sub_e3))
+
+    def test_readable_by_other_users(self):
+        write_snapshot_file(self.path)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o644)
+        write_snapshot_file(self.path, mode=0o640)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o640)
+
+    def test_directory_synced(self):
+        with patch('entity_subscription.snapshot.os.fsync', wraps=os.fsync) as fsync:
+            with patch('entity_subscription.snapshot.os.open', wraps=os.open) as open_mock:
+                write_snapshot_file(self.path)
+        open_mock.assert_any_call(self.directory, os.O_RDONLY)
+        self.assertEqual(fsync.call_count, 2)
+
+    def test_failed_write_keeps_file(self):
+        write_snapshot_file(self.path)
+        with patch.object(Subscription.objects, '_subscribed_triples', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                write_snapshot_file(self.path)
+        self.assertEqual(os.listdir(self.directory), ['subscriptions.snapshot'])
+        with MappedSubscriptionSnapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 6)
+
+    def test_not_a_snapshot_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'ESSNAP')
+        with self.assertRaises(ValueError):
+            MappedSubscriptionSnapshot(self.path)
+
+    def test_other_version(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'ESSNAP\x02\x00' + b'\x00' * 8)
+        with self.assertRaises(ValueError):
+            MappedSubscriptionSnapshot(self.path)
@@ -37,6 +37,8 @@ def configure_settings():
         settings.configure(
             DATABASES={
                 'default': db_config,
+                # A second database, to test routing reads away from the default one
+                'replica': dict(db_config, NAME=db_config['NAME'] + '_replica'),
             },
             INSTALLED_APPS=(
                 'django.contrib.auth',